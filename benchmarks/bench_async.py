@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Sync Flask app against the asyncio ASGI app under load
+
+Serves the app with one gunicorn worker against the stub CanDIG, see
+`loadtest.py`, once as `mesi_search.main:APP` with the `gthread` worker
+(8 threads) and once as `mesi_search.asgi:APP` with the uvicorn worker.
+Then keeps `concurrency` discovery requests in flight against each of them
+and reports throughput and latency. The count cache is off so every
+request waits on the stub, and the rate limit is off.
+
+Needs gunicorn, aiohttp and uvicorn.
+
+`python benchmarks/bench_async.py [datasets] [latency ms] [requests]`
+"""
+import asyncio
+import sys
+
+from loadtest import mint_tokens, run_load, start_app, start_upstream, stop, summary
+
+CONCURRENCY = [8, 64, 256]
+SERVERS = [
+    ("sync gthread x8", ["-w", "1", "-k", "gthread", "--threads", "8"], "mesi_search.main:APP"),
+    ("async uvicorn", ["-w", "1", "-k", "uvicorn.workers.UvicornWorker"],
+     "mesi_search.asgi:APP"),
+]
+
+
+def main(datasets=20, latency_ms=50, requests=1000):
+    upstream, upstream_url = start_upstream(["--datasets", str(datasets),
+                                             "--latency", str(latency_ms)])
+    tokens = mint_tokens(1)
+    print("{} datasets, {} ms upstream latency, {} requests per run".format(
+        datasets, latency_ms, requests))
+    print("{:<18} {:>12} {:>10} {:>10} {:>10} {:>8}".format(
+        "server", "concurrency", "req/s", "p50 ms", "p99 ms", "errors"))
+    try:
+        for name, gunicorn_args, app in SERVERS:
+            process, url = start_app(app, upstream_url, gunicorn_args, {"SESSION_TYPE": "cookie"})
+            try:
+                for concurrency in CONCURRENCY:
+                    # warm up the dataset catalogue and the connection pools
+                    asyncio.run(run_load(url, tokens, concurrency, requests=concurrency))
+                    row = summary(asyncio.run(run_load(url, tokens, concurrency,
+                                                       requests=requests)))
+                    print("{:<18} {:>12} {:>10.1f} {:>10.1f} {:>10.1f} {:>8}".format(
+                        name, concurrency, row["req/s"], row["p50 ms"], row["p99 ms"],
+                        row["errors"]))
+            finally:
+                stop(process)
+    finally:
+        stop(upstream)
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:4]])
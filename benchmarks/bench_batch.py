@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Separate discovery requests against one batch request
+
+Sends the attribute sets of `bench_count_query.ATTRIBUTE_SETS` to the
+stub CanDIG of `stub_upstream.py`, once as one `/api/candig/patient` call
+per set and once as a single `/api/candig/patient/batch` call. The count
+cache is off and the dataset catalogue is warm, so only the `/count`
+fan-out is compared.
+
+`python benchmarks/bench_batch.py [datasets] [latency ms]`
+"""
+import json
+import sys
+import time
+from unittest import mock
+
+import jwt
+from bench_count_query import ATTRIBUTE_SETS
+from mesi_search import candig
+from mesi_search.main import APP, limiter
+from stub_upstream import StubUpstream
+
+
+def post(client, path, headers, data):
+    response = client.post(path, headers=headers, content_type="application/json",
+                           data=json.dumps(data))
+    assert response.status_code == 200, response.data
+
+
+def main(datasets=20, latency_ms=50):
+    upstream = StubUpstream(datasets=datasets, latency=latency_ms / 1000).start()
+    token = jwt.encode({"sub": "bench", "iat": int(time.time())}, "bench")
+    headers = {"Authorization": "Bearer {}".format(
+        token.decode("utf-8") if isinstance(token, bytes) else token)}
+    runs = [
+        ("{} separate requests".format(len(ATTRIBUTE_SETS)), lambda client: [
+            post(client, "/api/candig/patient", headers, {"attributesOfInterest": attributes})
+            for attributes in ATTRIBUTE_SETS]),
+        ("1 batch request", lambda client: post(
+            client, "/api/candig/patient/batch", headers,
+            {"queries": [{"attributesOfInterest": attributes} for attributes in ATTRIBUTE_SETS]})),
+    ]
+    print("{} datasets, {} ms upstream latency".format(datasets, latency_ms))
+    print("{:<24} {:>10} {:>14}".format("", "ms", "/count calls"))
+    with mock.patch.object(candig.UPSTREAM, "base_url", upstream.url), \
+            mock.patch.object(candig.COUNT_CACHE, "ttl", 0), \
+            mock.patch.object(limiter, "enabled", False), \
+            APP.test_client() as client:
+        candig.CATALOGUE.invalidate()
+        candig.datasets()
+        for name, run in runs:
+            upstream.calls.clear()
+            started = time.monotonic()
+            run(client)
+            elapsed = time.monotonic() - started
+            print("{:<24} {:>10.1f} {:>14}".format(name, elapsed * 1000,
+                                                   upstream.calls.get("/count", 0)))
+    upstream.shutdown()
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""CanDIG calls of a burst of identical discovery requests, with and without
+single-flight
+
+`users` threads ask for the counts of the same attributes at the same
+moment, against the stub CanDIG of `stub_upstream.py`, with the count cache
+off. Once every request fetches on its own, once concurrent identical
+`/count` calls are coalesced by `candig.FLIGHTS`.
+
+`python benchmarks/bench_coalescing.py [users] [datasets] [latency ms]`
+"""
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from mesi_search import candig
+from mesi_search.cache import SingleFlight
+from stub_upstream import StubUpstream
+
+ATTRIBUTES = ["gender", "causeOfDeath"]
+
+
+class NoFlight(SingleFlight):
+    def do(self, key, function):
+        return function(), False
+
+
+def burst(users, dataset_ids):
+    start = threading.Barrier(users)
+
+    def discover():
+        start.wait()
+        return candig.raw_results(dataset_ids, fields=ATTRIBUTES)
+
+    with ThreadPoolExecutor(max_workers=users) as pool:
+        return [f.result() for f in [pool.submit(discover) for _ in range(users)]]
+
+
+def main(users=50, datasets=20, latency_ms=50):
+    upstream = StubUpstream(datasets=datasets, latency=latency_ms / 1000).start()
+    print("{} concurrent requests, {} datasets, {} ms upstream latency".format(
+        users, datasets, latency_ms))
+    print("{:<16} {:>10} {:>14} {:>12}".format("", "ms", "/count calls", "coalesced"))
+    with mock.patch.object(candig.UPSTREAM, "base_url", upstream.url), \
+            mock.patch.object(candig.UPSTREAM, "pool_size", users * 8), \
+            mock.patch.object(candig.COUNT_CACHE, "ttl", 0):
+        dataset_ids = candig.fetch_datasets()
+        for name, flights in (("no single-flight", NoFlight()), ("single-flight", SingleFlight())):
+            with mock.patch.object(candig, "FLIGHTS", flights):
+                upstream.calls.clear()
+                started = time.monotonic()
+                results = burst(users, dataset_ids)
+                elapsed = time.monotonic() - started
+            assert all(len(result) == datasets for result in results)
+            print("{:<16} {:>10.1f} {:>14} {:>12}".format(
+                name, elapsed * 1000, upstream.calls.get("/count", 0),
+                flights.stats()["coalesced"]))
+    upstream.shutdown()
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:4]])
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Polling the discovery endpoint, with and without conditional requests
+
+A client asks for the same attributes of interest over and over, like a
+dashboard that polls. Times a request and reports its response body when
+every request makes a new result (`SESSION_RESULT_TTL=0`), when the
+result released to the session is sent again, and when the client sends
+its ETag back in `If-None-Match` and gets a `304 Not Modified`. The counts
+come from the stub CanDIG of `stub_upstream.py` and are cached, so the
+new results only pay for filtering, noising and serializing.
+
+`python benchmarks/bench_conditional.py [datasets] [requests]`
+"""
+import json
+import sys
+import time
+from unittest import mock
+
+import jwt
+from mesi_search import candig
+from mesi_search.main import APP, limiter
+from stub_upstream import StubUpstream
+
+ATTRIBUTES = ["gender", "ethnicity", "causeOfDeath", "provinceOfResidence"]
+
+
+def poll(client, headers, requests):
+    """Seconds per request and body bytes of the last response"""
+    data = json.dumps({"attributesOfInterest": ATTRIBUTES})
+    response = client.post("/api/candig/patient", headers=headers,
+                           content_type="application/json", data=data)
+    headers = dict(headers)
+    if "If-None-Match" in headers:
+        headers["If-None-Match"] = response.headers["ETag"]
+    started = time.perf_counter()
+    for _ in range(requests):
+        response = client.post("/api/candig/patient", headers=headers,
+                               content_type="application/json", data=data)
+    elapsed = time.perf_counter() - started
+    assert response.status_code in (200, 304), response.data
+    return elapsed / requests, len(response.data), response.status_code
+
+
+def main(datasets=100, requests=200):
+    upstream = StubUpstream(datasets=datasets, latency=0).start()
+    token = jwt.encode({"sub": "bench", "iat": int(time.time())}, "bench")
+    headers = {"Authorization": "Bearer {}".format(
+        token.decode("utf-8") if isinstance(token, bytes) else token)}
+    runs = [
+        ("new result", 0, headers),
+        ("released result", 300, headers),
+        ("If-None-Match", 300, dict(headers, **{"If-None-Match": ""})),
+    ]
+    print("{} datasets, {} attributes, {} requests".format(datasets, len(ATTRIBUTES), requests))
+    print("{:<18} {:>8} {:>12} {:>12}".format("", "status", "ms/request", "body bytes"))
+    with mock.patch.object(candig.UPSTREAM, "base_url", upstream.url), \
+            mock.patch.object(limiter, "enabled", False), \
+            mock.patch.dict(APP.config, SESSION_RESULT_MAX_BYTES=64 * 1024 * 1024):
+        candig.CATALOGUE.invalidate()
+        candig.datasets()
+        for name, ttl, run_headers in runs:
+            with mock.patch.dict(APP.config, SESSION_RESULT_TTL=ttl), \
+                    APP.test_client() as client:
+                seconds, size, status = poll(client, run_headers, requests)
+            print("{:<18} {:>8} {:>12.2f} {:>12}".format(name, status, seconds * 1000, size))
+    upstream.shutdown()
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Response size of projected `/count` queries
+
+Compares a synthetic CanDIG `/count` response for all patient fields
+(what `prepare_count_query` used to ask for) with responses that only hold
+the attributes of interest: size on the wire, parse time and parse memory.
+
+`python benchmarks/bench_count_query.py [patients]`
+"""
+import datetime
+import json
+import random
+import sys
+import timeit
+import tracemalloc
+
+from mesi_search.candig import PATIENT_FIELDS
+
+ATTRIBUTE_SETS = [
+    ["gender"],
+    ["gender", "causeOfDeath"],
+    ["gender", "ethnicity", "race", "provinceOfResidence", "causeOfDeath",
+     "occupationalOrEnvironmentalExposure"],
+]
+CARDINALITY = {
+    "gender": 3,
+    "ethnicity": 8,
+    "race": 8,
+    "provinceOfResidence": 13,
+    "causeOfDeath": 21,
+    "occupationalOrEnvironmentalExposure": 28,
+}
+
+
+def synthetic_counts(patients, rnd):
+    """A `/count` response for `patients` patients with every patient field"""
+    start = datetime.date(1930, 1, 1)
+    counts = {}
+    for field in PATIENT_FIELDS:
+        if field.startswith("date"):  # one category per distinct date
+            values = [str(start + datetime.timedelta(days=rnd.randrange(30000)))
+                      for _ in range(patients)]
+        elif field in CARDINALITY:
+            values = ["{} {}".format(field, rnd.randrange(CARDINALITY[field]))
+                      for _ in range(patients)]
+        else:
+            values = ["n/a"] * patients
+        field_counts = {}
+        for value in values:
+            field_counts[value] = field_counts.get(value, 0) + 1
+        counts[field] = field_counts
+    return {"status": {"Known peers": 1, "Queried peers": 1,
+                       "Successful communications": 1, "Valid response": True},
+            "results": {"patients": [counts]}}
+
+
+def measure(payload):
+    body = json.dumps(payload).encode("utf-8")
+    seconds = min(timeit.repeat(lambda: json.loads(body), number=20, repeat=5)) / 20
+    tracemalloc.start()
+    json.loads(body)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(body), seconds, peak
+
+
+def main(patients=2000):
+    full = synthetic_counts(patients, random.Random(42))
+    full_size, full_seconds, full_peak = measure(full)
+    print("{:<50} {:>10} {:>10} {:>10}".format("fields", "bytes", "parse ms", "parse KiB"))
+    print("{:<50} {:>10} {:>10.3f} {:>10.1f}".format(
+        "all {} fields".format(len(PATIENT_FIELDS)), full_size, full_seconds * 1000,
+        full_peak / 1024))
+    for attributes in ATTRIBUTE_SETS:
+        projected = dict(full, results={"patients": [
+            {k: v for k, v in full["results"]["patients"][0].items() if k in attributes}]})
+        size, seconds, peak = measure(projected)
+        label = ",".join(attributes) if len(attributes) < 3 else \
+            "{} documented attributes".format(len(attributes))
+        print("{:<50} {:>10} {:>10.3f} {:>10.1f}  ({:.1%} of the bytes)".format(
+            label, size, seconds * 1000, peak / 1024, size / full_size))
+
+
+if __name__ == "__main__":
+    main(*(int(a) for a in sys.argv[1:]))
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Nested dicts against the columnar `CountTable`
+
+Runs the filter and the noise steps of `candig.private_data_filter` on a
+large synthetic `/count` payload, once the way it was done with nested
+dicts (`data_filter` then a `copy.deepcopy` per dataset before noising)
+and once with the `CountTable`. Reports time and peak traced memory of
+each step.
+
+`python benchmarks/bench_count_table.py [datasets] [terms] [categories]`
+"""
+import copy
+import sys
+import timeit
+import tracemalloc
+
+import dpath.util
+from mesi_search import candig
+from synthetic import attribute_names, PATH, raw_results
+
+
+def nested_filter(data, terms):
+    """`data_filter` on nested dicts, before `CountTable`"""
+    filtered = {}
+    for dataset_id in data:
+        patients_data = dpath.util.get(data[dataset_id], PATH)
+        filtered[dataset_id] = {term: dpath.util.get(patients_data[0], term) for term in terms}
+    return filtered
+
+
+def nested_noise(mechanism, filtered):
+    """Noise on nested dicts: a deep copy per dataset whose counts are then overwritten"""
+    result = {}
+    for dataset_id, dataset in filtered.items():
+        noised = copy.deepcopy(dataset)
+        noised_counts = candig.randomize_counts(mechanism, list(dataset.values()))
+        for term, counts in zip(dataset, noised_counts):
+            noised[term] = counts
+        result[dataset_id] = noised
+    return result
+
+
+def measure(function):
+    seconds = min(timeit.repeat(function, number=5, repeat=3)) / 5
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds * 1000, peak / 1024
+
+
+def main(datasets=200, terms=6, categories=60):
+    data = raw_results(datasets, terms, categories)
+    term_names = attribute_names(terms)
+    mechanism = candig.create_noise_mechanism(10.0, 0.3)
+    filtered = nested_filter(data, term_names)
+    table = candig.count_table(data, term_names, PATH)
+    stages = [
+        ("filter", lambda: nested_filter(data, term_names),
+         lambda: candig.count_table(data, term_names, PATH)),
+        ("noise + dicts", lambda: nested_noise(mechanism, filtered),
+         lambda: table.randomized(mechanism).to_dict()),
+    ]
+    print("{} datasets x {} terms x {} categories".format(datasets, terms, categories))
+    print("{:<15} {:>14} {:>14} {:>14} {:>14}".format(
+        "", "dicts ms", "dicts peak KiB", "table ms", "table peak KiB"))
+    for name, nested, columnar in stages:
+        print("{:<15} {:>14.2f} {:>14.1f} {:>14.2f} {:>14.1f}".format(
+            name, *(measure(nested) + measure(columnar))))
+
+
+if __name__ == "__main__":
+    main(*(int(a) for a in sys.argv[1:]))
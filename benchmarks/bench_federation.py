@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Fan-out over federated CanDIG nodes, one of them slow
+
+Three stub CanDIG nodes of `stub_upstream.py`, two fast and one slow,
+serve the same number of datasets, the slow one listed first. Reports,
+per node, the milliseconds until its last `/count` call came back, with
+the thread pool per node of `raw_results` and with a single pool shared
+by the calls to all nodes.
+With the shared pool the calls to the fast nodes queue up behind the
+calls to the slow one.
+
+`python benchmarks/bench_federation.py [datasets per node] [workers]`
+"""
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from mesi_search import candig
+from stub_upstream import StubUpstream
+
+LATENCIES = {"slow": 0.2, "fast-a": 0.01, "fast-b": 0.01}  # seconds, in catalogue order
+
+
+def shared_pool(dids, max_workers):
+    """`/count` calls of all nodes fanned out over one pool"""
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for did in dids:
+            node, upstream_id = candig.split_dataset_id(did)
+            pool.submit(candig._count_outcome, candig.prepare_count_query(upstream_id),
+                        candig.CANDIG_COUNT_TIMEOUT, False, node)
+
+
+def finished(run, dids, max_workers):
+    """Milliseconds until the last `/count` call of every node came back"""
+    done = {}
+    count_outcome = candig._count_outcome
+
+    def timed(query, timeout, cached=True, node=None):
+        outcome = count_outcome(query, timeout, cached, node)
+        done[node] = time.perf_counter()
+        return outcome
+
+    with mock.patch.object(candig, "_count_outcome", timed):
+        started = time.perf_counter()
+        run(dids, max_workers)
+    return {node: (at - started) * 1000 for node, at in done.items()}
+
+
+def main(datasets=24, max_workers=8):
+    upstreams = {name: StubUpstream(datasets=datasets, latency=latency).start()
+                 for name, latency in LATENCIES.items()}
+    clients = {name: candig.upstream_client(upstream.url) for name, upstream in upstreams.items()}
+    dids = [candig.dataset_id(name, did)
+            for name, upstream in upstreams.items() for did in upstream.dataset_ids]
+    runs = [
+        ("pool per node", lambda d, w: candig.raw_results(d, max_workers=w, cached=False)),
+        ("shared pool", shared_pool),
+    ]
+    print("{} nodes, {} datasets each, {} workers".format(len(upstreams), datasets, max_workers))
+    print("{:<16}".format("") + "".join("{:>10}".format(name) for name in upstreams))
+    with mock.patch.multiple(candig, FEDERATED=True, UPSTREAMS=clients):
+        for name, run in runs:
+            finished(run, dids, max_workers)  # warm up the connections
+            ms = finished(run, dids, max_workers)
+            print("{:<16}".format(name) +
+                  "".join("{:>10.0f}".format(ms[node]) for node in upstreams))
+    for upstream in upstreams.values():
+        upstream.shutdown()
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Import time of the app, what every new gunicorn worker pays
+
+Imports `module` in fresh interpreters with `-X importtime` and reports the
+cumulative import time of the module, and the packages that took the
+longest to import themselves.
+
+`python benchmarks/bench_import.py [module] [runs]`
+"""
+import os
+import statistics
+import subprocess
+import sys
+
+TOP = 15
+
+
+def import_times(module):
+    """Microseconds per imported package, `{name: (self, cumulative)}`"""
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module],
+                            stderr=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                            env=os.environ, check=True).stderr.decode("utf-8")
+    times = {}
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        if own.strip().isdigit():
+            times[name.strip()] = (int(own), int(cumulative))
+    return times
+
+
+def main(module="mesi_search.main", runs=5):
+    runs = [import_times(module) for _ in range(int(runs))]
+    totals = sorted(run[module][1] / 1000 for run in runs)
+    print("import {}: median {:.1f} ms, min {:.1f} ms over {} runs".format(
+        module, statistics.median(totals), totals[0], len(totals)))
+    fastest = min(runs, key=lambda run: run[module][1])
+    print("{:<40} {:>10} {:>12}".format("slowest packages", "self ms", "total ms"))
+    for name, (own, cumulative) in sorted(fastest.items(), key=lambda item: -item[1][1])[:TOP]:
+        print("{:<40} {:>10.1f} {:>12.1f}".format(name, own / 1000, cumulative / 1000))
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:3])
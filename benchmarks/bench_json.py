@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""JSON codecs and response compression
+
+For discovery responses of a few sizes, times the encoding of the response
+and the decoding of the `/count` responses it is made of, with `json` and
+with `orjson` when it is installed. Then reports the bytes on the wire of
+the response as it is, gzip and brotli compressed, and the time the
+compression takes.
+
+`python benchmarks/bench_json.py`
+"""
+import timeit
+
+from mesi_search import codec
+from mesi_search.compression import Compressor
+from synthetic import raw_results
+
+SIZES = (  # datasets, attributes, categories per attribute
+    (10, 6, 20),
+    (100, 10, 50),
+    (500, 10, 100),
+)
+CODECS = [codec.StandardCodec] + ([codec.OrjsonCodec] if codec.AVAILABLE else [])
+
+
+def per_call(function):
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    return min(timer.repeat(number=number, repeat=5)) / number * 1e6
+
+
+def response(results):
+    """Discovery response of `results`, noise left out"""
+    return {"datasets": {did: result["results"]["patients"][0]
+                         for did, result in results.items()}}
+
+
+def main():
+    print("Encode the response and decode its `/count` responses")
+    print("{:<14} {:<8} {:>14} {:>14}".format("size", "codec", "encode us", "decode us"))
+    for datasets, attributes, categories in SIZES:
+        results = raw_results(datasets=datasets, attributes=attributes, cardinality=categories)
+        document = response(results)
+        bodies = [codec.StandardCodec.dumps(result) for result in results.values()]
+        for json_codec in CODECS:
+            encode = per_call(lambda: json_codec.dumps(document, sort_keys=True))
+            decode = per_call(lambda: [json_codec.loads(body) for body in bodies])
+            print("{:<14} {:<8} {:>14.1f} {:>14.1f}".format(
+                "{}x{}x{}".format(datasets, attributes, categories), json_codec.name,
+                encode, decode))
+
+    encodings = ["gzip"] + (["br"] if "br" in Compressor().encodings else [])
+    print()
+    print("Bytes on the wire of the response, compression defaults")
+    print("{:<14} {:<8} {:>12} {:>8} {:>14}".format("size", "encoding", "bytes", "ratio",
+                                                    "compress us"))
+    for datasets, attributes, categories in SIZES:
+        body = codec.dumps(response(raw_results(datasets=datasets, attributes=attributes,
+                                                cardinality=categories)), sort_keys=True)
+        size = "{}x{}x{}".format(datasets, attributes, categories)
+        print("{:<14} {:<8} {:>12} {:>8} {:>14}".format(size, "identity", len(body), "", ""))
+        for encoding in encodings:
+            compressor = Compressor(encodings=(encoding,))
+            compressed = compressor.compress(body, encoding)
+            print("{:<14} {:<8} {:>12} {:>8.3f} {:>14.1f}".format(
+                size, encoding, len(compressed), len(compressed) / len(body),
+                per_call(lambda: compressor.compress(body, encoding))))
+
+
+if __name__ == "__main__":
+    main()
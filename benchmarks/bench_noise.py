@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Per-value noise loop against the batched noise engine
+
+Times how long it takes to add noise to every count of a synthetic
+filtered result, once with diffprivlib's `Laplace` mechanism called per
+value (how `candig.randomize` used to work) and once with the batched
+`LaplaceNoise` engine drawing the noise of the whole response at once.
+
+`python benchmarks/bench_noise.py`
+"""
+import copy
+import math
+import random
+import timeit
+
+from mesi_search import candig
+
+SIZES = [(2, 3, 10), (10, 6, 30), (50, 6, 30), (200, 6, 60)]  # datasets, terms, categories
+
+
+def filtered_result(datasets, terms, categories, rnd):
+    def counts():
+        return {"category-{}".format(c): rnd.randrange(500) for c in range(categories)}
+
+    return {"dataset-{}".format(d): {"term-{}".format(t): counts() for t in range(terms)}
+            for d in range(datasets)}
+
+
+def per_value_loop(mechanism, data):
+    """`candig.randomize` before the batched engine"""
+    result = copy.deepcopy(data)
+    for term, term_specific_data in data.items():
+        mechanism.set_sensitivity(candig.get_sensitivity(term_specific_data))
+        for item, val in term_specific_data.items():
+            result[term][item] = math.ceil(mechanism.randomise(val))
+    return result
+
+
+def batched(mechanism, data):
+    counts = [term_data for dataset in data.values() for term_data in dataset.values()]
+    return candig.randomize_counts(mechanism, counts)
+
+
+def main():
+    laplace = candig.create_laplace_mechanism(10.0, 0.3)
+    engine = candig.create_noise_mechanism(10.0, 0.3)
+    print("{:>9} {:>6} {:>11} {:>8} {:>12} {:>12} {:>8}".format(
+        "datasets", "terms", "categories", "values", "loop ms", "batched ms", "speedup"))
+    for datasets, terms, categories in SIZES:
+        data = filtered_result(datasets, terms, categories, random.Random(42))
+        number = max(1, 200 // datasets)
+        loop = min(timeit.repeat(
+            lambda: {k: per_value_loop(laplace, v) for k, v in data.items()},
+            number=number, repeat=3)) / number
+        fast = min(timeit.repeat(lambda: batched(engine, data), number=number, repeat=3)) / number
+        print("{:>9} {:>6} {:>11} {:>8} {:>12.3f} {:>12.3f} {:>7.1f}x".format(
+            datasets, terms, categories, datasets * terms * categories, loop * 1000, fast * 1000,
+            loop / fast))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""`dpath.util.get` against precompiled path accessors
+
+Times the path lookups that `candig.data_filter` makes, the patients path
+and every attribute of interest for every dataset, with `dpath.util.get`
+and with `mesi_search.paths`, for a growing number of datasets.
+
+`python benchmarks/bench_paths.py`
+"""
+import random
+import timeit
+
+import dpath.util
+from mesi_search import paths
+
+PATH = "/results/patients"
+TERMS = ["gender", "ethnicity", "race", "provinceOfResidence", "causeOfDeath",
+         "occupationalOrEnvironmentalExposure"]
+
+
+def raw_payload(datasets, categories, rnd):
+    def counts():
+        return {"category-{}".format(c): rnd.randrange(500) for c in range(categories)}
+
+    return {"dataset-{}".format(d): {"results": {"patients": [{t: counts() for t in TERMS}]}}
+            for d in range(datasets)}
+
+
+def lookups(get, data):
+    for dataset in data.values():
+        patients = get(dataset, PATH)
+        for term in TERMS:
+            get(patients[0], term)
+
+
+def main():
+    print("{:>9} {:>11} {:>10} {:>12} {:>8}".format(
+        "datasets", "categories", "dpath ms", "compiled ms", "speedup"))
+    for datasets, categories in [(2, 20), (20, 20), (100, 30), (500, 30)]:
+        data = raw_payload(datasets, categories, random.Random(42))
+        number = max(1, 100 // datasets)
+        slow = min(timeit.repeat(lambda: lookups(dpath.util.get, data),
+                                 number=number, repeat=3)) / number
+        fast = min(timeit.repeat(lambda: lookups(paths.get, data),
+                                 number=number, repeat=3)) / number
+        print("{:>9} {:>11} {:>10.2f} {:>12.3f} {:>7.0f}x".format(
+            datasets, categories, slow * 1000, fast * 1000, slow / fast))
+
+
+if __name__ == "__main__":
+    main()
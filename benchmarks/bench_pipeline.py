@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Time and memory of the `candig` pipeline functions, with stored baselines
+
+Runs `data_filter`, `get_sensitivity`, `randomize` and `private_data_filter`
+on synthetic data from `synthetic.py` at several sizes and reports the time
+per call and the peak traced memory.
+
+Times are also reported relative to a fixed pure Python workload timed on
+the same machine, so that baselines stored on one machine can be compared
+on another. `--save` stores the results as the baselines, `--compare`
+compares with the stored baselines and exits with 1 when a function got
+slower or takes more memory than the tolerance allows.
+
+`python benchmarks/bench_pipeline.py [--sizes small,medium] [--save | --compare]`
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import timeit
+import tracemalloc
+
+from mesi_search import candig
+from synthetic import attribute_names, PATH, raw_results
+
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines",
+                         "pipeline.json")
+# name: (datasets, attributes, categories per attribute)
+SIZES = {
+    "small": (10, 3, 10),
+    "medium": (100, 6, 50),
+    "large": (300, 15, 100),
+}
+MEMORY_SLACK_KIB = 64  # allocator noise on small peaks
+
+
+def calibration():
+    """Seconds of a fixed pure Python workload, the unit of the relative times"""
+    def workload():
+        counts = {}
+        for i in range(20000):
+            key = "category {}".format(i % 97)
+            counts[key] = counts.get(key, 0) + i
+        return sorted(counts.items())
+
+    return min(timeit.repeat(workload, number=10, repeat=7)) / 10
+
+
+def cases(datasets, attributes, categories):
+    """Functions to measure on data of the given size"""
+    data = raw_results(datasets, attributes, categories)
+    terms = attribute_names(attributes)
+    filtered = candig.data_filter(data, terms, PATH)
+    mechanism = candig.create_noise_mechanism(candig.DP_EPSILON, candig.DP_DELTA)
+    return [
+        ("data_filter", lambda: candig.data_filter(data, terms, PATH)),
+        ("get_sensitivity", lambda: [candig.get_sensitivity(counts)
+                                     for dataset in filtered.values()
+                                     for counts in dataset.values()]),
+        ("randomize", lambda: [candig.randomize(mechanism, dataset)
+                               for dataset in filtered.values()]),
+        ("private_data_filter", lambda: candig.private_data_filter(data, terms, PATH)),
+    ]
+
+
+def measure(function):
+    """Milliseconds per call and peak traced KiB of `function`"""
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    seconds = min(timer.repeat(number=number, repeat=3)) / number
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds * 1000, peak / 1024
+
+
+def run(sizes):
+    unit = calibration()
+    measured = {}
+    for size in sizes:
+        for name, function in cases(*SIZES[size]):
+            measured["{}/{}".format(size, name)] = measure(function)
+    unit = min(unit, calibration())  # the least disturbed of before and after
+    results = {case: {"ms": round(ms, 4), "relative": round(ms / 1000 / unit, 3),
+                      "peak_kib": round(peak_kib, 1)}
+               for case, (ms, peak_kib) in measured.items()}
+    return {"calibration_ms": round(unit * 1000, 4), "python": platform.python_version(),
+            "results": results}
+
+
+def compare(current, baselines, tolerance):
+    """Regressions of `current` against `baselines`
+
+    @return: list of messages, empty when nothing regressed
+    """
+    regressions = []
+    for case, result in current["results"].items():
+        baseline = baselines["results"].get(case)
+        if baseline is None:
+            continue
+        if result["relative"] > baseline["relative"] * (1 + tolerance):
+            regressions.append("{}: {:.3f} x calibration, baseline {:.3f}".format(
+                case, result["relative"], baseline["relative"]))
+        if result["peak_kib"] > baseline["peak_kib"] * (1 + tolerance) + MEMORY_SLACK_KIB:
+            regressions.append("{}: peak {:.1f} KiB, baseline {:.1f} KiB".format(
+                case, result["peak_kib"], baseline["peak_kib"]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default=",".join(SIZES),
+                        help="comma separated sizes out of {}".format(", ".join(SIZES)))
+    parser.add_argument("--save", action="store_true", help="store the results as baselines")
+    parser.add_argument("--compare", action="store_true", help="compare with the baselines")
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="allowed slowdown or memory growth, 0.5 is 50%%")
+    args = parser.parse_args(argv)
+
+    current = run(args.sizes.split(","))
+    baselines = None
+    if args.compare:
+        with open(BASELINES) as f:
+            baselines = json.load(f)
+
+    print("calibration {:.3f} ms, Python {}".format(current["calibration_ms"],
+                                                    current["python"]))
+    print("{:<28} {:>10} {:>10} {:>10} {:>14}".format(
+        "", "ms", "relative", "peak KiB", "baseline rel"))
+    for case, result in current["results"].items():
+        baseline = (baselines or {}).get("results", {}).get(case, {}).get("relative")
+        print("{:<28} {:>10.3f} {:>10.3f} {:>10.1f} {:>14}".format(
+            case, result["ms"], result["relative"], result["peak_kib"],
+            "-" if baseline is None else "{:.3f}".format(baseline)))
+
+    if args.save:
+        os.makedirs(os.path.dirname(BASELINES), exist_ok=True)
+        with open(BASELINES, "w") as f:
+            json.dump(current, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print("Saved the baselines to {}".format(BASELINES))
+    if baselines is not None:
+        regressions = compare(current, baselines, args.tolerance)
+        for regression in regressions:
+            print("REGRESSION {}".format(regression))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
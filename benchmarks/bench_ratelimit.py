@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Cost of a rate limit check per storage
+
+Times `FixedWindowRateLimiter.hit`, what Flask-Limiter does once per
+request, with the per-process memory storage of `limits` and with the
+shared `SQLiteStorage`. Also runs the SQLite storage with several
+processes hitting the same database at once, like gunicorn workers.
+
+`python benchmarks/bench_ratelimit.py [processes] [hits]`
+"""
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+from limits import parse
+from limits.storage import MemoryStorage
+from limits.strategies import FixedWindowRateLimiter
+from mesi_search.ratelimit import SQLiteStorage
+
+LIMIT = parse("10/minute")
+USERS = 1000
+
+
+def hits(storage, number):
+    """Microseconds per hit, spread over `USERS` keys"""
+    limiter = FixedWindowRateLimiter(storage)
+    started = time.perf_counter()
+    for i in range(number):
+        limiter.hit(LIMIT, "/api/candig/patient", "sub:user-{}".format(i % USERS))
+    return (time.perf_counter() - started) / number * 1e6
+
+
+def worker(url, number, results):
+    results.put(hits(SQLiteStorage(url), number))
+
+
+def main(processes=4, number=20000):
+    with tempfile.TemporaryDirectory() as directory:
+        url = "sqlite:///" + os.path.join(directory, "ratelimit.db")
+        memory = MemoryStorage()
+        sqlite = SQLiteStorage(url)
+        print("{:<36} {:>10}".format("", "us/hit"))
+        print("{:<36} {:>10.1f}".format("memory, 1 process", hits(memory, number)))
+        print("{:<36} {:>10.1f}".format("sqlite, 1 process", hits(sqlite, number)))
+
+        context = multiprocessing.get_context("fork")
+        results = context.Queue()
+        workers = [context.Process(target=worker, args=(url, number, results))
+                   for _ in range(processes)]
+        for process in workers:
+            process.start()
+        per_hit = [results.get() for _ in workers]
+        for process in workers:
+            process.join()
+        print("{:<36} {:>10.1f}".format("sqlite, {} processes (mean)".format(processes),
+                                        sum(per_hit) / len(per_hit)))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:3]])
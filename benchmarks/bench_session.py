@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Signed-cookie sessions against server-side sessions
+
+Drives the discovery endpoint through Flask's test client with CanDIG
+mocked out, once with the whole session in a signed cookie (plain Flask)
+and once with Flask-Session keeping it on the filesystem. Reports the
+cookie the client has to send back and the time per request.
+
+`python benchmarks/bench_session.py [datasets]`
+"""
+import json
+import random
+import sys
+import tempfile
+import time
+import warnings
+from unittest import mock
+
+import jwt
+from flask.sessions import SecureCookieSessionInterface
+from flask_session.sessions import FileSystemSessionInterface
+from mesi_search.main import APP, limiter
+
+ATTRIBUTES = ["gender", "ethnicity", "race", "provinceOfResidence", "causeOfDeath",
+              "occupationalOrEnvironmentalExposure"]
+
+
+def raw_results(datasets, rnd):
+    return {"dataset-{}".format(d): {"results": {"patients": [
+        {a: {"{} {}".format(a, c): rnd.randrange(500) for c in range(12)} for a in ATTRIBUTES}]}}
+        for d in range(datasets)}
+
+
+def run(interface, data, requests=60):
+    APP.session_interface = interface
+    token = jwt.encode({"sub": "bench", "iat": int(time.time())}, "bench")
+    headers = {"Authorization": "Bearer {}".format(
+        token.decode("utf-8") if isinstance(token, bytes) else token)}
+    with APP.test_client() as client:
+        started = time.perf_counter()
+        for i in range(requests):
+            body = json.dumps({"attributesOfInterest": ATTRIBUTES[:i % len(ATTRIBUTES) + 1]})
+            client.post("/api/candig/patient", headers=headers, data=body,
+                        content_type="application/json")
+        elapsed = time.perf_counter() - started
+        cookie = client.cookie_jar._cookies["localhost.local"]["/"]["session"].value
+    return elapsed / requests * 1000, len(cookie)
+
+
+def main(datasets=20):
+    warnings.simplefilter("ignore")  # werkzeug warns about the size of the signed cookie
+    data = raw_results(datasets, random.Random(42))
+    limiter.enabled = False
+    APP.config["SESSION_RESULT_MAX_BYTES"] = 10 * 1024 * 1024
+    with mock.patch("mesi_search.candig.datasets", lambda: list(data)), \
+            mock.patch("mesi_search.candig.raw_results",
+                       lambda ids, **kwargs: {d: data[d] for d in ids}):
+        print("{} datasets x {} attributes".format(datasets, len(ATTRIBUTES)))
+        print("{:<24} {:>14} {:>14}".format("session", "ms/request", "cookie bytes"))
+        for name, interface in [
+            ("signed cookie", SecureCookieSessionInterface()),
+            ("server-side filesystem", FileSystemSessionInterface(
+                tempfile.mkdtemp(), 500, 384, "session:", use_signer=True)),
+        ]:
+            print("{:<24} {:>14.3f} {:>14}".format(name, *run(interface, data)))
+
+
+if __name__ == "__main__":
+    main(*(int(a) for a in sys.argv[1:]))
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Full JSON parse against streamed parse of `/count` responses
+
+Parses a synthetic all-fields `/count` response (as an upstream returns it
+when it does not project the fields) with `json.loads` and with
+`mesi_search.streaming.parse_counts` keeping only the attributes of
+interest. Reports peak traced memory and time.
+
+`python benchmarks/bench_streaming.py [patients]`
+"""
+import io
+import json
+import random
+import sys
+import timeit
+import tracemalloc
+
+from bench_count_query import ATTRIBUTE_SETS, synthetic_counts
+from mesi_search import streaming
+
+
+def measure(function):
+    seconds = min(timeit.repeat(function, number=5, repeat=3)) / 5
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds * 1000, peak / 1024
+
+
+def main(patients=20000):
+    body = json.dumps(synthetic_counts(patients, random.Random(42))).encode("utf-8")
+    print("{} patients, {} bytes".format(patients, len(body)))
+    print("{:<40} {:>10} {:>10}".format("", "ms", "peak KiB"))
+    print("{:<40} {:>10.2f} {:>10.1f}".format(
+        "json.loads, all fields", *measure(lambda: json.loads(body))))
+    for attributes in ATTRIBUTE_SETS:
+        print("{:<40} {:>10.2f} {:>10.1f}".format(
+            "streamed, {} field(s)".format(len(attributes)),
+            *measure(lambda: streaming.parse_counts(io.BytesIO(body), attributes))))
+
+
+if __name__ == "__main__":
+    main(*(int(a) for a in sys.argv[1:]))
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Request body validation, flasgger against the compiled validators
+
+Times the validation of a discovery query body, valid and invalid, the way
+`swag_from(..., validation=True)` did it and with the compiled
+`validation.DISCOVERY_QUERY`, with and without its fast path.
+
+`python benchmarks/bench_validation.py`
+"""
+import os
+import timeit
+
+from flasgger.utils import validate
+from mesi_search import validation
+from mesi_search.main import APP
+from werkzeug.exceptions import HTTPException
+
+VALID = {"attributesOfInterest": ["gender", "causeOfDeath", "ethnicity"]}
+INVALID = {"attributesOfInterest": "gender"}
+PATH = os.path.join(validation.RESOURCES, "discovery.yaml")
+
+
+def flasgger(data):
+    try:
+        validate(data, filepath=PATH)
+    except HTTPException:
+        pass
+
+
+def per_call(function, data):
+    timer = timeit.Timer(lambda: function(data))
+    number, _ = timer.autorange()
+    return min(timer.repeat(number=number, repeat=5)) / number * 1e6
+
+
+def main():
+    compiled = validation.DISCOVERY_QUERY
+    no_fast_path = validation.BodyValidator("discovery.yaml")
+    print("{:<28} {:>12} {:>12}".format("", "valid us", "invalid us"))
+    with APP.test_request_context("/api/candig/patient", method="POST"):
+        for name, function in (("flasgger swag_from", flasgger),
+                               ("compiled", no_fast_path.error),
+                               ("compiled with fast path", compiled.error)):
+            print("{:<28} {:>12.1f} {:>12.1f}".format(
+                name, per_call(function, VALID), per_call(function, INVALID)))
+
+
+if __name__ == "__main__":
+    main()
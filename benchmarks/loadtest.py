@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""End-to-end load test of the discovery endpoint
+
+Starts the stub CanDIG of `stub_upstream.py` in its own process, serves the
+app with gunicorn against it, and keeps `concurrency` authenticated
+discovery requests in flight. The JWTs are minted here: signed with HS256
+and only decoded by the app, or with `--verify-jwt` signed with a new RSA
+key whose JWKS file the app verifies them with. Reports throughput, latency
+percentiles and the status codes. Everything runs on this box.
+
+The count cache and the rate limit are off unless asked for, so every
+request goes all the way to the stub.
+
+Needs gunicorn and aiohttp, and uvicorn for `mesi_search.asgi:APP`.
+
+`python benchmarks/loadtest.py [--app mesi_search.main:APP] [--workers 1]
+[--worker-class gthread] [--threads 8] [--concurrency 16] [--requests 1000]
+[--duration SECONDS] [--users 1] [--verify-jwt] [stub options]`
+"""
+import argparse
+import asyncio
+import collections
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+import jwt
+import stub_upstream
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SRC = os.path.abspath(os.path.join(HERE, os.pardir, "src"))
+ATTRIBUTES = ["gender", "causeOfDeath"]
+PERCENTILES = [50, 90, 99]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for(process, port, name, timeout=30):
+    """URL of `process` once it listens on `port`"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("{} exited with {}".format(name, process.returncode))
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return "http://127.0.0.1:{}".format(port)
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("{} did not start".format(name))
+
+
+def environment(upstream_url, env=None):
+    """Environment variables the app needs, with `env` on top"""
+    app_env = dict(os.environ, CANDIG_UPSTREAM_API=upstream_url, SECRET_KEY="loadtest",
+                   DP_EPSILON="1.0", RATELIMIT_ENABLED="false", CANDIG_COUNT_CACHE_TTL="0",
+                   PYTHONPATH=SRC)
+    app_env.update(env or {})
+    return app_env
+
+
+def start_upstream(stub_args=()):
+    """Stub CanDIG in its own process, so it does not share a GIL with the load
+
+    @param stub_args: command line options of `stub_upstream.py`
+    @return: tuple of the process and its URL
+    """
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(HERE, "stub_upstream.py"), "--port", str(port)] +
+        list(stub_args), env=environment("http://127.0.0.1:{}".format(port)),
+        stdout=subprocess.DEVNULL)
+    return process, wait_for(process, port, "stub CanDIG")
+
+
+def start_app(app, upstream_url, gunicorn_args=(), env=None):
+    """The app served by gunicorn against `upstream_url`
+
+    @param app: WSGI or ASGI app, like `mesi_search.main:APP`
+    @param upstream_url: URL of the CanDIG to use
+    @param gunicorn_args: more gunicorn options, e.g. the worker class
+    @param env: more environment variables of the app
+    @return: tuple of the process and its URL
+    """
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "--backlog", "2048", "--timeout", "120",
+         "--bind", "127.0.0.1:{}".format(port)] + list(gunicorn_args) + [app],
+        env=environment(upstream_url, env), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return process, wait_for(process, port, app)
+
+
+def stop(process):
+    process.terminate()
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def mint_tokens(users, key="loadtest", algorithm="HS256", kid=None, lifetime=3600):
+    """One JWT per user, subjects `user-0`, `user-1`...
+
+    @return: list of encoded JWTs
+    """
+    now = int(time.time())
+    headers = {"kid": kid} if kid else None
+    tokens = []
+    for user in range(users):
+        token = jwt.encode({"sub": "user-{}".format(user), "iat": now, "exp": now + lifetime},
+                           key, algorithm=algorithm, headers=headers)
+        tokens.append(token.decode("utf-8") if isinstance(token, bytes) else token)
+    return tokens
+
+
+def rsa_jwks(directory):
+    """New RSA signing key and the JWKS file of its public key
+
+    @return: tuple of the private key, its key ID and the path of the JWKS file
+    """
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from jwt.algorithms import RSAAlgorithm
+
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048,
+                                           backend=default_backend())
+    jwk = json.loads(RSAAlgorithm.to_jwk(private_key.public_key()))
+    jwk.update(kid="loadtest", use="sig", alg="RS256")
+    path = os.path.join(directory, "jwks.json")
+    with open(path, "w") as f:
+        json.dump({"keys": [jwk]}, f)
+    return private_key, "loadtest", path
+
+
+async def run_load(url, tokens, concurrency, requests=None, duration=None,
+                   attributes=ATTRIBUTES, path="/api/candig/patient"):
+    """Keep `concurrency` discovery requests in flight
+
+    Stops after `requests` requests or `duration` seconds, whichever is set.
+    The clients take turns over `tokens`.
+
+    @return: dict with `requests`, `seconds`, `latencies` (sorted) and
+    `statuses` (status code, or the exception name, to number of requests)
+    """
+    body = json.dumps({"attributesOfInterest": attributes})
+    latencies = []
+    statuses = collections.Counter()
+    deadline = time.monotonic() + duration if duration else None
+    remaining = iter(range(requests)) if requests else None
+
+    def more():
+        if deadline is not None:
+            return time.monotonic() < deadline
+        return next(remaining, None) is not None
+
+    async def client(session, number):
+        headers = {"Authorization": "Bearer {}".format(tokens[number % len(tokens)]),
+                   "Content-Type": "application/json"}
+        while more():
+            started = time.monotonic()
+            try:
+                async with session.post(url + path, data=body, headers=headers) as response:
+                    await response.read()
+                    statuses[response.status] += 1
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                statuses[type(e).__name__] += 1
+            latencies.append(time.monotonic() - started)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=300)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        started = time.monotonic()
+        await asyncio.gather(*(client(session, number) for number in range(concurrency)))
+        seconds = time.monotonic() - started
+    latencies.sort()
+    return {"requests": len(latencies), "seconds": seconds, "latencies": latencies,
+            "statuses": dict(statuses)}
+
+
+def percentile(latencies, p):
+    """`p`th percentile of sorted `latencies`, nearest rank"""
+    if not latencies:
+        return float("nan")
+    return latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))]
+
+
+def summary(result):
+    """Throughput, latency percentiles in ms and errors of a `run_load` result"""
+    errors = sum(n for status, n in result["statuses"].items() if status != 200)
+    row = {"req/s": result["requests"] / result["seconds"], "errors": errors}
+    for p in PERCENTILES:
+        row["p{} ms".format(p)] = percentile(result["latencies"], p) * 1000
+    row["max ms"] = result["latencies"][-1] * 1000 if result["latencies"] else float("nan")
+    return row
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--app", default="mesi_search.main:APP")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--worker-class", default="gthread",
+                        help="gunicorn worker class, e.g. uvicorn.workers.UvicornWorker")
+    parser.add_argument("--threads", type=int, default=8, help="threads of gthread workers")
+    parser.add_argument("--concurrency", type=int, default=16, help="requests in flight")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--duration", type=float, help="seconds to run, instead of --requests")
+    parser.add_argument("--warmup", type=int, default=20, help="requests before measuring")
+    parser.add_argument("--users", type=int, default=1, help="distinct JWT subjects")
+    parser.add_argument("--attributes", default=",".join(ATTRIBUTES))
+    parser.add_argument("--verify-jwt", action="store_true",
+                        help="sign the JWTs with RS256 and have the app verify them")
+    parser.add_argument("--count-cache", action="store_true", help="keep the count cache on")
+    parser.add_argument("--rate-limit", action="store_true", help="keep the rate limit on")
+    stub_upstream.arguments(parser)
+    args = parser.parse_args(argv)
+
+    stub_args = ["--datasets", str(args.datasets), "--latency", str(args.latency),
+                 "--jitter", str(args.jitter), "--error-rate", str(args.error_rate),
+                 "--drop-rate", str(args.drop_rate), "--cardinality", str(args.cardinality)]
+    gunicorn_args = ["-w", str(args.workers), "-k", args.worker_class,
+                     "--threads", str(args.threads)]
+    env = {"SESSION_TYPE": "cookie"}
+    if args.count_cache:
+        env["CANDIG_COUNT_CACHE_TTL"] = "300"
+    if args.rate_limit:
+        env["RATELIMIT_ENABLED"] = "true"
+
+    with tempfile.TemporaryDirectory() as directory:
+        if args.verify_jwt:
+            private_key, kid, jwks_file = rsa_jwks(directory)
+            env.update(JWT_JWKS_FILE=jwks_file, JWT_ALGORITHMS="RS256")
+            tokens = mint_tokens(args.users, private_key, "RS256", kid)
+        else:
+            tokens = mint_tokens(args.users)
+
+        upstream, upstream_url = start_upstream(stub_args)
+        try:
+            app, url = start_app(args.app, upstream_url, gunicorn_args, env)
+            try:
+                attributes = args.attributes.split(",")
+                if args.warmup:
+                    asyncio.run(run_load(url, tokens, min(args.concurrency, args.warmup),
+                                         requests=args.warmup, attributes=attributes))
+                result = asyncio.run(run_load(
+                    url, tokens, args.concurrency, attributes=attributes,
+                    requests=None if args.duration else args.requests,
+                    duration=args.duration))
+            finally:
+                stop(app)
+        finally:
+            stop(upstream)
+
+    row = summary(result)
+    print("{} with {} {} worker(s), {} requests in flight, {} datasets, {} ms (+{} ms) "
+          "latency, {:.0%} errors, {:.0%} drops upstream".format(
+              args.app, args.workers, args.worker_class, args.concurrency, args.datasets,
+              args.latency, args.jitter, args.error_rate, args.drop_rate))
+    print("  ".join("{:>10}".format(name) for name in row))
+    print("  ".join("{:>10.1f}".format(value) if isinstance(value, float) else
+                    "{:>10}".format(value) for value in row.values()))
+    print("status codes: {}".format(", ".join(
+        "{}: {}".format(status, n) for status, n in sorted(result["statuses"].items(),
+                                                           key=lambda item: str(item[0])))))
+
+
+if __name__ == "__main__":
+    main()
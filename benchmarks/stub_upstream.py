@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Local stub of the CanDIG API for load tests
+
+Answers `/datasets/search` with `datasets` synthetic datasets, paged like
+CanDIG, and `/count` with the counts of the asked for patient fields made
+by `synthetic.py`. Before every answer it waits `latency` plus up to
+`jitter` seconds, like a remote CanDIG would. `error_rate` of the calls
+get a 503 and `drop_rate` of them get their connection closed without an
+answer. Connections are kept alive and every one is served by its own
+thread. Nothing goes over the network.
+
+`python benchmarks/stub_upstream.py [--port 8008] [--datasets 20] [--latency 50]
+[--jitter 0] [--error-rate 0] [--drop-rate 0] [--cardinality 20]`
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from synthetic import attribute_names, count_payload
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get("Content-Length", 0))
+        query = json.loads(self.rfile.read(length) or b"{}")
+        if isinstance(query, str):  # `candig._datasets_page` sends a JSON string
+            query = json.loads(query)
+        outcome = server.outcome()
+        server.count_call(self.path, outcome)
+        time.sleep(server.delay())
+        if outcome == "drop":
+            self.close_connection = True
+            return
+
+        if outcome == "error":
+            status, body = 503, b'{"message": "stub error"}'
+        elif self.path == "/datasets/search":
+            status, body = 200, server.datasets_page(query)
+        elif self.path == "/count":
+            body = server.count(query)
+            status, body = (200, body) if body is not None else (404, b"{}")
+        else:
+            status, body = 404, b"{}"
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubUpstream(ThreadingHTTPServer):
+    """Stub CanDIG server
+
+    @param datasets: number of datasets listed
+    @param latency: seconds to wait before every answer
+    @param jitter: up to this many more seconds to wait, drawn per call
+    @param error_rate: fraction of calls answered with a 503
+    @param drop_rate: fraction of calls whose connection is closed unanswered
+    @param cardinality: categories per attribute, or `(low, high)`
+    @param page_size: largest page of datasets, smaller `pageSize`s are honoured
+    @param seed: seed of the payloads and of the latency and errors
+    @param port: port to listen on, 0 picks a free one
+    """
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, datasets=20, latency=0.05, jitter=0.0, error_rate=0.0, drop_rate=0.0,
+                 cardinality=20, page_size=1000, seed=42, port=0):
+        super().__init__(("127.0.0.1", port), StubHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.cardinality = cardinality
+        self.page_size = page_size
+        self.seed = seed
+        self.dataset_ids = ["dataset-{}".format(d) for d in range(datasets)]
+        self.calls = {}  # path -> number of calls
+        self.outcomes = {}  # "ok", "error" or "drop" -> number of calls
+        self._rnd = random.Random(seed)
+        self._payloads = {}
+        self._bodies = {}
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{}".format(self.server_port)
+
+    def outcome(self):
+        with self._lock:
+            draw = self._rnd.random()
+        if draw < self.drop_rate:
+            return "drop"
+        if draw < self.drop_rate + self.error_rate:
+            return "error"
+        return "ok"
+
+    def delay(self):
+        with self._lock:
+            return self.latency + self._rnd.uniform(0, self.jitter)
+
+    def count_call(self, path, outcome):
+        with self._lock:
+            self.calls[path] = self.calls.get(path, 0) + 1
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+
+    def datasets_page(self, query):
+        size = min(int(query.get("pageSize") or self.page_size), self.page_size)
+        offset = int(query.get("pageToken") or 0)
+        page = self.dataset_ids[offset:offset + size]
+        results = {"datasets": [{"id": d} for d in page], "total": len(self.dataset_ids)}
+        if offset + size < len(self.dataset_ids):
+            results["nextPageToken"] = offset + size
+        return json.dumps({"results": results}).encode("utf-8")
+
+    def count(self, query):
+        dataset_id = query.get("datasetId")
+        if dataset_id not in self.dataset_ids:
+            return None
+        fields = tuple(query["results"][0]["fields"])
+        with self._lock:
+            body = self._bodies.get((dataset_id, fields))
+            if body is None:
+                payload = self._payload(dataset_id)
+                patients = {f: v for f, v in payload["results"]["patients"][0].items()
+                            if f in fields}
+                body = self._bodies[dataset_id, fields] = json.dumps(
+                    dict(payload, results={"patients": [patients]})).encode("utf-8")
+        return body
+
+    def _payload(self, dataset_id):
+        payload = self._payloads.get(dataset_id)
+        if payload is None:
+            rnd = random.Random("{}-{}".format(self.seed, dataset_id))
+            payload = self._payloads[dataset_id] = count_payload(
+                attribute_names(15), self.cardinality, rnd)
+        return payload
+
+    def start(self):
+        """Serve in a background thread
+
+        @return: the server itself
+        """
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def arguments(parser):
+    """Add the options of the stub to an `argparse` parser"""
+    parser.add_argument("--datasets", type=int, default=20, help="number of datasets")
+    parser.add_argument("--latency", type=float, default=50, help="ms before every answer")
+    parser.add_argument("--jitter", type=float, default=0, help="up to this many ms more")
+    parser.add_argument("--error-rate", type=float, default=0, help="fraction of 503s")
+    parser.add_argument("--drop-rate", type=float, default=0,
+                        help="fraction of calls closed without an answer")
+    parser.add_argument("--cardinality", type=int, default=20,
+                        help="categories per attribute")
+    return parser
+
+
+def from_arguments(args, port=0):
+    """`StubUpstream` made with the options added by `arguments`"""
+    return StubUpstream(datasets=args.datasets, latency=args.latency / 1000,
+                        jitter=args.jitter / 1000, error_rate=args.error_rate,
+                        drop_rate=args.drop_rate, cardinality=args.cardinality, port=port)
+
+
+def main(argv=None):
+    parser = arguments(argparse.ArgumentParser(description=__doc__.splitlines()[0]))
+    parser.add_argument("--port", type=int, default=8008)
+    args = parser.parse_args(argv)
+    server = from_arguments(args, port=args.port)
+    print("Stub CanDIG with {} datasets, {} ms (+{} ms) latency, {:.0%} errors and {:.0%} "
+          "drops on {}".format(args.datasets, args.latency, args.jitter, args.error_rate,
+                               args.drop_rate, server.url), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
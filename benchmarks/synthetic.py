@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""Seeded synthetic CanDIG data for benchmarks
+
+`raw_results` makes what `candig.raw_results` returns, one `/count`
+response per dataset, at any size: number of datasets, number of
+attributes and number of categories per attribute. The same arguments
+and seed always make the same data.
+"""
+import random
+
+from mesi_search.candig import PATIENT_FIELDS
+
+PATH = "/results/patients"
+
+
+def attribute_names(attributes):
+    """Names of `attributes` attributes, the CanDIG patient fields first
+
+    @param attributes: number of attributes
+    @return: list of names
+    """
+    extra = ["attribute-{}".format(a) for a in range(max(0, attributes - len(PATIENT_FIELDS)))]
+    return (list(PATIENT_FIELDS) + extra)[:attributes]
+
+
+def count_payload(attributes, cardinality, rnd, max_count=500):
+    """One `/count` response with counts for every attribute
+
+    Counts fall off with the rank of the category, like real categories
+    where a few are common and most are rare.
+
+    @param attributes: list of attribute names
+    @param cardinality: categories per attribute, or `(low, high)` to pick
+    it per attribute
+    @param rnd: `random.Random` to draw from
+    @param max_count: count of the most common category, about
+    @return: dict shaped like a CanDIG `/count` response
+    """
+    patients = {}
+    for attribute in attributes:
+        categories = cardinality if isinstance(cardinality, int) else rnd.randint(*cardinality)
+        patients[attribute] = {"{} {}".format(attribute, c): rnd.randint(0, max_count // (c + 1))
+                               for c in range(categories)}
+    return {"status": {"Known peers": 1, "Queried peers": 1,
+                       "Successful communications": 1, "Valid response": True},
+            "results": {"patients": [patients]}}
+
+
+def raw_results(datasets=10, attributes=6, cardinality=20, seed=42, max_count=500):
+    """`/count` responses per dataset ID, like `candig.raw_results` returns
+
+    @param datasets: number of datasets
+    @param attributes: number of attributes, see `attribute_names`
+    @param cardinality: categories per attribute, or `(low, high)` to pick
+    it per attribute and dataset
+    @param seed: seed of the random numbers
+    @param max_count: count of the most common category, about
+    @return: dict of dataset ID to `/count` response
+    """
+    rnd = random.Random(seed)
+    names = attribute_names(attributes)
+    return {"dataset-{}".format(d): count_payload(names, cardinality, rnd, max_count)
+            for d in range(datasets)}
@@ -0,0 +1,13 @@
+#!/usr/bin/env python
+
+"""Build the API spec that the app serves at `/apispec_1.json`
+
+Run it after changing the API, and commit the spec it writes:
+
+`./bin/build_apispec.py`
+"""
+from mesi_search import main, swagger
+
+if __name__ == '__main__':
+    swagger.build_apispec(main.SWAGGER)
+    print("Wrote {}".format(swagger.APISPEC_FILE))
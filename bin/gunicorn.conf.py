@@ -0,0 +1,31 @@
+"""gunicorn settings for the app
+
+Sets up the Prometheus multiprocess mode, so that `/metrics` adds up the
+metrics of all workers, see `mesi_search.metrics`:
+
+`gunicorn -c bin/gunicorn.conf.py --bind :5000 run:app --chdir bin`
+
+`PROMETHEUS_MULTIPROC_DIR` defaults to `metrics` in `STATE_DIR`, it is
+made private and emptied when gunicorn starts.
+"""
+import os
+
+from mesi_search.files import private_directory
+from mesi_search.settings import STATE_DIR
+
+# set before `prometheus_client` is imported, it picks its value storage on import
+multiproc_dir = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR",
+                                      os.path.join(STATE_DIR, "metrics"))
+
+from mesi_search import metrics  # noqa: E402
+
+
+def on_starting(server):
+    private_directory(multiproc_dir)
+    # values left by an earlier run must not be added to this one
+    for name in os.listdir(multiproc_dir):
+        os.remove(os.path.join(multiproc_dir, name))
+
+
+def child_exit(server, worker):
+    metrics.mark_process_dead(worker.pid)
@@ -0,0 +1,13 @@
+#!/usr/bin/env python
+
+"""Executable to run the app on an ASGI server, see `mesi_search.asgi`.
+
+After you have configured your Python environment and installed the
+`async` extras (`pip install -e .[async]`):
+
+`./bin/run_async.py`
+"""
+import uvicorn
+
+if __name__ == '__main__':
+    uvicorn.run("mesi_search.asgi:APP")
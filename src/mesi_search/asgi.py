@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""MESI application, ASGI entry point
+
+Serves the patient discovery endpoint of `mesi_search.main` with the
+asyncio pipeline of `mesi_search.candig_async`, so a worker is not tied up
+while CanDIG answers. Run it with any ASGI server, e.g.
+
+`uvicorn mesi_search.asgi:APP` or
+`gunicorn -k uvicorn.workers.UvicornWorker mesi_search.asgi:APP`
+
+Differences with the Flask app:
+- there are no sessions, the endpoint does not remember the attributes of
+  interest or the result of a user
+- the rate limit is keyed by the JWT subject only, unauthenticated requests
+  are turned away before it
+- there is no home page or Swagger UI, `mesi_search.main` still serves them
+"""
+
+import logging
+
+from limits import parse
+from limits.storage import storage_from_string
+from limits.strategies import FixedWindowRateLimiter
+from mesi_search import candig, candig_async, codec, ratelimit  # noqa: F401 registers sqlite://
+from mesi_search.compression import COMPRESSOR
+from mesi_search.settings import RATELIMIT_ENABLED, RATELIMIT_STORAGE_URL
+from mesi_search.utils import decode_token
+
+if not candig_async.AVAILABLE:
+    raise ImportError("mesi_search.asgi needs aiohttp, install it with "
+                      "`pip install -e .[async]`")
+
+logger = logging.getLogger(__name__)
+DISCOVERY_PATH = "/api/candig/patient"
+DISCOVERY_LIMIT = parse(ratelimit.DISCOVERY_LIMIT)
+MAX_BODY_BYTES = 64 * 1024
+# same strategy, storage and keys as the Flask-Limiter of `mesi_search.main`, so
+# a client has one discovery budget for both apps. The limiter only keeps a weak
+# reference to the storage
+STORAGE = storage_from_string(RATELIMIT_STORAGE_URL)
+LIMITER = FixedWindowRateLimiter(STORAGE)
+
+
+async def APP(scope, receive, send):
+    """ASGI application"""
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+    if scope["path"] != DISCOVERY_PATH:
+        await respond(send, 404, "Not Found")
+    elif scope["method"] != "POST":
+        await respond(send, 405, "Method Not Allowed")
+    else:
+        status, body = await discover_candig_patient(scope, receive)
+        await respond(send, status, body, get_header(scope, b"accept-encoding"))
+
+
+async def lifespan(receive, send):
+    """Close the connections to CanDIG when the server shuts down"""
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await candig_async.close()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def discover_candig_patient(scope, receive):
+    """Search endpoint to discover possible data sets available
+
+    @return: tuple of the status code and the body, a dict is sent as JSON
+    """
+    logger.info("Request for patient discovery endpoint")
+    token = decode_token(get_jwt(scope))
+    if "sub" not in token:
+        return 401, ("Missing valid authentication token. Please provide your "
+                     "JWT in the Authorization header as Bearer token.")
+    if RATELIMIT_ENABLED and not LIMITER.hit(DISCOVERY_LIMIT, "sub:{}".format(token["sub"]),
+                                             ratelimit.DISCOVERY_SCOPE):
+        return 429, "Too Many Requests: {}".format(DISCOVERY_LIMIT)
+
+    body = await read_body(receive)
+    if body is None:
+        return 413, "Request body is larger than {} bytes".format(MAX_BODY_BYTES)
+    try:
+        incoming_post_data = codec.loads(body)
+    except ValueError:
+        return 400, "Request body is not valid JSON"
+    attribute_of_interest = incoming_post_data.get("attributesOfInterest") \
+        if isinstance(incoming_post_data, dict) else None
+    if not isinstance(attribute_of_interest, list) or \
+            not all(isinstance(a, str) for a in attribute_of_interest):
+        return 400, "'attributesOfInterest' must be an array of strings"
+
+    unknown_attributes = candig.unknown_attributes(attribute_of_interest)
+    if unknown_attributes:
+        return 400, "Unknown attributes of interest: {}. Known attributes are: {}".format(
+            ", ".join(unknown_attributes), ", ".join(candig.PATIENT_FIELDS))
+
+    return 200, {"datasets": await candig_async.discover(attribute_of_interest)}
+
+
+def get_jwt(scope):
+    """Like `utils.get_jwt`, from the headers of an ASGI scope
+
+    @return: string of JWT or empty string
+    """
+    parts = get_header(scope, b"authorization").split(" ")
+    return parts[1] if len(parts) > 1 else ""
+
+
+def get_header(scope, name):
+    """Value of the header `name` (lower case bytes) of an ASGI scope, empty if not there"""
+    for header, value in scope.get("headers", []):
+        if header == name:
+            return value.decode("latin-1")
+    return ""
+
+
+async def read_body(receive):
+    """Body of the request, `None` when it is larger than `MAX_BODY_BYTES`"""
+    chunks = []
+    size = 0
+    more_body = True
+    while more_body:
+        message = await receive()
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > MAX_BODY_BYTES:
+            return None
+        chunks.append(chunk)
+        more_body = message.get("more_body", False)
+    return b"".join(chunks)
+
+
+async def respond(send, status, body, accept_encoding=""):
+    """Send a response, a dict `body` as JSON and anything else as text
+
+    @param accept_encoding: `Accept-Encoding` header of the request, a large
+    JSON body is compressed with an encoding it accepts
+    """
+    if isinstance(body, dict):
+        content = codec.dumps(body)
+        content, encoding = COMPRESSOR.encode(content, "application/json", accept_encoding)
+        headers = [(b"content-type", b"application/json")]
+        if COMPRESSOR.encodings:
+            headers.append((b"vary", b"Accept-Encoding"))
+        if encoding is not None:
+            headers.append((b"content-encoding", encoding.encode("ascii")))
+    else:
+        content = body.encode("utf-8")
+        headers = [(b"content-type", b"text/html; charset=utf-8")]
+    headers.append((b"content-length", str(len(content)).encode("ascii")))
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": content})
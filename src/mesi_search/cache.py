@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""In-process caches
+
+Caches here only live in the memory of a worker process, nothing in them
+is ever sent to a client as is. `SingleFlight` shares calls that are
+still in flight rather than their results once they are done.
+"""
+
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def fingerprint(data):
+    """Stable digest of JSON-like data, the same for equal data whatever its key order
+
+    @param data: dict, list or other JSON serializable data
+    @return: hex string
+    """
+    encoded = json.dumps(data, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class TTLCache(object):
+    """Thread-safe cache with time-to-live expiry, LRU eviction and a size cap
+
+    Entries expire `ttl` seconds after they were put in. When the total size
+    of the entries goes over `max_bytes`, the least recently used entries are
+    evicted. Values are handed out as they were put in, so callers must not
+    change them.
+
+    @param ttl: seconds an entry stays valid, 0 or less disables the cache
+    @param max_bytes: cap on the total size of the entries
+    @param clock: function returning the current time in seconds
+    """
+
+    def __init__(self, ttl=300.0, max_bytes=64 * 1024 * 1024, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires at, size, value), oldest first
+        self._bytes = 0
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0,
+                          "invalidations": 0}
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def get(self, key):
+        """Value of `key`, or `None` when it is not cached or has expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= self._clock():
+                self._remove(key)
+                self._counters["expirations"] += 1
+                entry = None
+            if entry is None:
+                self._counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters["hits"] += 1
+            return entry[2]
+
+    def put(self, key, value, size):
+        """Cache `value` under `key`
+
+        @param key: hashable key
+        @param value: value to cache
+        @param size: size of the value in bytes, counted against `max_bytes`
+        """
+        if not self.enabled or size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (self._clock() + self.ttl, size, value)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._counters["evictions"] += 1
+
+    def invalidate(self, match=None):
+        """Drop cached entries
+
+        @param match: function that takes a key and says whether to drop it,
+        `None` drops every entry
+        @return: number of entries dropped
+        """
+        with self._lock:
+            keys = [k for k in self._entries if match is None or match(k)]
+            for key in keys:
+                self._remove(key)
+            self._counters["invalidations"] += len(keys)
+        return len(keys)
+
+    def stats(self):
+        """Counters of the cache
+
+        @return: dict with hits, misses, evictions, expirations, invalidations,
+        entries and bytes
+        """
+        with self._lock:
+            stats = dict(self._counters)
+            stats.update(entries=len(self._entries), bytes=self._bytes)
+        return stats
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+
+class SingleFlight(object):
+    """Coalesces concurrent calls with the same key into one
+
+    The first caller of a key runs the function, callers of the same key
+    that come in before it returns wait for it and get its result or its
+    error. Nothing is kept once the call is done. Works for threads, and for
+    greenlets when gevent has patched `threading`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}  # key -> _Call in flight
+        self._counters = {"calls": 0, "coalesced": 0}
+
+    def do(self, key, function):
+        """Run `function`, or wait for the call of `key` already in flight
+
+        @param key: hashable key, equal keys must mean equal calls
+        @param function: function without arguments to run
+        @return: tuple of what `function` returned and whether it was shared
+        with a call already in flight
+        @raise Exception: whatever `function` raised, in every waiting caller
+        """
+        with self._lock:
+            self._counters["calls"] += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self._counters["coalesced"] += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value, True
+
+        try:
+            call.value = function()
+        except BaseException as e:  # waiting callers must not take a missing value for None
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.value, False
+
+    def stats(self):
+        """Counters of the calls
+
+        @return: dict with calls, coalesced (calls that waited on another
+        one) and in_flight
+        """
+        with self._lock:
+            stats = dict(self._counters)
+            stats.update(in_flight=len(self._calls))
+        return stats
+
+
+class _Call(object):
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
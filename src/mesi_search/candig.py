@@ -6,28 +6,106 @@ to make API requests to CanDIG server. This could easily be
 a Flask middleware as long as we define the interface. That
 means, then it can be extended easily for other APIs that
 provide data. Or perhaps some GA4GH API based middleware.
+
+With `CANDIG_UPSTREAM_APIS` the datasets of several CanDIG nodes are
+federated: they are listed from every node in parallel and their IDs are
+namespaced as `node:id`, so everything past the upstream calls sees one
+dataset map. Every node has its own client, connection pool, circuit
+breaker and `/count` workers, a slow or failing node only holds up its
+own datasets.
 """
 
-import copy
+import array
+import contextlib
+import itertools
 import json
 import logging
-import math
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 
-import diffprivlib as dp
-import dpath.util
+import numpy as np
 import requests
-from mesi_search.settings import CANDIG_UPSTREAM_API, DP_DELTA, DP_EPSILON
+from urllib3.exceptions import DecodeError, ProtocolError, ReadTimeoutError
+from mesi_search import codec, metrics, paths, streaming
+from mesi_search.cache import fingerprint, SingleFlight, TTLCache
+from mesi_search.catalogue import DatasetCatalogue
+from mesi_search.noise import LaplaceNoise
+from mesi_search.settings import (CANDIG_BREAKER_RESET, CANDIG_BREAKER_THRESHOLD,
+                                  CANDIG_CONNECT_TIMEOUT, CANDIG_COUNT_CACHE_MAX_BYTES,
+                                  CANDIG_COUNT_CACHE_TTL, CANDIG_COUNT_TIMEOUT,
+                                  CANDIG_DATASETS_PAGE_SIZE, CANDIG_DATASETS_REFRESH,
+                                  CANDIG_DATASETS_TIMEOUT,
+                                  CANDIG_FANOUT_WORKERS, CANDIG_POOL_SIZE,
+                                  CANDIG_READ_TIMEOUT, CANDIG_RETRIES,
+                                  CANDIG_RETRY_BACKOFF, CANDIG_SNAPSHOT_MAX_AGE,
+                                  CANDIG_SNAPSHOT_REFRESH, CANDIG_STREAM_COUNTS,
+                                  CANDIG_UPSTREAM_API, CANDIG_UPSTREAM_APIS, DP_DELTA,
+                                  DP_EPSILON)
+from mesi_search.snapshot import CountSnapshot
+from mesi_search.upstream import CircuitBreaker, UpstreamClient
 
 logger = logging.getLogger(__name__)
+# patient fields that the CanDIG count endpoint can count
+PATIENT_FIELDS = (
+    "dateOfBirth",
+    "gender",
+    "ethnicity",
+    "race",
+    "provinceOfResidence",
+    "dateOfDeath",
+    "causeOfDeath",
+    "autopsyTissueForResearch",
+    "dateOfPriorMalignancy",
+    "familyHistoryAndRiskFactors",
+    "familyHistoryOfPredispositionSyndrome",
+    "detailsOfPredispositionSyndrome",
+    "geneticCancerSyndrome",
+    "otherGeneticConditionOrSignificantComorbidity",
+    "occupationalOrEnvironmentalExposure",
+)
 DEFAULT_HEADERS = {
     "Accept": "application/json",
     "Content-Type": "application/json"
 }
+NAMESPACE_SEPARATOR = ":"  # between the node name and the upstream ID of a dataset
+
+
+def upstream_client(base_url):
+    """Pooled client for one CanDIG node, with its own circuit breaker"""
+    return UpstreamClient(base_url,
+                          pool_size=CANDIG_POOL_SIZE,
+                          connect_timeout=CANDIG_CONNECT_TIMEOUT,
+                          read_timeout=CANDIG_READ_TIMEOUT,
+                          retries=CANDIG_RETRIES,
+                          backoff=CANDIG_RETRY_BACKOFF,
+                          breaker=CircuitBreaker(CANDIG_BREAKER_THRESHOLD, CANDIG_BREAKER_RESET))
+
+
+if any(NAMESPACE_SEPARATOR in name for name in CANDIG_UPSTREAM_APIS):
+    raise ValueError("CANDIG_UPSTREAM_APIS node names cannot contain "
+                     "'{}'".format(NAMESPACE_SEPARATOR))
+FEDERATED = bool(CANDIG_UPSTREAM_APIS)
+# clients by node name, the single `CANDIG_UPSTREAM_API` is the node `None`
+UPSTREAMS = {name: upstream_client(url) for name, url in CANDIG_UPSTREAM_APIS.items()} \
+    if FEDERATED else {None: upstream_client(CANDIG_UPSTREAM_API)}
+UPSTREAM = next(iter(UPSTREAMS.values()))  # the single upstream, or the first node
+# concurrent identical CanDIG calls of a worker wait on one of them and share its result
+FLIGHTS = SingleFlight()
+CATALOGUE = DatasetCatalogue(lambda: coalesced("/datasets/search", "all", fetch_datasets),
+                             refresh_interval=CANDIG_DATASETS_REFRESH)
+# raw counts per (dataset ID, query fingerprint), these must never be sent out without noise
+COUNT_CACHE = TTLCache(ttl=CANDIG_COUNT_CACHE_TTL, max_bytes=CANDIG_COUNT_CACHE_MAX_BYTES)
+# raw counts of all the patient fields of every dataset, refreshed in the background
+SNAPSHOT = CountSnapshot(lambda: fetch_snapshot(), refresh_interval=CANDIG_SNAPSHOT_REFRESH,
+                         max_age=CANDIG_SNAPSHOT_MAX_AGE)
+_invalidated_at = 0.0  # `time.time()` of the last `invalidate_counts` of this worker
 
 
 def private_data_filter(data={}, terms=[], path=""):
     """Calculates the differentially private results for given attributes
     of interest in CanDIG data
+    The noise for every count of every dataset is drawn in one go.
 
     @param data: entire patient dataset for CanDIG v1
     @param terms: a list of attributes of interest to look for in the `data`
@@ -35,40 +113,153 @@ def private_data_filter(data={}, terms=[], path=""):
     @return: object that returns differentially private data
     only for the said `terms` (attrs of interest)
     """
-    filtered_results = data_filter(data, terms, path)
-    private_filtered_results = {}
-
-    mech = create_laplace_mechanism(DP_EPSILON, DP_DELTA)
-
-    for dataset_id, dataset in filtered_results.items():
-        private_filtered_results[dataset_id] = randomize(mech, dataset)
-    return private_filtered_results
+    with metrics.timed("filter"):
+        table = count_table(data, terms, path)
+    with metrics.timed("noise"):
+        mech = create_noise_mechanism(DP_EPSILON, DP_DELTA)
+        return table.randomized(mech).to_dict()
 
 
 def data_filter(data={}, terms=[], path=""):
     """Return the subset of the key/value within a nested CanDIG data
-    Uses `dpath` package that makes it easy to work with
-    dicts using path-based access
+    Uses precompiled path accessors, see `mesi_search.paths`, that fall
+    back to the `dpath` package for paths with globs
 
     @param data: entire patient dataset for CanDIG v1
     @param terms: a list of attributes of interest to look for in the `data`
     @param path: path that represents the JSON data structure
     @return: object that returns data only for the said `terms` (attrs of interest)
     """
-    filtered_result = {}
+    return count_table(data, terms, path).to_dict()
+
+
+def count_table(data={}, terms=[], path=""):
+    """Like `data_filter`, but returns the counts as a `CountTable`
+
+    @param data: entire patient dataset for CanDIG v1
+    @param terms: a list of attributes of interest to look for in the `data`
+    @param path: path that represents the JSON data structure
+    @return: `CountTable` with the counts of the said `terms` (attrs of interest)
+    """
+    table = CountTable()
     if data and terms:
+        get_patients = paths.compile_path(path)
+        term_accessors = [(term, paths.compile_path(term)) for term in terms]
         for dataset_id in data:
-            patients_data = dpath.util.get(data[dataset_id], path)
+            patients_data = get_patients(data[dataset_id])
             if patients_data and len(patients_data) == 1:  # TODO: check for `>1`
-                term_results = {}
-                for term in terms:
+                table.add_dataset(dataset_id)
+                for term, get_term in term_accessors:
                     try:
-                        term_results[term] = dpath.util.get(patients_data[0], term)
+                        table.add_counts(dataset_id, term, get_term(patients_data[0]))
                     except KeyError as k:
                         logger.error("Did not find the term {} "
-                                     "in dataset {}".format(term, dataset_id), str(k))
-                filtered_result[dataset_id] = term_results
-    return filtered_result
+                                     "in dataset {}: {}".format(term, dataset_id, k))
+    return table.freeze()
+
+
+class CountTable(object):
+    """Counts per category of the attributes of interest of many datasets
+
+    The counts are not kept in nested dicts but in flat columns:
+    - every term has one vocabulary of interned category names, shared by
+      all datasets
+    - every (dataset, term) pair is a segment, `offsets[i]:offsets[i + 1]`
+      of the `category_ids` array (positions in the vocabulary of the term)
+      and of the `counts` array
+
+    Build a table with `add_dataset`/`add_counts` and then `freeze` it.
+    A frozen table is never changed, `randomized` returns a new table that
+    shares everything but the counts.
+    """
+    __slots__ = ("datasets", "segments", "categories", "category_ids", "counts", "offsets",
+                 "_vocabularies", "_pending")
+
+    def __init__(self):
+        self.datasets = []  # dataset IDs, in order
+        self.segments = []  # (dataset ID, term) of each segment, in order
+        self.categories = {}  # term -> list of categories, the vocabulary
+        self._vocabularies = {}  # term -> {category: position in vocabulary}
+        # category IDs, counts and offsets until the table is frozen
+        self._pending = (array.array("i"), array.array("i"), array.array("q", [0]))
+        self.category_ids = None
+        self.counts = None
+        self.offsets = None
+
+    def add_dataset(self, dataset_id):
+        self.datasets.append(dataset_id)
+
+    def add_counts(self, dataset_id, term, counts):
+        """Add the `{category: count}` of `term` in the dataset"""
+        vocabulary = self._vocabularies.setdefault(term, {})
+        categories = self.categories.setdefault(term, [])
+        category_ids, all_counts, offsets = self._pending
+        for category, count in counts.items():
+            position = vocabulary.get(category)
+            if position is None:
+                position = vocabulary[category] = len(categories)
+                categories.append(sys.intern(category) if type(category) is str else category)
+            category_ids.append(position)
+            all_counts.append(count)
+        offsets.append(len(all_counts))
+        self.segments.append((dataset_id, term))
+
+    def freeze(self):
+        """Move the counts into arrays, no counts can be added after this
+
+        @return: the table itself
+        """
+        category_ids, counts, offsets = self._pending
+        self.category_ids = np.frombuffer(category_ids, dtype=np.intc)
+        self.counts = np.frombuffer(counts, dtype=np.intc)
+        self.offsets = np.frombuffer(offsets, dtype=np.int64)
+        self._pending = None
+        return self
+
+    def sensitivities(self):
+        """Sensitivity of every segment, as `get_sensitivity` calculates it
+
+        @return: array with one sensitivity per segment
+        """
+        lengths = np.diff(self.offsets)
+        result = np.ones(len(lengths), dtype=np.int64)
+        filled = lengths > 0
+        if filled.any():
+            starts = self.offsets[:-1][filled]
+            result[filled] = np.maximum.reduceat(self.counts, starts) - \
+                np.minimum.reduceat(self.counts, starts)  # crude sensitivity
+        result[result == 0] = 1  # difference of 1 when there is nothing much to do
+        return result
+
+    def randomized(self, mechanism):
+        """Table with noise added to every count in one draw
+
+        @param mechanism: batched Laplace mechanism, see `create_noise_mechanism`
+        @return: new `CountTable`
+        """
+        sensitivities = np.repeat(self.sensitivities(), np.diff(self.offsets))
+        table = CountTable.__new__(CountTable)
+        for name in CountTable.__slots__:
+            setattr(table, name, getattr(self, name))
+        noised = mechanism.randomise(self.counts, sensitivities)
+        del sensitivities
+        table.counts = np.ceil(noised, out=noised).astype(np.intc)
+        return table
+
+    def to_dict(self):
+        """The counts as `{dataset: {term: {category: count}}}`
+
+        @return: dict
+        """
+        result = {dataset_id: {} for dataset_id in self.datasets}
+        offsets = self.offsets.tolist()
+        for i, (dataset_id, term) in enumerate(self.segments):
+            start, end = offsets[i], offsets[i + 1]
+            categories = self.categories[term]
+            result[dataset_id][term] = dict(zip(
+                map(categories.__getitem__, self.category_ids[start:end].tolist()),
+                self.counts[start:end].tolist()))
+        return result
 
 
 def create_laplace_mechanism(epsilon, delta=0.0):
@@ -80,11 +271,28 @@ def create_laplace_mechanism(epsilon, delta=0.0):
     @param delta: Differential privacy parameter for purity of diff priv
     @return: IBM differential privact library's mechanism object
     """
+    # imported on first use, it pulls in scikit-learn and scipy and only
+    # `LaplaceNoise` draws the noise of the responses
+    import diffprivlib as dp
+
     mech = dp.mechanisms.Laplace()
     mech.set_epsilon_delta(epsilon, delta)
     return mech
 
 
+def create_noise_mechanism(epsilon, delta=0.0):
+    """Returns the batched Laplace mechanism with epsilon and delta set
+    It is the same mechanism as `create_laplace_mechanism` returns, but it
+    randomises whole arrays of values at once.
+
+    @param epsilon: Differential privacy main parameter for privacy;
+    lower means more privacy but less utility
+    @param delta: Differential privacy parameter for purity of diff priv
+    @return: `LaplaceNoise` mechanism object
+    """
+    return LaplaceNoise(epsilon, delta)
+
+
 def get_sensitivity(data):
     """Calculates sensitivity needed for Laplace mechanism
     This sensitivity is calculated per attribute-of-interest, per dataset
@@ -103,10 +311,8 @@ def get_sensitivity(data):
     @return integer that denotes the sensitivity of the dataset
     """
     result = 1
-    value_list = []
-    for k, v in data.items():
-        value_list.append(v)
-    if value_list is not []:
+    value_list = list(data.values())
+    if value_list:
         result = max(value_list) - min(value_list)  # crude sensitivity
     if result == 0:
         result = 1  # difference of 1 when there is nothing much to do
@@ -116,41 +322,244 @@ def get_sensitivity(data):
 def randomize(mechanism, data):
     """Using the `mechanism` send the randomized data
 
-    @param mechanism: IBM diff priv library mechanism object
+    @param mechanism: batched Laplace mechanism, see `create_noise_mechanism`
     @param data: CanDIG v1 data
     @return: object of filtered and private data for each dataset
     """
-    result = copy.deepcopy(data)
-    for term, term_specific_data in data.items():
-        mechanism.set_sensitivity(get_sensitivity(term_specific_data))
-        for item, val in term_specific_data.items():
-            result[term][item] = math.ceil(mechanism.randomise(val))
-    return result
+    return dict(zip(data, randomize_counts(mechanism, list(data.values()))))
+
 
+def randomize_counts(mechanism, counts):
+    """Randomize many `{category: count}` objects with one draw of noise
+    Each object gets noise for its own sensitivity, see `get_sensitivity`.
 
-def raw_results(candig_datasets):
+    @param mechanism: batched Laplace mechanism, see `create_noise_mechanism`
+    @param counts: list of objects of counts per category
+    @return: list of objects of randomized counts, in the order of `counts`
+    """
+    sizes = [len(term_counts) for term_counts in counts]
+    values = np.fromiter(itertools.chain.from_iterable(c.values() for c in counts),
+                         dtype=float, count=sum(sizes))
+    sensitivities = np.repeat([get_sensitivity(c) for c in counts], sizes)
+    noised = iter(np.ceil(mechanism.randomise(values, sensitivities)).astype(np.int64).tolist())
+    return [{category: next(noised) for category in term_counts} for term_counts in counts]
+
+
+def raw_results(candig_datasets, fields=None, max_workers=CANDIG_FANOUT_WORKERS,
+                timeout=CANDIG_COUNT_TIMEOUT, errors=None, cached=True):
     """Fetch raw results from CanDIG API
+    The `/count` calls of every node are fanned out over a bounded thread
+    pool of the node, so the calls to a slow node do not queue up the calls
+    to the others. With one node and `max_workers` of 1 they are made one
+    after another. Either way the results are the same and keep the order of
+    `candig_datasets`. A dataset whose call fails is left out and its error
+    is put in `errors`.
 
     @param candig_datasets: list of dataset IDs from CanDIG to fetch results from
+    @param fields: patient fields to fetch, `None` fetches all `PATIENT_FIELDS`
+    @param max_workers: maximum number of `/count` calls in flight at once per node
+    @param timeout: seconds the `/count` call of each dataset may take, retries included
+    @param errors: optional dict that collects the error message per dataset ID
+    @param cached: whether counts may come from `COUNT_CACHE`
     @return: all the data for each dataset ID
     """
     collective_counts = {}
+    queries = {}
+    nodes = {}  # node -> dataset IDs of the node
     for did in candig_datasets:
-        query = prepare_count_query(did)
-        if query is not {}:
-            count_result = request(url="/count", json_data=query)
-            collective_counts[did] = count_result.json()
+        node, upstream_id = split_dataset_id(did)
+        query = prepare_count_query(upstream_id, fields)
+        if query:
+            queries[did] = query
+            nodes.setdefault(node, []).append(did)
         else:
             logger.error("Empty query received. You are likely missing dataset ID.")
+
+    if len(nodes) > 1 or min(max_workers, len(queries)) > 1:
+        pools = {node: ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(dids))))
+                 for node, dids in nodes.items()}
+        futures = {did: pools[node].submit(_count_outcome, queries[did], timeout, cached, node)
+                   for node, dids in nodes.items() for did in dids}
+        for pool in pools.values():
+            pool.shutdown(wait=False)  # runs what was submitted, workers quit when done
+        outcomes = {did: futures[did].result() for did in queries}
+    else:
+        outcomes = {did: _count_outcome(query, timeout, cached, split_dataset_id(did)[0])
+                    for did, query in queries.items()}
+
+    for did, outcome in outcomes.items():
+        if isinstance(outcome, Exception):
+            logger.error("CanDIG count for dataset {} failed: {}".format(did, outcome))
+            if errors is not None:
+                errors[did] = str(outcome)
+        else:
+            collective_counts[did] = outcome
     return collective_counts
 
 
-def prepare_count_query(dataset_id=None):
+def _count_outcome(query, timeout, cached=True, node=None):
+    """Counts of one dataset, or the error that stopped us from getting them"""
+    try:
+        return fetch_count(query, timeout, cached=cached, node=node)
+    except (requests.RequestException, ValueError) as e:
+        return e
+
+
+def fetch_count(query, timeout=CANDIG_COUNT_TIMEOUT, cached=True, node=None):
+    """Fetch the counts of one dataset from CanDIG API
+    Counts are served from `COUNT_CACHE` while they are fresh. A call for the
+    same query already in flight is waited on rather than made again. Counts
+    are shared between requests, so do not change them.
+
+    @param query: query for the CanDIG count endpoint, see `prepare_count_query`
+    @param timeout: seconds the upstream call may take, retries included
+    @param cached: whether the counts may come from `COUNT_CACHE`, they are
+    put in it either way
+    @param node: node the dataset is on, see `split_dataset_id`
+    @return: the counts as dict
+    @raise requests.RequestException: upstream call failed or returned an error status
+    @raise ValueError: upstream response is not JSON
+    """
+    key = (dataset_id(node, query.get("datasetId")), fingerprint(query))
+    counts = COUNT_CACHE.get(key) if cached else None
+    if counts is None:
+        counts = coalesced("/count", key, lambda: _fetch_count(key, query, timeout, node))
+    return counts
+
+
+def _fetch_count(key, query, timeout, node=None):
+    """Counts of one dataset from CanDIG, put in `COUNT_CACHE`"""
+    deadline = time.monotonic() + timeout  # retries and their backoff included
+    if CANDIG_STREAM_COUNTS and streaming.AVAILABLE:
+        counts, size = _stream_count(query, timeout, node, deadline)
+    else:
+        count_result = request(url="/count", json_data=query, timeout=timeout, node=node,
+                               deadline=deadline)
+        count_result.raise_for_status()
+        counts, size = codec.loads(count_result.content), len(count_result.content)
+    COUNT_CACHE.put(key, counts, size)
+    return counts
+
+
+def coalesced(endpoint, key, fetch):
+    """Result of `fetch`, shared with an identical call already in flight
+
+    @param endpoint: CanDIG endpoint that `fetch` calls, for the metrics
+    @param key: hashable key of the call, equal for calls with equal results
+    @param fetch: function without arguments that calls CanDIG
+    @return: what `fetch` returns
+    """
+    result, shared = FLIGHTS.do((endpoint, key), fetch)
+    if shared:
+        metrics.UPSTREAM_COALESCED.labels(endpoint).inc()
+    return result
+
+
+def _stream_count(query, timeout, node=None, deadline=None):
+    """Fetch the counts of one dataset, parsing them while they are read
+    Only the patient fields asked for in `query` are kept.
+
+    @return: tuple of the counts and the number of bytes read
+    """
+    count_result = request(url="/count", json_data=query, timeout=timeout, stream=True,
+                           node=node, deadline=deadline)
+    try:
+        count_result.raise_for_status()
+        if count_result.raw is None:  # nothing to stream from, body is already read
+            return codec.loads(count_result.content), len(count_result.content)
+        count_result.raw.decode_content = True  # let urllib3 gunzip
+        reader = streaming.CountingReader(count_result.raw)
+        with _raw_read_errors():
+            counts = streaming.parse_counts(reader, query["results"][0]["fields"])
+        return counts, reader.bytes_read
+    finally:
+        count_result.close()  # connection is back in the pool once the body is read
+
+
+@contextlib.contextmanager
+def _raw_read_errors():
+    """Raise the urllib3 errors of reading a streamed body as the requests
+    errors `Response.iter_content` raises for them
+    """
+    try:
+        yield
+    except ProtocolError as e:
+        raise requests.exceptions.ChunkedEncodingError(e) from e
+    except DecodeError as e:
+        raise requests.exceptions.ContentDecodingError(e) from e
+    except ReadTimeoutError as e:
+        raise requests.exceptions.ConnectionError(e) from e
+
+
+def snapshot_results(fields):
+    """Raw results of every dataset from `SNAPSHOT`, without waiting on CanDIG
+
+    @param fields: patient fields asked for, the snapshot holds all of them
+    @return: all the data for each dataset ID, `None` when the snapshot is
+    disabled, not loaded yet or too old
+    """
+    if not fields:
+        return None
+    return SNAPSHOT.data()
+
+
+def fetch_snapshot():
+    """Fetch the counts of every patient field of every dataset for `SNAPSHOT`
+
+    @return: tuple of all the data for each dataset ID and the IDs of the
+    datasets whose counts could not be fetched
+    """
+    errors = {}
+    results = raw_results(datasets(), errors=errors, cached=False)
+    return results, list(errors)
+
+
+def invalidate_counts(dataset_id=None):
+    """Drop cached counts, e.g. after a dataset changed upstream
+    The whole `SNAPSHOT` is dropped either way.
+
+    @param dataset_id: dataset whose counts to drop, `None` drops all of them
+    @return: number of cached results dropped
+    """
+    global _invalidated_at
+    _invalidated_at = time.time()
+    dropped = COUNT_CACHE.invalidate(
+        None if dataset_id is None else lambda key: key[0] == dataset_id)
+    SNAPSHOT.invalidate()  # live counts are fetched until it is refreshed
+    logger.info("Dropped {} cached CanDIG count result(s)".format(dropped))
+    return dropped
+
+
+def counts_version():
+    """Version of the counts that results are made of now, see `counts_changed_since`
+
+    @return: fingerprint of the `SNAPSHOT` counts, `None` when they are not served
+    """
+    return SNAPSHOT.version()
+
+
+def counts_changed_since(made_at, version):
+    """Whether the counts may have changed since a result was made of them
+    Without a snapshot only an `invalidate_counts` of this worker is seen.
+
+    @param made_at: `time.time()` the result was made at
+    @param version: `counts_version()` when the result was made
+    @return: `True` when the counts were invalidated since or their version differs
+    """
+    return made_at <= _invalidated_at or version != counts_version()
+
+
+def prepare_count_query(dataset_id=None, fields=None):
     """CanDIG count endpoint needs some specific JSON
 
     @param dataset_id: alphanumeric ID from CanDIG
+    @param fields: patient fields to count, `None` counts all `PATIENT_FIELDS`.
+    They are put in the order of `PATIENT_FIELDS` so the same set of fields
+    always makes the same query.
     @return: fully formed query that CanDIG API expects as data
     """
+    if fields is None:
+        fields = PATIENT_FIELDS
     base_query = {
         "logic": {
             "and": [
@@ -176,23 +585,7 @@ def prepare_count_query(dataset_id=None):
         "results": [
             {
                 "table": "patients",
-                "fields": [
-                    "dateOfBirth",
-                    "gender",
-                    "ethnicity",
-                    "race",
-                    "provinceOfResidence",
-                    "dateOfDeath",
-                    "causeOfDeath",
-                    "autopsyTissueForResearch",
-                    "dateOfPriorMalignancy",
-                    "familyHistoryAndRiskFactors",
-                    "familyHistoryOfPredispositionSyndrome",
-                    "detailsOfPredispositionSyndrome",
-                    "geneticCancerSyndrome",
-                    "otherGeneticConditionOrSignificantComorbidity",
-                    "occupationalOrEnvironmentalExposure"
-                ]
+                "fields": [f for f in PATIENT_FIELDS if f in fields]
             }
         ]
     }
@@ -206,32 +599,188 @@ def prepare_count_query(dataset_id=None):
     return base_query
 
 
+def unknown_attributes(terms):
+    """Attributes of interest that are not patient fields CanDIG can count
+
+    @param terms: a list of attributes of interest
+    @return: list of the unknown attributes, empty when all are known
+    """
+    return [term for term in terms if term not in PATIENT_FIELDS]
+
+
+def dataset_id(node, upstream_id):
+    """Dataset ID of `upstream_id` on `node`, namespaced when federated
+
+    @param node: node name, `None` for the single `CANDIG_UPSTREAM_API`
+    @param upstream_id: dataset ID on the node
+    @return: `node:upstream_id`, or `upstream_id` as is for the node `None`
+    """
+    if node is None or upstream_id is None:
+        return upstream_id
+    return node + NAMESPACE_SEPARATOR + upstream_id
+
+
+def split_dataset_id(did):
+    """Node and dataset ID on the node of a dataset ID, see `dataset_id`
+
+    @return: tuple of the node name and the dataset ID on the node
+    """
+    if not FEDERATED or did is None:
+        return None, did
+    node, _, upstream_id = did.partition(NAMESPACE_SEPARATOR)
+    return node, upstream_id
+
+
+def node_client(node):
+    """Upstream client of `node`, `UPSTREAM` for the node `None`
+
+    @raise ValueError: there is no such node
+    """
+    if node is None:
+        return UPSTREAM
+    try:
+        return UPSTREAMS[node]
+    except KeyError:
+        raise ValueError("Unknown CanDIG node {!r}".format(node))
+
+
 def datasets():
-    """Fetch datasets from the CanDIG API
+    """Dataset IDs from the CanDIG API, served from the in-memory `CATALOGUE`
 
     @return: list of dataset IDs
     """
-    dataset_query = json.dumps({"pageSize": 1000, "pageToken": 0})
-    result = request(url="/datasets/search", json_data=dataset_query)
-    result = result.json()  # result as dict
-    datasets = dpath.util.get(result, "/results/datasets")
-    dataset_ids = [d.get("id", None) for d in datasets if datasets]
+    return CATALOGUE.ids()
+
+
+_node_datasets = {}  # node -> dataset IDs of its last successful listing
+
+
+def fetch_datasets(page_size=CANDIG_DATASETS_PAGE_SIZE, timeout=CANDIG_DATASETS_TIMEOUT):
+    """Fetch every dataset of every node from the CanDIG API
+    The nodes are asked in parallel. A node that cannot be listed, or not
+    within `timeout`, keeps the datasets of its last listing, or is left out
+    until it can be listed.
+
+    @param page_size: number of datasets to ask for per page
+    @param timeout: seconds the listing of a federated node may take
+    @return: list of dataset IDs, namespaced when federated, in node order
+    @raise requests.RequestException: no node could be listed
+    @raise ValueError: no node could be listed
+    """
+    if not FEDERATED:
+        return fetch_node_datasets(None, page_size)
+
+    deadline = time.monotonic() + timeout
+    pool = ThreadPoolExecutor(max_workers=len(UPSTREAMS))
+    futures = {node: pool.submit(fetch_node_datasets, node, page_size) for node in UPSTREAMS}
+    pool.shutdown(wait=False)  # a slow node is not waited on past the deadline
+    dataset_ids = []
+    failures = []
+    for node, future in futures.items():
+        try:
+            node_ids = _node_datasets[node] = [dataset_id(node, did)
+                                               for did in _listing(future, deadline)]
+        except (requests.RequestException, ValueError) as e:
+            failures.append(e)
+            node_ids = _node_datasets.get(node, [])
+            logger.error("Listing the datasets of CanDIG node {} failed, keeping {} dataset(s) "
+                         "of its last listing: {}".format(node, len(node_ids), e))
+        dataset_ids.extend(node_ids)
+    if len(failures) == len(futures):
+        raise failures[0]
+    return dataset_ids
+
+
+def _listing(future, deadline):
+    """Dataset IDs `future` lists, `requests.Timeout` once `deadline` has passed"""
+    try:
+        return future.result(timeout=max(0.0, deadline - time.monotonic()))
+    except FutureTimeout:
+        raise requests.Timeout("listing the datasets took too long") from None
+
+
+def fetch_node_datasets(node, page_size=CANDIG_DATASETS_PAGE_SIZE):
+    """Fetch every dataset of one node from the CanDIG API, page after page
+    When the first page tells the total, the rest of the pages are fetched
+    concurrently. Otherwise `nextPageToken` is followed until it runs out.
+
+    @param node: node name, `None` for the single `CANDIG_UPSTREAM_API`
+    @param page_size: number of datasets to ask for per page
+    @return: list of dataset IDs on the node
+    """
+    page, next_token, total = _datasets_page(0, page_size, node)
+    pages = [page]
+    if total is not None and len(page) < total and page:
+        # page tokens are offsets in the list of datasets
+        offsets = range(len(page), total, len(page))
+        workers = max(1, min(CANDIG_FANOUT_WORKERS, len(offsets)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pages.extend(p for p, _, _ in pool.map(
+                lambda offset: _datasets_page(offset, page_size, node), offsets))
+    else:
+        seen_tokens = {0}
+        while next_token and page and next_token not in seen_tokens:
+            seen_tokens.add(next_token)
+            page, next_token, _ = _datasets_page(next_token, page_size, node)
+            pages.append(page)
+
+    dataset_ids = []
+    seen = set()
+    for did in (did for page in pages for did in page):
+        if did not in seen:
+            seen.add(did)
+            dataset_ids.append(did)
+    if total is not None and len(dataset_ids) < total:
+        logger.warning("CanDIG listed {} datasets but {} were "
+                       "fetched".format(total, len(dataset_ids)))
     return dataset_ids
 
 
-def request(url="/", json_data={}, headers=DEFAULT_HEADERS):
-    """CanDIG API request
+def _datasets_page(page_token, page_size, node=None):
+    """One page of the CanDIG dataset search of `node`
+
+    @return: tuple of the dataset IDs, the next page token and the total
+    number of datasets, the last two are `None` when CanDIG does not say
+    """
+    dataset_query = json.dumps({"pageSize": page_size, "pageToken": page_token})
+    result = request(url="/datasets/search", json_data=dataset_query, node=node)
+    result.raise_for_status()
+    result = codec.loads(result.content)  # result as dict
+    datasets = paths.get(result, "/results/datasets")
+    dataset_ids = [d.get("id", None) for d in datasets if datasets]
+    results = result.get("results", {})
+    return dataset_ids, results.get("nextPageToken"), results.get("total")
+
+
+def request(url="/", json_data={}, headers=DEFAULT_HEADERS, timeout=None, node=None,
+            **kwargs):
+    """CanDIG API request, made through the pooled client of the node
 
     @param url: CanDIG API URL segment (not the base domain)
     @param json_data: data that CanDIG API endpoint expects
     @param headers: headers that CanDIG API endpoint expects
-    @return: CanDIG API response object (`requests`)
+    @param timeout: seconds to wait for the CanDIG server, `None` uses
+    `CANDIG_READ_TIMEOUT`
+    @param node: node to call, `None` calls `UPSTREAM`
+    @param kwargs: more arguments of `requests`, like `stream`
+    @return: CanDIG API response object (`requests`), its `upstream_timing`
+    tells how long the call took. The call is also recorded in `metrics`.
     """
-    # TODO: Write better API calls, bubble up errors from upstream
-    logger.info("CanDIG API call for {}".format(url))
-
-    request_url = CANDIG_UPSTREAM_API + url
-    result = requests.post(request_url, json=json_data, headers=headers)
-    logger.info("CanDIG server returned {}".format(result.status_code))
+    # TODO: bubble up errors from upstream
+    logger.info("CanDIG API call for {}{}".format(url, "" if node is None else " of " + node))
+    client = node_client(node)
+
+    started = time.monotonic()
+    try:
+        result = client.post(url, json_data=json_data, headers=headers, timeout=timeout,
+                             **kwargs)
+    except requests.RequestException as e:
+        metrics.observe_upstream(url, time.monotonic() - started, type(e).__name__)
+        raise
+    timing = result.upstream_timing
+    metrics.observe_upstream(url, timing.elapsed, result.status_code)
+    logger.info("CanDIG server returned {} in {:.1f} ms after {} attempt(s), "
+                "{} new connection(s)".format(result.status_code, timing.elapsed * 1000,
+                                              timing.attempts, timing.new_connections))
 
     return result
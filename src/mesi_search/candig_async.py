@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+"""CanDIG API Requests, asyncio variant
+
+The same discovery pipeline as `mesi_search.candig`, with the upstream
+calls made on an event loop by `aiohttp` instead of blocking a thread each.
+One worker can then keep hundreds of discovery requests waiting on CanDIG
+at once, see `mesi_search.asgi`.
+
+Only the I/O is async. Queries, the count cache, the dataset catalogue, the
+filtering and the noise are the ones of `mesi_search.candig`: they do not
+wait on anything, so the results of both variants are the same.
+
+Needs the optional `aiohttp` package, `AVAILABLE` tells whether it is there.
+"""
+
+import asyncio
+import logging
+import random
+import time
+import weakref
+
+from mesi_search import candig, codec, metrics
+from mesi_search.cache import fingerprint
+from mesi_search.settings import (CANDIG_ASYNC_POOL_SIZE, CANDIG_CONNECT_TIMEOUT,
+                                  CANDIG_COUNT_TIMEOUT, CANDIG_FANOUT_WORKERS,
+                                  CANDIG_READ_TIMEOUT, CANDIG_RETRIES,
+                                  CANDIG_RETRY_BACKOFF)
+from mesi_search.upstream import RETRY_STATUS_CODES, UpstreamUnavailable
+
+try:
+    import aiohttp
+except ImportError:  # the async pipeline is optional, `mesi_search.candig` is not
+    aiohttp = None
+
+AVAILABLE = aiohttp is not None
+logger = logging.getLogger(__name__)
+
+
+class AsyncUpstreamClient(object):
+    """Pooled, keep-alive asyncio HTTP client for one upstream API
+
+    Retries and backs off like `mesi_search.upstream.UpstreamClient` and
+    shares its circuit breaker, so both variants see the same upstream
+    health. The `aiohttp` session is made on first use on the running
+    event loop.
+
+    @param base_url: upstream base URL that the call URL segments are added to
+    @param breaker: `CircuitBreaker` guarding the upstream
+    @param pool_size: maximum number of open connections to the upstream
+    @param connect_timeout: seconds to wait for a connection to the upstream
+    @param read_timeout: default seconds to wait for the upstream to answer
+    @param retries: number of times a failed call is tried again
+    @param backoff: base seconds to wait before a retry, doubled per retry
+    """
+
+    def __init__(self, base_url, breaker, pool_size=100, connect_timeout=3.05,
+                 read_timeout=30.0, retries=2, backoff=0.2):
+        self.base_url = base_url
+        self.breaker = breaker
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self._session = None
+
+    @property
+    def session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size)
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  headers={"Accept-Encoding": "gzip"})
+        return self._session
+
+    async def close(self):
+        """Close the connections to the upstream"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def post(self, url, json_data=None, headers=None, timeout=None):
+        """POST to the upstream
+
+        @param url: URL segment of the upstream API (not the base domain)
+        @param json_data: data to send as JSON
+        @param headers: headers of the call
+        @param timeout: seconds to wait for the answer, defaults to `read_timeout`
+        @return: body of the response as bytes
+        @raise UpstreamUnavailable: circuit breaker is open
+        @raise aiohttp.ClientError: all attempts failed or the upstream
+        returned an error status
+        @raise asyncio.TimeoutError: the upstream did not answer in time
+        """
+        if not self.breaker.allow():
+            raise UpstreamUnavailable("Circuit breaker is open for {}".format(self.base_url))
+
+        request_url = self.base_url + url
+        timeouts = aiohttp.ClientTimeout(
+            sock_connect=self.connect_timeout,
+            sock_read=timeout if timeout is not None else self.read_timeout)
+        started = time.monotonic()
+        attempt = 0
+        try:
+            while True:
+                attempt += 1
+                try:
+                    async with self.session.post(request_url, json=json_data,
+                                                 headers=headers, timeout=timeouts) as result:
+                        body = await result.read()
+                    error = None
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                    result, error = None, e
+
+                failed = error is not None or result.status in RETRY_STATUS_CODES
+                if not failed or attempt > self.retries:
+                    break
+                delay = random.uniform(0, self.backoff * 2 ** (attempt - 1))  # full jitter
+                logger.warning("Upstream call to {} failed ({}), retrying in {:.3f} "
+                               "seconds".format(url, error or result.status, delay))
+                await asyncio.sleep(delay)
+        except BaseException:
+            # a broken payload, a cancelled call...: not retried, but the breaker
+            # must hear of it, or a half open trial never ends
+            self.breaker.record_failure()
+            raise
+
+        if failed:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        if error is not None:
+            raise error
+        logger.info("CanDIG server returned {} in {:.1f} ms after {} attempt(s)".format(
+            result.status, (time.monotonic() - started) * 1000, attempt))
+        result.raise_for_status()
+        return body
+
+
+# clients by node, like `candig.UPSTREAMS` and sharing their circuit breakers
+UPSTREAMS = {node: AsyncUpstreamClient(client.base_url, client.breaker,
+                                       pool_size=CANDIG_ASYNC_POOL_SIZE,
+                                       connect_timeout=CANDIG_CONNECT_TIMEOUT,
+                                       read_timeout=CANDIG_READ_TIMEOUT,
+                                       retries=CANDIG_RETRIES,
+                                       backoff=CANDIG_RETRY_BACKOFF)
+             for node, client in candig.UPSTREAMS.items()}
+UPSTREAM = next(iter(UPSTREAMS.values()))  # the single upstream, or the first node
+# event loop -> {count cache key -> task of the `/count` call in flight}, a task
+# can only be awaited on the loop it runs on
+_IN_FLIGHT = weakref.WeakKeyDictionary()
+
+
+async def discover(terms):
+    """Differentially private counts of `terms` in every CanDIG dataset
+
+    @param terms: a list of attributes of interest
+    @return: object of private counts per dataset, like `candig.private_data_filter`
+    """
+    results = candig.snapshot_results(terms)
+    if results is None:
+        with metrics.timed("datasets"):
+            candig_datasets = await datasets() if terms else []
+        results = await raw_results(candig_datasets, fields=terms)
+    return candig.private_data_filter(data=results, terms=terms, path="/results/patients")
+
+
+async def datasets():
+    """Dataset IDs from the CanDIG API, served from `candig.CATALOGUE`
+
+    The catalogue is refreshed in a background thread once it is loaded.
+    Only its first load waits on CanDIG, and that wait is moved off the
+    event loop.
+
+    @return: list of dataset IDs
+    """
+    if candig.CATALOGUE.loaded:
+        return candig.datasets()
+    return await asyncio.get_running_loop().run_in_executor(None, candig.datasets)
+
+
+def node_client(node):
+    """Upstream client of `node`, like `candig.node_client`
+
+    @raise ValueError: there is no such node
+    """
+    if node is None:
+        return UPSTREAM
+    try:
+        return UPSTREAMS[node]
+    except KeyError:
+        raise ValueError("Unknown CanDIG node {!r}".format(node))
+
+
+async def close():
+    """Close the connections to every node"""
+    for client in UPSTREAMS.values():
+        await client.close()
+
+
+async def raw_results(candig_datasets, fields=None, max_concurrency=CANDIG_FANOUT_WORKERS,
+                      timeout=CANDIG_COUNT_TIMEOUT, errors=None):
+    """Fetch raw results from CanDIG API, like `candig.raw_results`
+
+    @param candig_datasets: list of dataset IDs from CanDIG to fetch results from
+    @param fields: patient fields to fetch, `None` fetches all `PATIENT_FIELDS`
+    @param max_concurrency: maximum number of `/count` calls of this request
+    in flight at once per node
+    @param timeout: seconds to wait on the `/count` call of each dataset
+    @param errors: optional dict that collects the error message per dataset ID
+    @return: all the data for each dataset ID
+    """
+    queries = {}
+    for did in candig_datasets:
+        node, upstream_id = candig.split_dataset_id(did)
+        query = candig.prepare_count_query(upstream_id, fields)
+        if query:
+            queries[did] = (node, query)
+        else:
+            logger.error("Empty query received. You are likely missing dataset ID.")
+
+    # every node has its own slots, the calls to a slow node do not hold up the others
+    semaphores = {node: asyncio.Semaphore(max(1, max_concurrency))
+                  for node, _ in queries.values()}
+
+    async def count_outcome(node, query):
+        async with semaphores[node]:
+            try:
+                return await asyncio.wait_for(fetch_count(query, timeout, node), timeout)
+            except (aiohttp.ClientError, asyncio.TimeoutError, UpstreamUnavailable,
+                    ValueError) as e:
+                return e
+
+    outcomes = await asyncio.gather(*(count_outcome(node, query)
+                                      for node, query in queries.values()))
+
+    collective_counts = {}
+    for did, outcome in zip(queries, outcomes):
+        if isinstance(outcome, Exception):
+            logger.error("CanDIG count for dataset {} failed: {!r}".format(did, outcome))
+            if errors is not None:
+                errors[did] = str(outcome) or type(outcome).__name__
+        else:
+            collective_counts[did] = outcome
+    return collective_counts
+
+
+async def fetch_count(query, timeout=CANDIG_COUNT_TIMEOUT, node=None):
+    """Fetch the counts of one dataset from CanDIG API, like `candig.fetch_count`
+    Counts are served from and put in `candig.COUNT_CACHE`. A call for the
+    same query already in flight on this event loop is waited on rather
+    than made again.
+
+    @param query: query for the CanDIG count endpoint, see `candig.prepare_count_query`
+    @param timeout: seconds to wait on the upstream call
+    @param node: node the dataset is on, see `candig.split_dataset_id`
+    @return: the counts as dict
+    @raise aiohttp.ClientError: upstream call failed or returned an error status
+    @raise ValueError: upstream response is not JSON, or there is no such node
+    """
+    key = (candig.dataset_id(node, query.get("datasetId")), fingerprint(query))
+    counts = candig.COUNT_CACHE.get(key)
+    if counts is None:
+        in_flight = _IN_FLIGHT.setdefault(asyncio.get_running_loop(), {})
+        call = in_flight.get(key)
+        if call is None:
+            call = in_flight[key] = asyncio.ensure_future(
+                _fetch_count(key, query, timeout, node_client(node)))
+            call.add_done_callback(lambda _: in_flight.pop(key, None))
+        else:
+            metrics.UPSTREAM_COALESCED.labels("/count").inc()
+        # a caller that gives up must not cancel the call for the others
+        counts = await asyncio.shield(call)
+    return counts
+
+
+async def _fetch_count(key, query, timeout, client):
+    """Counts of one dataset from CanDIG, put in `candig.COUNT_CACHE`"""
+    started = time.monotonic()
+    try:
+        body = await client.post("/count", json_data=query,
+                                 headers=candig.DEFAULT_HEADERS, timeout=timeout)
+    except aiohttp.ClientResponseError as e:
+        metrics.observe_upstream("/count", time.monotonic() - started, e.status)
+        raise
+    except (aiohttp.ClientError, asyncio.TimeoutError, UpstreamUnavailable) as e:
+        metrics.observe_upstream("/count", time.monotonic() - started, type(e).__name__)
+        raise
+    metrics.observe_upstream("/count", time.monotonic() - started, 200)
+    counts = codec.loads(body)
+    candig.COUNT_CACHE.put(key, counts, len(body))
+    return counts
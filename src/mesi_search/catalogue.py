@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""Dataset catalogue
+
+Keeps the list of upstream dataset IDs in memory so that a discovery request
+does not have to ask the upstream for it every time.
+"""
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class DatasetCatalogue(object):
+    """In-memory list of dataset IDs, refreshed in the background
+
+    The first caller fetches the list and waits for it. After that the list
+    is served from memory. Once it is older than `refresh_interval` a
+    background thread fetches it again and the old list is served until the
+    new one is in. If that refresh fails the old list is kept.
+
+    @param fetch: function that returns the complete list of dataset IDs
+    @param refresh_interval: seconds after which the list is refreshed,
+    0 or less fetches it on every call
+    @param clock: function returning the current time in seconds
+    """
+
+    def __init__(self, fetch, refresh_interval=300.0, clock=time.monotonic):
+        self.fetch = fetch
+        self.refresh_interval = refresh_interval
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._ids = None
+        self._fetched_at = None
+        self._refreshing = False
+
+    @property
+    def loaded(self):
+        """Whether `ids` answers from memory, without waiting on a fetch"""
+        return self.refresh_interval > 0 and self._ids is not None
+
+    def ids(self):
+        """The dataset IDs
+
+        @return: list of dataset IDs
+        """
+        if self.refresh_interval <= 0:
+            return list(self.fetch())
+
+        with self._lock:
+            ids = self._ids
+            stale = ids is not None and \
+                self._clock() - self._fetched_at >= self.refresh_interval
+            if stale and not self._refreshing:
+                self._refreshing = True
+                threading.Thread(target=self._background_refresh, daemon=True).start()
+        if ids is None:
+            with self._load_lock:  # concurrent first callers wait on one fetch
+                if self._ids is None:
+                    self.refresh()
+                ids = self._ids
+        return list(ids)
+
+    def refresh(self):
+        """Fetch the dataset IDs now and swap them in"""
+        ids = list(self.fetch())
+        with self._lock:
+            self._ids = ids
+            self._fetched_at = self._clock()
+        logger.info("Dataset catalogue has {} dataset(s)".format(len(ids)))
+
+    def invalidate(self):
+        """Forget the dataset IDs, the next call fetches them again"""
+        with self._lock:
+            self._ids = None
+            self._fetched_at = None
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            logger.error("Refreshing the dataset catalogue failed, keeping the "
+                         "previous list: {}".format(e))
+        finally:
+            with self._lock:
+                self._refreshing = False
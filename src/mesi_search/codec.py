@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""JSON codec of the app and of the CanDIG responses
+
+Discovery responses with many datasets and categories spend a good part of
+their time in the `json` module of the standard library. `orjson` encodes
+and decodes the same documents several times faster, and is used when it
+is installed, unless `JSON_CODEC` is "json". It is optional, `pip install
+-e .[fast]` brings it in.
+
+`CODEC` has the `loads`/`dumps` of the JSON module in use. The Flask app
+parses request bodies with it (`JSONRequest`), answers with `jsonify`, and
+the CanDIG responses are parsed with `loads`.
+"""
+
+import json
+
+from flask import current_app, Request, Response
+from mesi_search.settings import JSON_CODEC
+
+try:
+    import orjson
+except ImportError:  # the fast codec is optional, `json` always works
+    orjson = None
+
+AVAILABLE = orjson is not None
+
+
+class StandardCodec(object):
+    """`json` of the standard library"""
+
+    name = "json"
+
+    @staticmethod
+    def loads(data):
+        """Document of a JSON `str` or `bytes`"""
+        return json.loads(data)
+
+    @staticmethod
+    def dumps(obj, sort_keys=False):
+        """Compact UTF-8 JSON `bytes` of `obj`"""
+        return json.dumps(obj, separators=(",", ":"), sort_keys=sort_keys,
+                          ensure_ascii=False).encode("utf-8")
+
+
+class OrjsonCodec(object):
+    """`orjson`, keys that are not strings are turned into strings like `json` does"""
+
+    name = "orjson"
+
+    @staticmethod
+    def loads(data):
+        """Document of a JSON `str` or `bytes`"""
+        return orjson.loads(data)
+
+    @staticmethod
+    def dumps(obj, sort_keys=False):
+        """Compact UTF-8 JSON `bytes` of `obj`"""
+        option = orjson.OPT_NON_STR_KEYS
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, option=option)
+
+
+def get_codec(name="auto"):
+    """Codec by name
+
+    @param name: "orjson", "json", or "auto" for `orjson` when it is installed
+    @return: `OrjsonCodec` or `StandardCodec`
+    @raise ValueError: unknown name, or "orjson" is asked for and not installed
+    """
+    if name == "auto":
+        name = "orjson" if AVAILABLE else "json"
+    if name == "json":
+        return StandardCodec
+    if name == "orjson":
+        if not AVAILABLE:
+            raise ValueError("JSON_CODEC is orjson, install it with `pip install -e .[fast]`")
+        return OrjsonCodec
+    raise ValueError("Unknown JSON_CODEC {!r}, use auto, orjson or json".format(name))
+
+
+CODEC = get_codec(JSON_CODEC)
+
+
+def loads(data):
+    """Document of a JSON `str` or `bytes`, with `CODEC`
+
+    @raise ValueError: `data` is not valid JSON
+    """
+    return CODEC.loads(data)
+
+
+def dumps(obj, sort_keys=False):
+    """Compact UTF-8 JSON `bytes` of `obj`, with `CODEC`"""
+    return CODEC.dumps(obj, sort_keys=sort_keys)
+
+
+def jsonify(obj):
+    """JSON response of `obj` with `CODEC`, like `flask.jsonify` outside of debug mode"""
+    body = dumps(obj, sort_keys=current_app.config["JSON_SORT_KEYS"])
+    return Response(body + b"\n", mimetype=current_app.config["JSONIFY_MIMETYPE"])
+
+
+class JSONRequest(Request):
+    """Flask request whose JSON body is parsed with `CODEC`"""
+
+    json_module = CODEC
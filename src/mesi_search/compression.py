@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""Compression of responses, negotiated with `Accept-Encoding`
+
+Discovery responses repeat the same attribute and category names for every
+dataset and compress well. Responses of at least `COMPRESS_MIN_BYTES` are
+sent brotli or gzip compressed to the clients that accept it, in the order
+of `COMPRESS_ENCODINGS`. Smaller ones are sent as they are, compressing
+them costs more than it saves.
+
+A compressed response with a strong ETag gets the ETag of its own, with
+the encoding appended, as two representations must not share one.
+
+Brotli needs the optional `brotli` package, `pip install -e .[fast]`
+brings it in. Without it only gzip is offered.
+"""
+
+import zlib
+
+from werkzeug.http import parse_accept_header
+from mesi_search import metrics
+from mesi_search.settings import (COMPRESS_BROTLI_QUALITY, COMPRESS_ENCODINGS,
+                                  COMPRESS_GZIP_LEVEL, COMPRESS_MIN_BYTES)
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always offered
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = frozenset(("application/json", "text/html", "text/plain"))
+BODILESS_STATUS_CODES = frozenset((204, 304))
+
+
+class Compressor(object):
+    """Compresses response bodies with the encoding a client prefers
+
+    @param min_bytes: smallest body that is compressed
+    @param encodings: "br" and/or "gzip", in order of preference when a
+    client accepts several equally. "br" is left out when `brotli` is not
+    installed. None of them disables compression.
+    @param gzip_level: zlib compression level, 1 (fast) to 9 (small)
+    @param brotli_quality: brotli quality, 0 (fast) to 11 (small)
+    """
+
+    def __init__(self, min_bytes=1024, encodings=("br", "gzip"), gzip_level=5,
+                 brotli_quality=4):
+        self.min_bytes = min_bytes
+        self.encodings = tuple(e for e in encodings if e == "gzip" or
+                               (e == "br" and brotli is not None))
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    def negotiate(self, accept_encodings):
+        """Encoding of the response
+
+        @param accept_encodings: `werkzeug.datastructures.Accept` of the
+        `Accept-Encoding` header
+        @return: the accepted encoding with the highest quality, `None` when
+        the client accepts none
+        """
+        best, best_quality = None, 0
+        for encoding in self.encodings:
+            quality = accept_encodings.quality(encoding)
+            if quality > best_quality:
+                best, best_quality = encoding, quality
+        return best
+
+    def representation_etags(self, etag):
+        """Strong ETags a response with the strong `etag` may be sent with
+
+        @return: list of `etag` and the ETags of its compressed representations
+        """
+        return [etag] + [encoded_etag(etag, encoding) for encoding in self.encodings]
+
+    def compress(self, data, encoding):
+        """`data` compressed with `encoding`, "br" or "gzip"
+
+        Same `data` gives the same bytes, the gzip header has no timestamp.
+        """
+        if encoding == "br":
+            return brotli.compress(data, quality=self.brotli_quality)
+        compressor = zlib.compressobj(self.gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return compressor.compress(data) + compressor.flush()
+
+    def encode(self, data, mimetype, accept_encoding):
+        """Body to send and its encoding
+
+        @param data: body as bytes
+        @param mimetype: mimetype of the body
+        @param accept_encoding: value of the `Accept-Encoding` header
+        @return: tuple of the body and its encoding, `None` when it is not
+        compressed
+        """
+        if mimetype not in COMPRESSIBLE_MIMETYPES or len(data) < self.min_bytes:
+            return data, None
+        encoding = self.negotiate(parse_accept_header(accept_encoding))
+        if encoding is None:
+            return data, None
+        with metrics.timed("compress"):
+            return self.compress(data, encoding), encoding
+
+    def compress_response(self, response, accept_encoding):
+        """Compress a Flask response in place, for an `after_request` hook
+
+        Responses without a body, streamed or already encoded are left alone,
+        but for the `Vary` header of a 304 that the full response would have
+        had. A strong ETag is replaced by the one of the compressed
+        representation.
+
+        @param response: `flask.Response`
+        @param accept_encoding: value of the `Accept-Encoding` header
+        @return: the response
+        """
+        if self.encodings and response.status_code == 304:
+            response.vary.add("Accept-Encoding")  # caches tell the ETags apart by it
+        if not self.encodings or response.mimetype not in COMPRESSIBLE_MIMETYPES or \
+                response.status_code in BODILESS_STATUS_CODES or \
+                response.direct_passthrough or response.is_streamed or \
+                "Content-Encoding" in response.headers:
+            return response
+        response.vary.add("Accept-Encoding")
+        data, encoding = self.encode(response.get_data(), response.mimetype, accept_encoding)
+        if encoding is not None:
+            response.set_data(data)
+            response.headers["Content-Encoding"] = encoding
+            etag, weak = response.get_etag()
+            if etag is not None and not weak:
+                response.set_etag(encoded_etag(etag, encoding))
+        return response
+
+
+def encoded_etag(etag, encoding):
+    """Strong ETag of the representation compressed with `encoding`"""
+    return "{}-{}".format(etag, encoding)
+
+
+COMPRESSOR = Compressor(min_bytes=COMPRESS_MIN_BYTES, encodings=COMPRESS_ENCODINGS,
+                        gzip_level=COMPRESS_GZIP_LEVEL, brotli_quality=COMPRESS_BROTLI_QUALITY)
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+"""Private directories of the app
+
+Sessions are pickled to files that are loaded again, so whoever can put a
+file in their directory can run code in the app. The directories the app
+keeps its state in are made readable and writable by its own user only,
+and a directory that someone else owns or may write to is refused.
+"""
+
+import os
+import stat
+
+
+def private_directory(path):
+    """Make `path` a directory only the user of this process can write to
+
+    Missing directories are made with mode 0700.
+
+    @param path: directory path
+    @return: the absolute path of the directory
+    @raise ValueError: `path` is not a directory, is a symlink, is owned by
+    another user or is writable by its group or others
+    """
+    path = os.path.abspath(path)
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode):
+        raise ValueError("{} is not a directory".format(path))
+    if info.st_uid != os.geteuid():
+        raise ValueError("{} is owned by uid {}, not by uid {} of the app".format(
+            path, info.st_uid, os.geteuid()))
+    if info.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise ValueError("{} is writable by its group or others, make it 0700".format(path))
+    return path
@@ -4,20 +4,91 @@ TODO: Send only the data from attrs_of_interest back to avoid sending changing d
 TODO: Add docker-compose
 """
 
-import json
+import hashlib
 import logging
+import time
 
 from flasgger import swag_from, Swagger
-from flask import Flask, jsonify, render_template, request, session
+from flask import abort, Flask, g, jsonify, render_template, request, Response, session
 from flask_limiter import Limiter
-from mesi_search import candig
-from mesi_search.swagger import SWAGGER_TEMPLATE, SWAGGER_CONFIG
+from flask_session import Session
+from mesi_search import candig, codec, metrics, ratelimit  # noqa: F401 registers sqlite://
+from mesi_search.compression import COMPRESSOR
+from mesi_search.files import private_directory
+from mesi_search.profiling import profiled
+from mesi_search.swagger import load_apispec, SWAGGER_TEMPLATE, SWAGGER_CONFIG
 from mesi_search.utils import authorize, flask_limiter_key
+from mesi_search.validation import DISCOVERY_BATCH_QUERY, DISCOVERY_QUERY
 
 APP = Flask(__name__)
+APP.request_class = codec.JSONRequest  # request bodies are parsed with `codec.CODEC`
+APP.config.from_object("mesi_search.settings")
 logger = logging.getLogger(__name__)
+if APP.config["SESSION_TYPE"] == "filesystem":
+    # sessions are pickled, nobody else may write to their directory
+    APP.config["SESSION_FILE_DIR"] = private_directory(APP.config["SESSION_FILE_DIR"])
+if APP.config["SESSION_TYPE"] != "cookie":
+    Session(APP)  # server-side sessions, the cookie only holds the session ID
+APP.session_interface = metrics.TimedSessionInterface(APP.session_interface)
 limiter = Limiter(APP)
+# one budget of noised releases for both discovery endpoints, a batch spends
+# one per distinct attribute set, see `spend_releases`
+discovery_limit = limiter.shared_limit(ratelimit.DISCOVERY_LIMIT, scope=ratelimit.DISCOVERY_SCOPE,
+                                       key_func=flask_limiter_key)
 SWAGGER = Swagger(APP, config=SWAGGER_CONFIG, decorators=[], template=SWAGGER_TEMPLATE)
+if not load_apispec(SWAGGER):
+    logger.warning("No prebuilt API spec, build it with bin/build_apispec.py")
+
+
+@APP.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+
+@APP.after_request
+def record_response(response):
+    if "request_started" in g:
+        metrics.observe_response(endpoint_label(), time.perf_counter() - g.request_started,
+                                 response.status_code)
+    return response
+
+
+@APP.after_request
+def compress(response):
+    return COMPRESSOR.compress_response(response, request.headers.get("Accept-Encoding", ""))
+
+
+@APP.errorhandler(429)
+def rate_limited(e):
+    metrics.RATE_LIMITED.labels(endpoint_label()).inc()
+    return e
+
+
+def endpoint_label():
+    """Route of the request, to label metrics with a bounded set of values"""
+    return request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+
+@APP.route('/metrics', methods=['GET'])
+@limiter.exempt
+def prometheus_metrics():
+    """Metrics in the Prometheus text format, of all gunicorn workers when
+    `PROMETHEUS_MULTIPROC_DIR` is set"""
+    body, content_type = metrics.latest()
+    return Response(body, content_type=content_type)
+
+
+@APP.route('/health', methods=['GET'])
+@limiter.exempt
+def health():
+    """Health of the worker, 503 when the count snapshot is too old to be served"""
+    snapshot = candig.SNAPSHOT.health()
+    healthy = snapshot["status"] != "stale"
+    health = {"status": "ok" if healthy else "degraded", "snapshot": snapshot,
+              "upstream": candig.UPSTREAM.breaker.state}
+    if candig.FEDERATED:
+        health["nodes"] = {node: client.breaker.state for node, client in candig.UPSTREAMS.items()}
+    return jsonify(health), 200 if healthy else 503
 
 
 @APP.route('/', methods=['GET'])
@@ -27,37 +98,190 @@ def home():
 
 
 @APP.route('/api/candig/patient', methods=['POST'])
-@limiter.limit("10/minute", key_func=flask_limiter_key)
-@swag_from('resources/discovery.yaml', validation=True)
+@discovery_limit
+@swag_from('resources/discovery.yaml')
+@DISCOVERY_QUERY
 @authorize
+@profiled
 def discover_candig_patient():
     """Search endpoint to discover possible data sets available"""
     logger.info("Request for patient discovery endpoint")
 
     result = {}
-    incoming_post_data = json.loads(request.data.decode("utf-8"))  # receives as bytes
+    incoming_post_data = request.json  # parsed and validated by `DISCOVERY_QUERY`
     attribute_of_interest = incoming_post_data.get("attributesOfInterest", [])
 
     logger.debug("Chosen attributes of interest are {}".format(attribute_of_interest))
 
-    # TODO: filter out results even prior for this view for better privacy
-    candig_datasets = candig.datasets()
-    raw_results = candig.raw_results(candig_datasets)
+    released = released_response(attribute_of_interest)
+    if released is not None:
+        return released
+
+    unknown_attributes = candig.unknown_attributes(attribute_of_interest)
+    if unknown_attributes:
+        return Response("Unknown attributes of interest: {}. Known attributes are: {}".format(
+            ", ".join(unknown_attributes), ", ".join(candig.PATIENT_FIELDS)), 400)
+
+    version, made_at = candig.counts_version(), time.time()
+    raw_results = candig.snapshot_results(attribute_of_interest)
+    if raw_results is None:
+        # only the attributes of interest are fetched, upstream leaves the rest out
+        with metrics.timed("datasets"):
+            candig_datasets = candig.datasets() if attribute_of_interest else []
+        raw_results = candig.raw_results(candig_datasets, fields=attribute_of_interest)
     # get the private data for attribute of interest
     private_filtered_data = candig.private_data_filter(data=raw_results,
                                                        terms=attribute_of_interest,
                                                        path="/results/patients")
-    # save attributes of interest to session, as well as result this is to save
-    # recalculation and send different data for the same user.
-    # TODO: Save the session in persistent storage
+    result = {"datasets": private_filtered_data}
+    with metrics.timed("serialize"):
+        response = codec.jsonify(result)
+    release = None
+    if APP.config["SESSION_RESULT_TTL"] > 0:
+        release = {"attributes": release_key(attribute_of_interest), "made_at": made_at,
+                   "version": version, "etag": result_etag(attribute_of_interest, response)}
+    if remember(attribute_of_interest, result, response.content_length, release) and \
+            release is not None:
+        with_etag(response, release["etag"])
+    return response
+
+
+@APP.route('/api/candig/patient/batch', methods=['POST'])
+@discovery_limit
+@swag_from('resources/discovery_batch.yaml')
+@DISCOVERY_BATCH_QUERY
+@authorize
+def discover_candig_patient_batch():
+    """Search endpoint to discover possible data sets available, for many
+    attribute sets at once. CanDIG is asked once for the union of the
+    attributes, then every distinct attribute set is filtered and noised once,
+    and spends one release of the discovery limit."""
+    logger.info("Request for patient batch discovery endpoint")
+
+    incoming_post_data = request.json  # parsed and validated by `DISCOVERY_BATCH_QUERY`
+    queries = [q["attributesOfInterest"] for q in incoming_post_data["queries"]]
+    if len(queries) > APP.config["CANDIG_BATCH_MAX_QUERIES"]:
+        return Response("At most {} queries can be sent at once".format(
+            APP.config["CANDIG_BATCH_MAX_QUERIES"]), 400)
+
+    distinct = {}  # release key -> attributes of its first query
+    for attributes in queries:
+        distinct.setdefault(tuple(release_key(attributes)), attributes)
+
+    all_attributes = list(dict.fromkeys(a for attributes in queries for a in attributes))
+    logger.debug("Chosen attributes of interest are {}".format(all_attributes))
+
+    unknown_attributes = candig.unknown_attributes(all_attributes)
+    if unknown_attributes:
+        return Response("Unknown attributes of interest: {}. Known attributes are: {}".format(
+            ", ".join(unknown_attributes), ", ".join(candig.PATIENT_FIELDS)), 400)
+
+    if not spend_releases(len(distinct)):
+        abort(429, "The batch holds {} distinct attribute sets, more than the releases "
+                   "left of {}".format(len(distinct), ratelimit.DISCOVERY_LIMIT))
+
+    raw_results = candig.snapshot_results(all_attributes)
+    if raw_results is None:
+        with metrics.timed("datasets"):
+            candig_datasets = candig.datasets() if all_attributes else []
+        raw_results = candig.raw_results(candig_datasets, fields=all_attributes)
+    # the same attribute set gets the same noised counts, not fresh noise to average
+    released = {key: {"datasets": candig.private_data_filter(data=raw_results, terms=attributes,
+                                                             path="/results/patients")}
+                for key, attributes in distinct.items()}
+    result = {"results": [released[tuple(release_key(attributes))] for attributes in queries]}
+    with metrics.timed("serialize"):
+        response = codec.jsonify(result)
+    remember(all_attributes, result, response.content_length)
+    return response
+
+
+def spend_releases(releases):
+    """Spend `releases` of the discovery limit of the client, the request
+    itself has spent one already
+
+    @param releases: noised releases the request makes
+    @return: whether they were left in the current window
+    """
+    view_rate_limit = g.get("view_rate_limit")
+    if releases <= 1 or not limiter.enabled or view_rate_limit is None:
+        return True
+    limit, identifiers = view_rate_limit[0], view_rate_limit[1:]
+    if limiter.limiter.get_window_stats(limit, *identifiers)[1] < releases - 1:
+        return False
+    for _ in range(releases - 1):
+        if not limiter.limiter.hit(limit, *identifiers):  # spent by another request meanwhile
+            return False
+    return True
+
+
+def remember(attribute_of_interest, result, size, release=None):
+    """Save attributes of interest to session, as well as result this is to save
+    recalculation and send different data for the same user.
+
+    @param attribute_of_interest: attributes of interest of the request
+    @param result: result sent back, not kept when it is too large
+    @param size: bytes of the result as JSON
+    @param release: facts of the result for `released_response`, `None`
+    when it is not to be sent again
+    @return: whether the result was kept
+    """
     attrs_of_interest_from_session = set(session.get("attributes_of_interest", []))
     attrs_of_interest_from_session.update(attribute_of_interest)
     session["attributes_of_interest"] = list(attrs_of_interest_from_session)
 
-    result = {"datasets": private_filtered_data}
-    session["result"] = result
+    session.pop("release", None)
+    if size <= APP.config["SESSION_RESULT_MAX_BYTES"]:
+        session["result"] = result
+        if release is not None:
+            session["release"] = release
+        return True
+    logger.warning("Result is too large to be kept in the session")
+    session.pop("result", None)
+    return False
+
+
+def released_response(attribute_of_interest):
+    """Response with the result released to this session for the same
+    attributes of interest, decided before any counts are fetched or noised.
+    A request whose `If-None-Match` has its ETag gets a `304 Not Modified`.
+
+    @param attribute_of_interest: attributes of interest of the request
+    @return: response, `None` when there is no such result, it is older than
+    `SESSION_RESULT_TTL` or the counts may have changed since
+    """
+    release = session.get("release")
+    if release is None or release["attributes"] != release_key(attribute_of_interest) or \
+            "result" not in session:
+        return None
+    if time.time() - release["made_at"] > APP.config["SESSION_RESULT_TTL"] or \
+            candig.counts_changed_since(release["made_at"], release["version"]):
+        return None
+    for etag in COMPRESSOR.representation_etags(release["etag"]):
+        if request.if_none_match.contains_weak(etag):  # weak comparison, RFC 7232 3.2
+            return with_etag(APP.response_class(status=304), etag)
+    with metrics.timed("serialize"):
+        return with_etag(codec.jsonify(session["result"]), release["etag"])
+
+
+def release_key(attribute_of_interest):
+    """Attributes of interest as a set, in the same order for the same set"""
+    return sorted(set(attribute_of_interest))
+
+
+def result_etag(attribute_of_interest, response):
+    """Strong ETag of a result, of its attribute set and its JSON body"""
+    digest = hashlib.sha256(codec.dumps(release_key(attribute_of_interest)))
+    digest.update(response.get_data())
+    return digest.hexdigest()[:32]
+
 
-    return jsonify(result)
+def with_etag(response, etag):
+    """`response` with `etag`, to be revalidated by the clients that keep it"""
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
 
 
 if __name__ == '__main__':
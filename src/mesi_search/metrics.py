@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""Prometheus metrics
+
+Time spent per stage of a discovery request, upstream calls and their
+status codes, API responses and rate limit rejections, exposed at
+`/metrics` in the Prometheus text format.
+
+Under gunicorn every worker has its own counters. Set
+`PROMETHEUS_MULTIPROC_DIR` to an empty directory before the workers start
+and they write their values there, `/metrics` then adds up the values of
+all workers whichever worker answers. `bin/gunicorn.conf.py` sets this up.
+"""
+
+import os
+import time
+
+from flask.sessions import SessionInterface
+from prometheus_client import (CollectorRegistry, CONTENT_TYPE_LATEST, Counter,
+                               generate_latest, Histogram, REGISTRY)
+from prometheus_client import multiprocess
+
+MULTIPROC_DIR_VARIABLE = "PROMETHEUS_MULTIPROC_DIR"
+# stages are fast in-process steps, the upstream calls take longer
+STAGE_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0)
+UPSTREAM_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+STAGE_SECONDS = Histogram(
+    "mesi_stage_seconds", "Seconds spent in a stage of a discovery request",
+    ["stage"], buckets=STAGE_BUCKETS)
+UPSTREAM_SECONDS = Histogram(
+    "mesi_upstream_request_seconds", "Seconds of CanDIG calls, retries included",
+    ["endpoint"], buckets=UPSTREAM_BUCKETS)
+UPSTREAM_RESPONSES = Counter(
+    "mesi_upstream_responses_total", "CanDIG calls by status code, or the error that "
+    "stopped them", ["endpoint", "status"])
+UPSTREAM_COALESCED = Counter(
+    "mesi_upstream_coalesced_total", "CanDIG calls not made because an identical one "
+    "was in flight", ["endpoint"])
+REQUEST_SECONDS = Histogram(
+    "mesi_request_seconds", "Seconds to answer an API request", ["endpoint"],
+    buckets=UPSTREAM_BUCKETS)
+RESPONSES = Counter(
+    "mesi_responses_total", "API responses by status code", ["endpoint", "status"])
+RATE_LIMITED = Counter(
+    "mesi_rate_limited_total", "API requests rejected by the rate limit", ["endpoint"])
+
+
+def timed(stage):
+    """Context manager that adds the time it takes to `stage`
+
+    Stages of a discovery request are `validation`, `datasets`, `filter`,
+    `noise`, `session_write`, `serialize` and `compress`.
+    """
+    return STAGE_SECONDS.labels(stage).time()
+
+
+def observe_upstream(endpoint, seconds, status):
+    """Record one CanDIG call
+
+    @param endpoint: URL segment that was called, like `/count`
+    @param seconds: time it took, retries included
+    @param status: status code, or the name of the error that stopped it
+    """
+    UPSTREAM_SECONDS.labels(endpoint).observe(seconds)
+    UPSTREAM_RESPONSES.labels(endpoint, str(status)).inc()
+
+
+def observe_response(endpoint, seconds, status):
+    """Record one API response"""
+    REQUEST_SECONDS.labels(endpoint).observe(seconds)
+    RESPONSES.labels(endpoint, str(status)).inc()
+
+
+def latest():
+    """Metrics of this process, or of all workers in multiprocess mode
+
+    @return: tuple of the body and its content type
+    """
+    if os.environ.get(MULTIPROC_DIR_VARIABLE):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid):
+    """Drop the live values of a worker that exited, call it from gunicorn's `child_exit`"""
+    if os.environ.get(MULTIPROC_DIR_VARIABLE):
+        multiprocess.mark_process_dead(pid)
+
+
+class TimedSessionInterface(SessionInterface):
+    """Session interface that times `save_session` as the `session_write` stage
+
+    Everything else is done by the wrapped interface.
+
+    @param interface: session interface to wrap
+    """
+
+    def __init__(self, interface):
+        self.interface = interface
+
+    def __getattr__(self, name):
+        return getattr(self.interface, name)
+
+    def open_session(self, app, request):
+        return self.interface.open_session(app, request)
+
+    def save_session(self, app, session, response):
+        started = time.perf_counter()
+        try:
+            return self.interface.save_session(app, session, response)
+        finally:
+            STAGE_SECONDS.labels("session_write").observe(time.perf_counter() - started)
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""Batched noise for differential privacy
+
+The Laplace mechanism of IBM's diff priv library, as built by
+`candig.create_laplace_mechanism`, adds noise to one value per call. Here
+the same mechanism draws the noise of a whole array of values in one go.
+"""
+
+import numpy as np
+
+
+class LaplaceNoise(object):
+    """Laplace mechanism for arrays of values
+
+    For (epsilon, delta) the noise has the scale
+    `sensitivity / (epsilon - log(1 - delta))` and is drawn by inverse
+    transform sampling, exactly like diffprivlib's `Laplace` mechanism, so it
+    gives the same privacy guarantee.
+
+    @param epsilon: Differential privacy main parameter for privacy;
+    lower means more privacy but less utility
+    @param delta: Differential privacy parameter for purity of diff priv
+    @param rng: numpy random `Generator`, a new one seeded by the OS by default
+    """
+
+    def __init__(self, epsilon, delta=0.0, rng=None):
+        if epsilon < 0:
+            raise ValueError("Epsilon must be non-negative")
+        if not 0 <= delta <= 1:
+            raise ValueError("Delta must be in [0, 1]")
+        if epsilon + delta == 0:
+            raise ValueError("Epsilon and Delta cannot both be zero")
+        self.epsilon = float(epsilon)
+        self.delta = float(delta)
+        self.rng = rng if rng is not None else np.random.default_rng()
+
+    def scale(self, sensitivity):
+        """Scale of the Laplace noise for `sensitivity`
+
+        @param sensitivity: sensitivity, or array of sensitivities
+        @return: scale, or array of scales
+        """
+        return np.asarray(sensitivity, dtype=float) / (self.epsilon - np.log(1 - self.delta))
+
+    def randomise(self, values, sensitivity):
+        """Randomise `values` with the mechanism
+
+        @param values: array of values
+        @param sensitivity: sensitivity of all values, or array with the
+        sensitivity of each value
+        @return: array of randomised values
+        """
+        values = np.asarray(values)
+        sensitivity = np.asarray(sensitivity)
+        if np.any(sensitivity < 0):
+            raise ValueError("Sensitivity must be non-negative")
+        # value - scale * sign(u) * log(1 - 2|u|), worked out in place to
+        # keep the number of temporary arrays down on large inputs
+        unif_rv = self.rng.random(values.shape)
+        unif_rv -= 0.5
+        noise = np.abs(unif_rv)
+        noise *= -2
+        noise += 1
+        np.log(noise, out=noise)
+        noise *= np.sign(unif_rv, out=unif_rv)
+        del unif_rv
+        noise *= sensitivity
+        noise /= self.epsilon - np.log(1 - self.delta)  # noise *= self.scale(sensitivity)
+        np.subtract(values, noise, out=noise)
+        return noise
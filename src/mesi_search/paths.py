@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""Path-based access to nested data
+
+`dpath.util.get` parses its path and glob-matches it against every key of
+the data on each call. The paths used here are mostly fixed keys, like
+`/results/patients` or an attribute of interest, so they are parsed once
+into an accessor that indexes the dicts and lists directly. Only paths that
+contain glob characters are left to `dpath`.
+"""
+
+import functools
+
+GLOB_CHARACTERS = frozenset("*?[]")
+
+
+def get(data, path):
+    """Value at `path` in `data`, like `dpath.util.get`
+
+    @param data: nested dicts and lists
+    @param path: `/` separated path, may contain globs
+    @return: the value at the path
+    @raise KeyError: nothing is found at the path
+    """
+    return compile_path(path)(data)
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_path(path):
+    """Accessor function for `path`, parsed once and cached
+
+    @param path: `/` separated path, may contain globs
+    @return: function that takes the data and returns the value at the path,
+    raising `KeyError` when nothing is found there
+    """
+    if path == "/":
+        return lambda data: data
+    if not GLOB_CHARACTERS.isdisjoint(path):
+        import dpath.util  # only needed for globs, not imported when the workers start
+
+        return functools.partial(dpath.util.get, glob=path)
+
+    segments = tuple(path.lstrip("/").split("/"))
+
+    def accessor(data):
+        try:
+            for segment in segments:
+                if isinstance(data, list):
+                    if not segment.isdigit():  # dpath only matches list positions
+                        raise KeyError(segment)
+                    data = data[int(segment)]
+                else:
+                    data = data[segment]
+        except (KeyError, IndexError, TypeError):
+            raise KeyError(path) from None
+        return data
+
+    return accessor
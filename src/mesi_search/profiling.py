@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""Opt-in profiling of single requests
+
+For operators chasing a slow discovery query in production. A request is
+profiled when it has the `X-Mesi-Profile` header set to `PROFILE_TOKEN`, or
+when it is drawn at `PROFILE_SAMPLE_RATE`. Its view then runs under
+`cProfile` and `tracemalloc`, and the profile is written to `PROFILE_DIR`:
+
+- `<name>.prof`: `pstats` data of the view, `python -m pstats <name>.prof`
+- `<name>.json`: attributes of interest, status code, seconds and the
+  lines that allocated the most memory during the request
+
+Only the newest `PROFILE_KEEP` profiles are kept. `cProfile` only sees the
+thread of the request, the `/count` calls made by the fan-out workers show
+up as the time spent waiting on them. One request is profiled at a time
+per worker, others that ask for it meanwhile run as usual.
+
+With no token and a sample rate of 0 nothing is profiled, and a request
+only pays for one attribute check.
+"""
+
+import cProfile
+import hmac
+import itertools
+import json
+import logging
+import os
+import random
+import threading
+import time
+import tracemalloc
+from functools import wraps
+
+from flask import request
+from mesi_search.files import private_directory
+from mesi_search.settings import (PROFILE_DIR, PROFILE_KEEP, PROFILE_SAMPLE_RATE,
+                                  PROFILE_TOKEN)
+
+HEADER = "X-Mesi-Profile"
+TOP_ALLOCATIONS = 20  # lines kept in the memory summary of a profile
+logger = logging.getLogger(__name__)
+
+
+class RequestProfiler(object):
+    """Profiles requests to views on demand or at a sampling rate
+
+    @param directory: directory the profiles are written to
+    @param sample_rate: fraction of requests profiled without being asked
+    @param token: value of the `X-Mesi-Profile` header that asks for a
+    profile, `None` ignores the header
+    @param keep: newest profiles kept, older ones are deleted
+    """
+
+    def __init__(self, directory, sample_rate=0.0, token=None, keep=50):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.token = token
+        self.keep = keep
+        self._lock = threading.Lock()  # cProfile and tracemalloc are one per process
+        self._sequence = itertools.count()  # tells apart profiles of the same second
+
+    @property
+    def enabled(self):
+        return self.sample_rate > 0 or bool(self.token)
+
+    def wanted(self, headers):
+        """Whether a request with `headers` is to be profiled"""
+        asked = headers.get(HEADER)
+        if asked and self.token and hmac.compare_digest(asked, self.token):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def profile(self, view, attributes, *args, **kwargs):
+        """Run `view` under the profilers and write its profile
+
+        @param view: view function
+        @param attributes: attributes of interest of the request, for the profile
+        @return: what `view` returns
+        """
+        if not self._lock.acquire(blocking=False):
+            return view(*args, **kwargs)
+        started_tracing = not tracemalloc.is_tracing()
+        try:
+            if started_tracing:
+                tracemalloc.start()
+            before = tracemalloc.take_snapshot()
+            profiler = cProfile.Profile()
+            started = time.perf_counter()
+            result = profiler.runcall(view, *args, **kwargs)
+            seconds = time.perf_counter() - started
+            allocations = tracemalloc.take_snapshot().compare_to(before, "lineno")
+            self.write(profiler, allocations, {
+                "path": request.path,
+                "attributes": attributes,
+                "status": _status(result),
+                "seconds": round(seconds, 6),
+            })
+            return result
+        finally:
+            if started_tracing:
+                tracemalloc.stop()
+            self._lock.release()
+
+    def write(self, profiler, allocations, summary):
+        """Write a profile and delete the oldest ones beyond `keep`
+
+        @param profiler: `cProfile.Profile` that ran the view
+        @param allocations: `tracemalloc.StatisticDiff`s, largest first
+        @param summary: JSON-serializable facts of the request
+        @return: path of the profile without extension, `None` if it could
+        not be written
+        """
+        name = "{}-{}-{}-{:.0f}ms".format(time.strftime("%Y%m%dT%H%M%S"), os.getpid(),
+                                          next(self._sequence), summary["seconds"] * 1000)
+        path = os.path.join(self.directory, name)
+        summary = dict(summary, allocations=[
+            {"where": str(stat.traceback), "size_kib": round(stat.size_diff / 1024, 1),
+             "count": stat.count_diff} for stat in allocations[:TOP_ALLOCATIONS]])
+        try:
+            private_directory(self.directory)
+            profiler.dump_stats(path + ".prof")
+            with open(path + ".json", "w") as f:
+                json.dump(summary, f, indent=2)
+            self._rotate()
+        except (OSError, ValueError) as e:
+            logger.error("Could not write the profile {}: {}".format(path, e))
+            return None
+        logger.info("Profiled {} in {:.1f} ms to {}".format(
+            summary["path"], summary["seconds"] * 1000, path))
+        return path
+
+    def _rotate(self):
+        profiles = sorted((entry.stat().st_mtime, entry.path[:-len(".prof")])
+                          for entry in os.scandir(self.directory)
+                          if entry.name.endswith(".prof"))
+        for _, path in profiles[:max(0, len(profiles) - self.keep)]:
+            for extension in (".prof", ".json"):
+                try:
+                    os.remove(path + extension)
+                except FileNotFoundError:
+                    pass
+
+
+def _status(result):
+    """Status code of what a view returned"""
+    if isinstance(result, tuple):
+        return result[1] if len(result) > 1 and isinstance(result[1], int) else 200
+    return getattr(result, "status_code", 200)
+
+
+PROFILER = RequestProfiler(PROFILE_DIR, sample_rate=PROFILE_SAMPLE_RATE, token=PROFILE_TOKEN,
+                           keep=PROFILE_KEEP)
+
+
+def profiled(view):
+    """Decorator that profiles the requests to `view` that `PROFILER` wants"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not PROFILER.enabled or not PROFILER.wanted(request.headers):
+            return view(*args, **kwargs)
+        data = request.get_json(silent=True)
+        attributes = data.get("attributesOfInterest") if isinstance(data, dict) else None
+        return PROFILER.profile(view, attributes, *args, **kwargs)
+    return wrapper
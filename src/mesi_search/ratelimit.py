@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""Rate limit storage shared by the worker processes of one host
+
+`limits` keeps its counters in the memory of each process by default, so
+with N gunicorn workers a client gets N times its limit. `SQLiteStorage`
+keeps them in a local SQLite database in WAL mode instead, that every
+worker of the host opens. No outside service is needed.
+
+Importing this module registers the `sqlite` scheme with `limits`:
+`RATELIMIT_STORAGE_URL=sqlite:////var/run/mesi-search/ratelimit.db`
+(four slashes for an absolute path). The directory of the database must be
+private to the user of the app. Only the fixed window strategies
+are supported, which is what Flask-Limiter uses by default.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from limits.storage import Storage
+from mesi_search.files import private_directory
+
+SCHEME = "sqlite"
+# noised discovery releases a client gets per window, one budget shared by the
+# single and batch endpoints of `mesi_search.main` and by `mesi_search.asgi`
+DISCOVERY_LIMIT = "10/minute"
+DISCOVERY_SCOPE = "discovery"
+PURGE_EVERY = 1000  # counter increments of a process between purges of expired counters
+_OPEN_LOCK = threading.Lock()  # taken to open the connection of a process
+
+_INCREMENT = """
+INSERT INTO counters (key, count, expires) VALUES (:key, 1, :expires)
+ON CONFLICT (key) DO UPDATE SET
+    count = CASE WHEN expires <= :now THEN 1 ELSE count + 1 END,
+    expires = CASE WHEN expires <= :now OR :elastic THEN :expires ELSE expires END
+"""
+# upsert and read back in one statement, from SQLite 3.35 on
+RETURNING = sqlite3.sqlite_version_info >= (3, 35)
+
+
+class SQLiteStorage(Storage):
+    """`limits` storage in a SQLite database in WAL mode
+
+    Every counter is a row with its count and the time it expires at. An
+    increment is one upsert that returns the count, or an upsert and a read
+    in a write transaction before SQLite 3.35, so it is atomic across
+    processes. Readers do not block writers. Every process has one
+    connection behind a lock, not one per thread, which under gevent or
+    eventlet would be one per greenlet. The database is only a scratch
+    pad, it is not synced to disk on commit.
+
+    @param uri: `sqlite:///relative/path` or `sqlite:////absolute/path`
+    @param timeout: seconds to wait for the write lock of the database
+    @raise ValueError: directory of the database is not private, see
+    `files.private_directory`
+    """
+
+    STORAGE_SCHEME = [SCHEME]
+
+    def __init__(self, uri=None, timeout=5.0, **options):
+        self.uri = uri
+        self.path = uri[len(SCHEME + ":///"):]
+        self.timeout = timeout
+        self._pid = None  # process the connection was opened in
+        self._increments = 0
+        # a database that someone else can swap would let them lift the limits
+        private_directory(os.path.dirname(os.path.abspath(self.path)))
+        super(SQLiteStorage, self).__init__(uri, **options)
+        # fail at start up rather than on the first request
+        with self._connection() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS counters (key TEXT PRIMARY KEY, "
+                               "count INTEGER NOT NULL, expires REAL NOT NULL) WITHOUT ROWID")
+
+    @contextmanager
+    def _connection(self):
+        """The connection of this process, held by one thread or greenlet at a time
+
+        A forked worker opens its own, a connection must not cross a fork.
+        """
+        if self._pid != os.getpid():
+            with _OPEN_LOCK:
+                if self._pid != os.getpid():
+                    self._lock = threading.Lock()
+                    self._db = sqlite3.connect(self.path, timeout=self.timeout,
+                                               isolation_level=None, check_same_thread=False)
+                    self._db.execute("PRAGMA synchronous=OFF")
+                    self._pid = os.getpid()
+        with self._lock:
+            yield self._db
+
+    def incr(self, key, expiry, elastic_expiry=False):
+        """Add one to the counter of `key`, a new or expired one starts at 1
+
+        @param key: rate limit key
+        @param expiry: seconds the counter lives from its first increment
+        @param elastic_expiry: whether every increment restarts `expiry`
+        @return: the count after the increment
+        """
+        now = time.time()
+        arguments = {"key": key, "expires": now + expiry, "now": now,
+                     "elastic": bool(elastic_expiry)}
+        with self._connection() as connection:
+            self._increments += 1
+            if self._increments % PURGE_EVERY == 0:
+                connection.execute("DELETE FROM counters WHERE expires <= ?", (now,))
+            if RETURNING:  # one statement is one transaction, done once all its rows are read
+                return connection.execute(_INCREMENT + " RETURNING count",
+                                          arguments).fetchall()[0][0]
+            with _write_transaction(connection):
+                connection.execute(_INCREMENT, arguments)
+                return connection.execute("SELECT count FROM counters WHERE key = ?",
+                                          (key,)).fetchone()[0]
+
+    def get(self, key):
+        """Count of `key`, 0 when it has expired"""
+        with self._connection() as connection:
+            row = connection.execute("SELECT count FROM counters WHERE key = ? AND expires > ?",
+                                     (key, time.time())).fetchone()
+        return row[0] if row else 0
+
+    def get_expiry(self, key):
+        """Time the counter of `key` expires at, in seconds since the epoch"""
+        now = time.time()
+        with self._connection() as connection:
+            row = connection.execute("SELECT expires FROM counters WHERE key = ? AND expires > ?",
+                                     (key, now)).fetchone()
+        return int(row[0] if row else now)
+
+    def check(self):
+        """Whether the database can be read"""
+        try:
+            with self._connection() as connection:
+                connection.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self):
+        """Drop every counter"""
+        with self._connection() as connection:
+            connection.execute("DELETE FROM counters")
+
+    def clear(self, key):
+        """Drop the counter of `key`"""
+        with self._connection() as connection:
+            connection.execute("DELETE FROM counters WHERE key = ?", (key,))
+
+
+@contextmanager
+def _write_transaction(connection):
+    """Write transaction that takes the write lock of the database up front"""
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+    connection.execute("COMMIT")
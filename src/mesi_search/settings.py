@@ -8,6 +8,8 @@ are required
 
 For examples, see `etc/dev/.env.bash` or `etc/dev/.env.fish`
 """
+import os
+
 from environs import Env as Env
 
 env = Env()
@@ -16,7 +18,92 @@ env.read_env()
 ENV = env.str("FLASK_ENV", default="production")
 DEBUG = env.bool("FLASK_DEBUG", default=False)
 TESTING = env.bool("FLASK_TESTING", default=False)
-CANDIG_UPSTREAM_API = env.str("CANDIG_UPSTREAM_API")
+# several CanDIG nodes as `name=url,name=url`, queried in parallel, see
+# `mesi_search.candig`. Their dataset IDs are namespaced as `name:id`. Without
+# them the single `CANDIG_UPSTREAM_API` is queried, its dataset IDs are kept as is
+CANDIG_UPSTREAM_APIS = env.dict("CANDIG_UPSTREAM_APIS", {})
+CANDIG_UPSTREAM_API = env.str("CANDIG_UPSTREAM_API", None) if CANDIG_UPSTREAM_APIS \
+    else env.str("CANDIG_UPSTREAM_API")
 SECRET_KEY = env.str("SECRET_KEY")
+# private directory the sessions, rate limit counters and profiles are kept in by
+# default, made 0700, see `mesi_search.files`. Not the shared temporary directory,
+# another local user could make the directories there first
+STATE_DIR = env.str("STATE_DIR", os.path.join(
+    os.environ.get("XDG_STATE_HOME") or os.path.join(os.path.expanduser("~"), ".local", "state"),
+    "mesi-search"))
+# rate limits of the API, only worth turning off for load tests
+RATELIMIT_ENABLED = env.bool("RATELIMIT_ENABLED", True)
+# counters of the rate limits, shared by the workers of a host through a local
+# SQLite database, see `mesi_search.ratelimit`. "memory://" keeps them per worker
+RATELIMIT_STORAGE_URL = env.str("RATELIMIT_STORAGE_URL", "sqlite:///" + os.path.join(
+    STATE_DIR, "ratelimit.db"))
 DP_EPSILON = env.float("DP_EPSILON")
 DP_DELTA = env.float("DP_DELTA", 0.0)  # it is ok to have pure ϵ dp if you want
+# number of `/count` calls to CanDIG that can be in flight at once per request,
+# 1 turns the per-dataset fan-out back into a sequential loop
+CANDIG_FANOUT_WORKERS = env.int("CANDIG_FANOUT_WORKERS", 8)
+CANDIG_COUNT_TIMEOUT = env.float("CANDIG_COUNT_TIMEOUT", 30.0)  # seconds, per dataset
+# pooled, keep-alive client for CanDIG, see `mesi_search.upstream`
+CANDIG_POOL_SIZE = env.int("CANDIG_POOL_SIZE", 10)
+CANDIG_CONNECT_TIMEOUT = env.float("CANDIG_CONNECT_TIMEOUT", 3.05)
+CANDIG_READ_TIMEOUT = env.float("CANDIG_READ_TIMEOUT", 30.0)
+CANDIG_RETRIES = env.int("CANDIG_RETRIES", 2)
+CANDIG_RETRY_BACKOFF = env.float("CANDIG_RETRY_BACKOFF", 0.2)  # seconds, doubled per retry
+CANDIG_BREAKER_THRESHOLD = env.int("CANDIG_BREAKER_THRESHOLD", 5)  # failures in a row
+CANDIG_BREAKER_RESET = env.float("CANDIG_BREAKER_RESET", 30.0)  # seconds to fail fast
+# connections to CanDIG per worker of the asyncio pipeline, see `mesi_search.asgi`
+CANDIG_ASYNC_POOL_SIZE = env.int("CANDIG_ASYNC_POOL_SIZE", 100)
+# cache of the raw (pre-noise) CanDIG `/count` results, a TTL of 0 disables it
+CANDIG_COUNT_CACHE_TTL = env.float("CANDIG_COUNT_CACHE_TTL", 300.0)  # seconds
+CANDIG_COUNT_CACHE_MAX_BYTES = env.int("CANDIG_COUNT_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+# dataset catalogue of CanDIG, kept in memory and refreshed in the background
+CANDIG_DATASETS_PAGE_SIZE = env.int("CANDIG_DATASETS_PAGE_SIZE", 1000)
+CANDIG_DATASETS_REFRESH = env.float("CANDIG_DATASETS_REFRESH", 300.0)  # seconds
+# seconds the listing of a federated node may take before its last one is used
+CANDIG_DATASETS_TIMEOUT = env.float("CANDIG_DATASETS_TIMEOUT", 30.0)
+# raw counts of every dataset kept in memory and refetched in the background every
+# `CANDIG_SNAPSHOT_REFRESH` seconds, 0 disables it. Discovery requests fetch the
+# counts themselves while it is loading or older than `CANDIG_SNAPSHOT_MAX_AGE`
+CANDIG_SNAPSHOT_REFRESH = env.float("CANDIG_SNAPSHOT_REFRESH", 0.0)  # seconds
+CANDIG_SNAPSHOT_MAX_AGE = env.float("CANDIG_SNAPSHOT_MAX_AGE", 900.0)  # seconds
+# parse `/count` responses while they are read, needs the optional `ijson` package
+CANDIG_STREAM_COUNTS = env.bool("CANDIG_STREAM_COUNTS", False)
+# attribute sets one request to `/api/candig/patient/batch` can hold, each distinct
+# one is noised once and spends one release of the discovery rate limit
+CANDIG_BATCH_MAX_QUERIES = env.int("CANDIG_BATCH_MAX_QUERIES", 10)
+# server-side sessions, only a signed session ID is kept in the cookie.
+# "filesystem" keeps them in `SESSION_FILE_DIR`, "cookie" keeps the whole
+# session in the cookie like plain Flask does
+SESSION_TYPE = env.str("SESSION_TYPE", "filesystem")
+SESSION_FILE_DIR = env.str("SESSION_FILE_DIR", os.path.join(STATE_DIR, "sessions"))
+SESSION_FILE_THRESHOLD = env.int("SESSION_FILE_THRESHOLD", 10000)  # sessions kept at most
+SESSION_USE_SIGNER = True
+PERMANENT_SESSION_LIFETIME = env.int("PERMANENT_SESSION_LIFETIME", 3600)  # seconds
+SESSION_RESULT_MAX_BYTES = env.int("SESSION_RESULT_MAX_BYTES", 256 * 1024)
+# the result released to a session is sent again, with its ETag, to requests of the
+# session for the same attributes of interest until the counts may have changed or
+# for at most this long. 0 makes a new result for every request, without ETags
+SESSION_RESULT_TTL = env.float("SESSION_RESULT_TTL", 300.0)  # seconds
+# JWT signatures are verified against the keys of this local JWKS file,
+# without it the JWTs are only decoded
+JWT_JWKS_FILE = env.str("JWT_JWKS_FILE", None)
+JWT_ALGORITHMS = env.list("JWT_ALGORITHMS", ["RS256"])
+JWT_AUDIENCE = env.str("JWT_AUDIENCE", None)
+JWT_VERIFIED_CACHE_SIZE = env.int("JWT_VERIFIED_CACHE_SIZE", 1024)  # tokens, 0 disables
+# opt-in profiling of single discovery requests, see `mesi_search.profiling`.
+# A request is profiled when its `X-Mesi-Profile` header is `PROFILE_TOKEN`
+# or when it is drawn at `PROFILE_SAMPLE_RATE`
+PROFILE_TOKEN = env.str("PROFILE_TOKEN", None)
+PROFILE_SAMPLE_RATE = env.float("PROFILE_SAMPLE_RATE", 0.0)  # fraction of requests
+PROFILE_DIR = env.str("PROFILE_DIR", os.path.join(STATE_DIR, "profiles"))
+PROFILE_KEEP = env.int("PROFILE_KEEP", 50)  # newest profiles kept
+# JSON codec of requests, responses and CanDIG responses, see `mesi_search.codec`.
+# "auto" uses the optional `orjson` package when it is installed
+JSON_CODEC = env.str("JSON_CODEC", "auto")
+# responses of at least `COMPRESS_MIN_BYTES` are compressed with the first of
+# `COMPRESS_ENCODINGS` that the client accepts, see `mesi_search.compression`.
+# "br" needs the optional `brotli` package, an empty list disables compression
+COMPRESS_MIN_BYTES = env.int("COMPRESS_MIN_BYTES", 1024)
+COMPRESS_ENCODINGS = env.list("COMPRESS_ENCODINGS", ["br", "gzip"])
+COMPRESS_GZIP_LEVEL = env.int("COMPRESS_GZIP_LEVEL", 5)  # 1 (fast) to 9 (small)
+COMPRESS_BROTLI_QUALITY = env.int("COMPRESS_BROTLI_QUALITY", 4)  # 0 (fast) to 11 (small)
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""Snapshot of the raw counts of every dataset
+
+Keeps the raw counts of all datasets in memory and refetches them in a
+background thread on a schedule, so that discovery requests only filter
+and noise counts that are already there.
+"""
+
+import logging
+import threading
+import time
+
+from mesi_search.cache import fingerprint
+
+logger = logging.getLogger(__name__)
+
+
+class CountSnapshot(object):
+    """Raw counts of every dataset, refreshed in the background
+
+    The background thread starts on first use, in the worker that uses it.
+    It fetches the counts every `refresh_interval` seconds and swaps the new
+    snapshot in whole. Until it is in, the previous snapshot is served.
+    Datasets whose counts could not be fetched keep their previous counts.
+    A snapshot older than `max_age` is not served, callers then fetch the
+    counts themselves, and `health` reports it. `version` tells whether the
+    counts changed between two refreshes, in any worker.
+
+    @param fetch: function that returns a tuple of the raw counts per
+    dataset ID and the dataset IDs whose counts could not be fetched
+    @param refresh_interval: seconds between the starts of two refreshes,
+    0 or less disables the snapshot
+    @param max_age: seconds after which a snapshot is too old to be served
+    @param clock: function returning the current time in seconds
+    """
+
+    def __init__(self, fetch, refresh_interval=0.0, max_age=900.0, clock=time.monotonic):
+        self.fetch = fetch
+        self.refresh_interval = refresh_interval
+        self.max_age = max_age
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._data = None
+        self._taken_at = None
+        self._version = None
+        self._last_error = None
+        self._refreshes = 0
+
+    @property
+    def enabled(self):
+        return self.refresh_interval > 0
+
+    def data(self):
+        """The raw counts per dataset ID, never waits on a fetch
+
+        @return: dict of the raw counts, `None` while there is no snapshot
+        or when it is older than `max_age`. Shared, do not change it.
+        """
+        if not self.enabled:
+            return None
+        self.start()
+        data, taken_at = self._data, self._taken_at
+        if data is None or self._clock() - taken_at > self.max_age:
+            return None
+        return data
+
+    def version(self):
+        """Fingerprint of the counts `data` serves, the same for the same counts
+
+        @return: hex string, `None` when `data` serves nothing
+        """
+        version = self._version
+        return version if self.data() is not None else None
+
+    def start(self):
+        """Start the background refresh, if it is not running yet"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopped.clear()
+                self._thread = threading.Thread(target=self._run, name="count-snapshot",
+                                                daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        """Stop the background refresh after the refresh in flight"""
+        self._stopped.set()
+
+    def refresh(self):
+        """Fetch the counts now and swap them in"""
+        data, failed = self.fetch()
+        previous = self._data or {}
+        kept = {did: previous[did] for did in failed if did in previous}
+        if kept:
+            logger.warning("Keeping the previous counts of {} dataset(s) that could not "
+                           "be fetched".format(len(kept)))
+            data = dict(data, **kept)
+        version = fingerprint(data)
+        with self._lock:
+            self._data = data
+            self._taken_at = self._clock()
+            self._version = version
+            self._refreshes += 1
+        logger.info("Count snapshot has {} dataset(s)".format(len(data)))
+
+    def invalidate(self):
+        """Forget the snapshot, it is served again after the next refresh"""
+        with self._lock:
+            self._data = None
+            self._taken_at = None
+            self._version = None
+
+    def health(self):
+        """State of the snapshot
+
+        @return: dict with `status` (`disabled`, `loading`, `ok` or `stale`),
+        `age` in seconds, number of `datasets`, number of `refreshes` and
+        the `last_error` of a refresh
+        """
+        with self._lock:
+            data, taken_at = self._data, self._taken_at
+            health = {"refreshes": self._refreshes, "last_error": self._last_error}
+        age = None if taken_at is None else self._clock() - taken_at
+        if not self.enabled:
+            status = "disabled"
+        elif data is None:
+            status = "loading"
+        elif age > self.max_age:
+            status = "stale"
+        else:
+            status = "ok"
+        health.update(status=status, age=age, datasets=len(data or {}))
+        return health
+
+    def _run(self):
+        while not self._stopped.is_set():
+            started = self._clock()
+            try:
+                self.refresh()
+                self._last_error = None
+            except Exception as e:
+                self._last_error = str(e) or type(e).__name__
+                logger.error("Refreshing the count snapshot failed, keeping the "
+                             "previous one: {}".format(e))
+            self._stopped.wait(max(0.0, self.refresh_interval - (self._clock() - started)))
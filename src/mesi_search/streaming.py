@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""Streaming parser for CanDIG `/count` responses
+
+Parses a `/count` response incrementally while it is read from the socket
+and only builds the attributes of interest of `results.patients[*]`.
+Everything else is tokenized and dropped on the fly, so the memory it takes
+grows with the selected attributes rather than with the whole response.
+
+Needs the optional `ijson` package, `AVAILABLE` tells whether it is there.
+"""
+
+try:
+    import ijson
+except ImportError:  # streaming is optional, callers fall back to `json`
+    ijson = None
+
+AVAILABLE = ijson is not None
+PATIENTS_PREFIX = "results.patients"
+PATIENT_PREFIX = PATIENTS_PREFIX + ".item"
+
+
+class CountingReader(object):
+    """File-like wrapper that counts the bytes read through it"""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.bytes_read += len(data)
+        return data
+
+
+class PatientsBuilder(object):
+    """Builds the entries of `results.patients` from the parse events under them
+
+    @param fields: patient fields to keep, the others are dropped
+    """
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.patients = []
+        self._patient = None
+        self._key = None
+        self._builder = None
+
+    def event(self, prefix, event, value):
+        """Take an `ijson.parse` event whose prefix starts with `PATIENT_PREFIX`"""
+        if self._builder is not None:
+            if prefix != PATIENT_PREFIX:  # still inside the value of the field
+                self._builder.event(event, value)
+                return
+            self._patient[self._key] = self._builder.value
+            self._builder = None
+
+        if prefix != PATIENT_PREFIX:
+            return
+        if event == "start_map":
+            self._patient = {}
+            self.patients.append(self._patient)
+        elif event == "map_key" and value in self.fields:
+            self._key = value
+            self._builder = ijson.ObjectBuilder()
+
+
+def parse_counts(fileobj, fields):
+    """Parse a `/count` response, keeping only `fields` of every patient entry
+
+    @param fileobj: file-like object with the JSON response
+    @param fields: patient fields to keep
+    @return: `{"results": {"patients": [{field: value}]}}`, with `results` and
+    `patients` only when they are in the response
+    @raise ValueError: response is not valid JSON
+    """
+    fields = frozenset(fields)
+    document = {}
+    builder = None
+    try:
+        for prefix, event, value in ijson.parse(fileobj, use_float=True):
+            if builder is not None and prefix.startswith(PATIENT_PREFIX):
+                builder.event(prefix, event, value)
+            elif prefix == PATIENTS_PREFIX and event == "start_array":
+                builder = PatientsBuilder(fields)
+                document["results"]["patients"] = builder.patients
+            elif prefix == "results" and event == "start_map":
+                document["results"] = {}
+    except ijson.JSONError as e:
+        raise ValueError("CanDIG count response is not valid JSON: {}".format(e)) from e
+    return document
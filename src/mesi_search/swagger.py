@@ -1,6 +1,17 @@
 # -*- coding: utf-8 -*-
-"""Swagger config"""
+"""Swagger config
 
+Flasgger assembles the API spec from the docstrings and YAML files of the
+views on the first request for it, in every worker. The spec is built once
+instead with `bin/build_apispec.py` into `APISPEC_FILE`, which the workers
+load as is. Build it again after changing the API.
+"""
+import json
+import os
+
+APISPEC_ENDPOINT = "apispec_1"
+APISPEC_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resources",
+                            "{}.json".format(APISPEC_ENDPOINT))
 
 SWAGGER_TEMPLATE = {
     "schemes": ["http", "https"],
@@ -18,8 +29,8 @@ SWAGGER_CONFIG = {
     ],
     "specs": [
         {
-            "endpoint": 'apispec_1',
-            "route": '/apispec_1.json',
+            "endpoint": APISPEC_ENDPOINT,
+            "route": '/{}.json'.format(APISPEC_ENDPOINT),
             "rule_filter": lambda rule: True,
             "model_filter": lambda tag: True,
         }
@@ -28,3 +39,34 @@ SWAGGER_CONFIG = {
     "swagger_ui": True,
     "specs_route": "/api"
 }
+
+
+def load_apispec(swagger, path=APISPEC_FILE):
+    """Serve the prebuilt API spec at `path` instead of assembling it
+
+    @param swagger: `flasgger.Swagger` of the app
+    @param path: spec built by `build_apispec`
+    @return: whether the prebuilt spec was loaded
+    """
+    try:
+        with open(path) as f:
+            swagger.apispecs[APISPEC_ENDPOINT] = json.load(f)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def build_apispec(swagger, path=APISPEC_FILE):
+    """Assemble the API spec with flasgger and write it to `path`
+
+    @param swagger: `flasgger.Swagger` of the app, without a prebuilt spec
+    @param path: file to write the spec to
+    @return: the spec
+    """
+    swagger.apispecs.pop(APISPEC_ENDPOINT, None)
+    with swagger.app.test_request_context():
+        spec = swagger.get_apispecs(APISPEC_ENDPOINT)
+    with open(path, "w") as f:
+        json.dump(spec, f, indent=2, sort_keys=True)
+        f.write("\n")
+    return spec
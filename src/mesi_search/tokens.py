@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""JWT verification against a local JSON Web Key Set
+
+The keys of the JWKS file are turned into key objects once and reused for
+every token. A token that passed verification is remembered by its digest
+until it expires, so the same client sending the same token again does not
+go through the signature check again.
+
+Everything needed is on disk, nothing is fetched over the network.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import jwt
+from jwt.algorithms import ECAlgorithm, HMACAlgorithm, RSAAlgorithm
+from jwt.exceptions import InvalidKeyError
+
+logger = logging.getLogger(__name__)
+
+# algorithms a key of each JWK type can verify, so that a token cannot pick
+# an algorithm of another family for a key, e.g. HS256 with an RSA public key
+KEY_TYPES = {
+    "RSA": (RSAAlgorithm, {"RS256", "RS384", "RS512", "PS256", "PS384", "PS512"}),
+    "EC": (ECAlgorithm, {"ES256", "ES384", "ES512"}),
+    "oct": (HMACAlgorithm, {"HS256", "HS384", "HS512"}),
+}
+
+
+class KeySet(object):
+    """Verification keys of a JWKS file
+
+    The file is read when the key set is made. It is read again when a token
+    names a key ID that is not in the set and the file changed since, which
+    picks up rotated keys without a restart.
+
+    @param path: path of the JWKS file, `{"keys": [JWK, ...]}`
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._keys = {}
+        self._mtime = None
+        self.load()
+
+    def load(self):
+        """Read the JWKS file and swap in its keys
+
+        @raise ValueError: the file is not a valid key set
+        """
+        mtime = os.stat(self.path).st_mtime
+        with open(self.path) as f:
+            try:
+                jwks = json.load(f)
+            except ValueError as e:
+                raise ValueError("JWKS file {} is not valid JSON: {}".format(self.path, e))
+        keys = {}
+        for jwk in jwks.get("keys", []):
+            if jwk.get("use", "sig") != "sig" or jwk.get("kty") not in KEY_TYPES:
+                continue
+            algorithm, algorithms = KEY_TYPES[jwk["kty"]]
+            if "alg" in jwk:
+                algorithms = algorithms & {jwk["alg"]}
+            try:
+                keys[jwk.get("kid")] = (algorithm.from_jwk(json.dumps(jwk)), algorithms)
+            except (InvalidKeyError, ValueError, KeyError) as e:
+                logger.error("Skipping key {} of {}: {}".format(jwk.get("kid"), self.path, e))
+        if not keys:
+            raise ValueError("JWKS file {} has no usable signing key".format(self.path))
+        with self._lock:
+            self._keys = keys
+            self._mtime = mtime
+        logger.info("Loaded {} key(s) from {}".format(len(keys), self.path))
+
+    def key(self, kid):
+        """Key object and algorithms of the key `kid`
+
+        A token without a key ID can only be verified by a set of one key.
+
+        @param kid: key ID from the token header, may be `None`
+        @return: `(key, algorithms)`
+        @raise jwt.InvalidTokenError: there is no such key
+        """
+        found = self._find(kid)
+        if found is None and self._changed():
+            self.load()
+            found = self._find(kid)
+        if found is None:
+            raise jwt.InvalidTokenError("No key {} in {}".format(kid, self.path))
+        return found
+
+    def _find(self, kid):
+        keys = self._keys
+        if kid is None and len(keys) == 1:
+            return next(iter(keys.values()))
+        return keys.get(kid)
+
+    def _changed(self):
+        try:
+            return os.stat(self.path).st_mtime != self._mtime
+        except OSError:
+            return False
+
+
+class TokenVerifier(object):
+    """Verifies JWTs and remembers the ones that passed until they expire
+
+    @param key_set: `KeySet` to verify signatures with
+    @param algorithms: algorithms a token may be signed with
+    @param audience: audience the tokens must be for, `None` to not check it
+    @param max_entries: number of verified tokens remembered at most, the
+    least recently used ones are forgotten first. 0 remembers none
+    @param clock: function returning the current UNIX time
+    """
+
+    def __init__(self, key_set, algorithms=("RS256",), audience=None, max_entries=1024,
+                 clock=time.time):
+        self.key_set = key_set
+        self.algorithms = frozenset(algorithms)
+        self.audience = audience
+        self.max_entries = max_entries
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._verified = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def verify(self, token):
+        """Claims of `token` once its signature and claims are verified
+
+        @param token: encoded JWT
+        @return: dict of claims
+        @raise jwt.InvalidTokenError: the token is not valid
+        """
+        digest = hashlib.sha256(token.encode("utf-8")).digest()
+        now = self._clock()
+        with self._lock:
+            entry = self._verified.get(digest)
+            if entry is not None and entry[0] > now:
+                self._verified.move_to_end(digest)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._verified[digest]
+            self.misses += 1
+
+        claims = self._decode(token)
+        expires = claims.get("exp")
+        if self.max_entries > 0 and isinstance(expires, (int, float)):
+            with self._lock:
+                self._verified[digest] = (expires, claims)
+                self._verified.move_to_end(digest)
+                while len(self._verified) > self.max_entries:
+                    self._verified.popitem(last=False)
+        return claims
+
+    def forget(self):
+        """Forget all verified tokens"""
+        with self._lock:
+            self._verified.clear()
+
+    def _decode(self, token):
+        header = jwt.get_unverified_header(token)
+        key, algorithms = self.key_set.key(header.get("kid"))
+        algorithms = algorithms & self.algorithms
+        if header.get("alg") not in algorithms:
+            raise jwt.InvalidAlgorithmError(
+                "Algorithm {} is not allowed for this key".format(header.get("alg")))
+        options = {"require_iat": True, "verify_aud": self.audience is not None}
+        return jwt.decode(token, key, algorithms=sorted(algorithms), audience=self.audience,
+                          options=options)
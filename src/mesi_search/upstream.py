@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""Upstream HTTP client
+
+A long lived client for the CanDIG API. Every worker process keeps one
+pooled `requests.Session` so the TCP/TLS connections to the upstream are
+kept alive and reused between calls instead of being opened per call.
+Calls have connect/read timeouts, are retried a bounded number of times
+with jittered backoff, and a circuit breaker fails them fast while the
+upstream is down.
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+from collections import namedtuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUS_CODES = frozenset([502, 503, 504])
+
+# what one call cost: number of attempts made, seconds spent over all attempts
+# and number of new connections opened to the upstream while it ran
+CallTiming = namedtuple("CallTiming", ["attempts", "elapsed", "new_connections"])
+
+
+class UpstreamUnavailable(requests.ConnectionError):
+    """Raised without calling the upstream while the circuit breaker is open"""
+
+
+class CircuitBreaker(object):
+    """Stops calls to an upstream that keeps failing
+
+    The breaker is closed to begin with. After `threshold` consecutive
+    failures it opens, and every call fails fast for `reset_timeout` seconds.
+    Then it is half open: one trial call is let through, which closes the
+    breaker again on success or re-opens it on failure.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return self.CLOSED
+        if self._clock() - self._opened_at < self.reset_timeout:
+            return self.OPEN
+        return self.HALF_OPEN
+
+    def allow(self):
+        """Whether a call may go to the upstream now
+
+        @return: boolean
+        """
+        with self._lock:
+            state = self._state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_running or self._failures >= self.threshold:
+                if self._opened_at is None:
+                    logger.error("Upstream failed {} times in a row, failing fast for "
+                                 "{} seconds".format(self._failures, self.reset_timeout))
+                self._opened_at = self._clock()
+            self._trial_running = False
+
+
+class UpstreamClient(object):
+    """Pooled, keep-alive HTTP client for one upstream API
+
+    @param base_url: upstream base URL that the call URL segments are added to
+    @param pool_size: maximum number of kept alive connections to the upstream
+    @param connect_timeout: seconds to wait for a connection to the upstream
+    @param read_timeout: default seconds to wait for the upstream to answer
+    @param retries: number of times a failed call is tried again
+    @param backoff: base seconds to wait before a retry, doubled per retry
+    @param breaker: `CircuitBreaker` guarding the upstream
+    """
+
+    def __init__(self, base_url, pool_size=10, connect_timeout=3.05, read_timeout=30.0,
+                 retries=2, backoff=0.2, breaker=None):
+        self.base_url = base_url
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self._lock = threading.Lock()
+        self._session = None
+        self._pid = None
+        self._stats = {"calls": 0, "attempts": 0, "retries": 0, "failures": 0,
+                       "rejected": 0, "elapsed": 0.0}
+
+    @property
+    def session(self):
+        """The `requests.Session` of this worker process, made on first use
+
+        A forked worker gets its own session so it never shares sockets
+        with its parent.
+        """
+        with self._lock:
+            if self._session is None or self._pid != os.getpid():
+                self._session = self._new_session()
+                self._pid = os.getpid()
+            return self._session
+
+    def _new_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers["Accept-Encoding"] = "gzip"
+        return session
+
+    def connections_opened(self):
+        """Number of connections opened to the upstream by this worker so far
+
+        @return: integer
+        """
+        if self._session is None:
+            return 0
+        opened = 0
+        for adapter in set(self._session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is not None:
+                    opened += pool.num_connections
+        return opened
+
+    def stats(self):
+        """Counters of this client, to see what retries and pooling cost or save
+
+        @return: dict of counters
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        stats["connections"] = self.connections_opened()
+        stats["breaker"] = self.breaker.state
+        return stats
+
+    def post(self, url, json_data=None, headers=None, timeout=None, deadline=None,
+             **kwargs):
+        """POST to the upstream
+
+        The `CallTiming` of the call is set on the returned response as
+        `upstream_timing`.
+
+        @param url: URL segment of the upstream API (not the base domain)
+        @param json_data: data to send as JSON
+        @param headers: headers of the call
+        @param timeout: seconds to wait for the answer, defaults to `read_timeout`
+        @param deadline: `time.monotonic()` after which no attempt is made or
+        waited on, the timeouts of the last attempt are cut to it. `None` lets
+        every attempt and retry take its full time
+        @return: `requests` response object
+        @raise UpstreamUnavailable: circuit breaker is open
+        @raise requests.RequestException: all attempts failed
+        """
+        if not self.breaker.allow():
+            self._count(rejected=1)
+            raise UpstreamUnavailable("Circuit breaker is open for {}".format(self.base_url))
+
+        request_url = self.base_url + url
+        read_timeout = timeout if timeout is not None else self.read_timeout
+        connections_before = self.connections_opened()
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                result = self.session.post(request_url, json=json_data, headers=headers,
+                                           timeout=self._timeouts(read_timeout, deadline),
+                                           **kwargs)
+                error = None
+            except (requests.ConnectionError, requests.Timeout) as e:
+                result, error = None, e
+            except Exception:
+                # not worth a retry (a bad gzip body, a broken chunk...), but
+                # the breaker must hear of it, or a half open trial never ends
+                self._count(calls=1, attempts=attempt, retries=attempt - 1, failures=1,
+                            elapsed=time.monotonic() - started)
+                self.breaker.record_failure()
+                raise
+
+            failed = error is not None or result.status_code in RETRY_STATUS_CODES
+            delay = self._retry_delay(attempt, deadline) if failed else None
+            if delay is None:
+                break
+            logger.warning("Upstream call to {} failed ({}), retrying in {:.3f} "
+                           "seconds".format(url, error or result.status_code, delay))
+            if result is not None:
+                result.close()  # give the connection back to the pool
+            time.sleep(delay)
+
+        timing = CallTiming(attempts=attempt, elapsed=time.monotonic() - started,
+                            new_connections=self.connections_opened() - connections_before)
+        self._count(calls=1, attempts=attempt, retries=attempt - 1,
+                    failures=int(failed), elapsed=timing.elapsed)
+        if failed:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        if error is not None:
+            raise error
+        result.upstream_timing = timing
+        return result
+
+    def _retry_delay(self, attempt, deadline):
+        """Seconds to wait before retrying failed `attempt`, `None` for no retry"""
+        if attempt > self.retries:
+            return None
+        delay = random.uniform(0, self.backoff * 2 ** (attempt - 1))  # full jitter
+        if deadline is not None and time.monotonic() + delay >= deadline:
+            return None  # no time left for another attempt
+        return delay
+
+    def _timeouts(self, read_timeout, deadline):
+        """Connect and read timeouts of an attempt, no longer than what is left to `deadline`"""
+        if deadline is None:
+            return self.connect_timeout, read_timeout
+        left = max(deadline - time.monotonic(), 0.001)
+        return min(self.connect_timeout, left), min(read_timeout, left)
+
+    def _count(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                self._stats[name] += value
@@ -2,17 +2,32 @@ import logging
 from functools import wraps
 
 import jwt
-from flask import request, Response, session
+from flask import g, request, Response, session
+
+from mesi_search.settings import JWT_ALGORITHMS, JWT_AUDIENCE, JWT_JWKS_FILE, \
+    JWT_VERIFIED_CACHE_SIZE
+from mesi_search.tokens import KeySet, TokenVerifier
 
 logger = logging.getLogger(__name__)
 
+if JWT_JWKS_FILE:
+    VERIFIER = TokenVerifier(KeySet(JWT_JWKS_FILE), algorithms=JWT_ALGORITHMS,
+                             audience=JWT_AUDIENCE, max_entries=JWT_VERIFIED_CACHE_SIZE)
+else:
+    VERIFIER = None
+    logger.warning("JWT_JWKS_FILE is not set, JWT signatures are NOT verified")
+
 
 def flask_limiter_key():
-    limiter_key = None
-    sub = session.get("sub", None)
+    """Rate limit key of the current request
+
+    @return: subject of the JWT, or of the session when there is no valid
+    JWT, otherwise the address of the client
+    """
+    sub = request_claims().get("sub") or session.get("sub", None)
     if sub:
-        limiter_key = sub
-    return limiter_key
+        return "sub:{}".format(sub)
+    return "addr:{}".format(request.remote_addr)
 
 
 def get_jwt(req):
@@ -26,39 +41,56 @@ def get_jwt(req):
         try:
             req_jwt = authorization_header.split(" ")[1]  # first part is "Bearer "
         except IndexError as ie:
-            logger.error("Authorization header is missing the JWT.", str(ie))
+            logger.error("Authorization header is missing the JWT: {}".format(ie))
     return req_jwt
 
 
 def decode_jwt(req):
+    """Claims of the JWT in the request, see `decode_token`
+
+    @param req: Flask `request` object
+    @return: dict of claims, empty if there is no valid JWT
+    """
+    return decode_token(get_jwt(req))
+
+
+def decode_token(req_jwt):
+    """Claims of a JWT
+
+    The signature is verified against `JWT_JWKS_FILE` when it is set,
+    otherwise the JWT is only decoded.
+
+    @param req_jwt: encoded JWT, may be empty
+    @return: dict of claims, empty if the JWT is not valid
+    """
     decoded_jwt = {}
-    req_jwt = get_jwt(req)
 
     if req_jwt != "":
         try:
-            # TODO: need to verify JWT with pub key
-            # TODO: need to check for claims that Vault sends in JWT
-            decoded_jwt = jwt.decode(req_jwt, verify=False,
-                                     options={'require': ['iat', 'sub']})
+            if VERIFIER is not None:
+                decoded_jwt = VERIFIER.verify(req_jwt)
+            else:
+                # TODO: need to check for claims that Vault sends in JWT
+                # without `JWT_AUDIENCE` any `aud` claim is fine, like with a JWKS
+                decoded_jwt = jwt.decode(req_jwt, audience=JWT_AUDIENCE, options={
+                    "verify_signature": False, "verify_aud": JWT_AUDIENCE is not None})
         except jwt.InvalidIssuedAtError as iisa:
-            logger.error("JWT has invalid Issued-At datetime ", str(iisa))
+            logger.error("JWT has invalid Issued-At datetime: {}".format(iisa))
         except jwt.ExpiredSignatureError as es:
-            logger.error("JWT has invalid or expired signature ", str(es))
-        except jwt.DecodeError as d:
-            logger.error("JWT could not be decoded for reasons ", str(d))
+            logger.error("JWT has expired: {}".format(es))
+        except jwt.InvalidTokenError as it:
+            logger.error("JWT is not valid: {}".format(it))
     return decoded_jwt
 
 
-def is_jwt_valid(req):
-    """Check for JWT's validity
+def request_claims():
+    """Claims of the JWT of the current request, decoded once per request
 
-    @param req: Flask `request` object
-    @return: boolean
+    @return: dict of claims, empty if there is no valid JWT
     """
-    is_request_authorized = False
-    if decode_jwt(req):
-        is_request_authorized = True
-    return is_request_authorized
+    if "jwt_claims" not in g:
+        g.jwt_claims = decode_jwt(request)
+    return g.jwt_claims
 
 
 def authorize(f):
@@ -70,12 +102,12 @@ def authorize(f):
 
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if not is_jwt_valid(request):
+        token = request_claims()
+        if "sub" not in token:
             return Response("Missing valid authentication token. Please provide your "
                             "JWT in the Authorization header as Bearer token.", 401)
         else:
             logger.info("Authorized to make requests to the API")
-            token = decode_jwt(request)
             session["authorized"] = True
             session["user"] = token["sub"]
             session["sub"] = token["sub"]
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""Validation of request bodies against the schemas of the API spec
+
+`swag_from(..., validation=True)` finds, reads and parses the YAML file of
+the view, resolves its schema and checks the schema itself on every
+request before it validates the body. Here that is done once, when the
+app starts, into a compiled `jsonschema` validator. Bodies that are
+plainly valid can skip even that through a fast path. Invalid bodies get
+the same 400 responses as with flasgger.
+"""
+
+import copy
+import os
+from functools import wraps
+
+import jsonschema
+import yaml
+from flask import abort, request, Response
+from jsonschema.exceptions import best_match
+from mesi_search import metrics
+
+RESOURCES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resources")
+
+
+class BodyValidator(object):
+    """Compiled validator of the body schema of a view
+
+    @param path: YAML spec of the view, relative to the `resources` directory
+    @param fast_path: function that takes the body and returns `True` only
+    for bodies that are valid, they are then not checked against the schema
+    """
+
+    def __init__(self, path, fast_path=None):
+        self.path = path
+        self.fast_path = fast_path
+        self.schema = load_body_schema(os.path.join(RESOURCES, path))
+        validator_class = jsonschema.validators.validator_for(self.schema)
+        validator_class.check_schema(self.schema)
+        self.validator = validator_class(self.schema)
+
+    def error(self, data):
+        """First error of `data` as `jsonschema.validate` would raise it, `None` if valid"""
+        if self.fast_path is not None and self.fast_path(data):
+            return None
+        return best_match(self.validator.iter_errors(data))
+
+    def __call__(self, view):
+        """Decorator that validates the JSON body of the requests to `view`"""
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            with metrics.timed("validation"):
+                data = request.json
+                if not data:
+                    abort(Response("No data to validate", status=400))
+                error = self.error(data)
+            if error is not None:
+                abort(Response(str(error), status=400))
+            return view(*args, **kwargs)
+        return wrapper
+
+
+def load_body_schema(path):
+    """Schema of the body parameter of a YAML spec, resolved like flasgger does
+
+    @param path: path of the YAML spec
+    @return: the JSON schema of the body
+    """
+    with open(path) as f:
+        spec = yaml.safe_load(f)
+    definitions = spec.get("definitions", {})
+    reference = next(param["schema"]["$ref"] for param in spec.get("parameters", [])
+                     if param.get("in") == "body")
+    schema_id = reference.split("/")[-1]
+    schema = copy.deepcopy(definitions[schema_id])
+    # flasgger sends an empty `definitions` along, the others are only
+    # needed for references, and they show up in the error messages
+    schema["definitions"] = {name: definition for name, definition in definitions.items()
+                             if name != schema_id} if "$ref" in repr(schema) else {}
+    return schema
+
+
+def is_discovery_query(data):
+    """Whether `data` is a plainly valid `DiscoveryQuery`"""
+    if type(data) is not dict:
+        return False
+    attributes = data.get("attributesOfInterest")
+    return type(attributes) is list and all(type(a) is str for a in attributes)
+
+
+DISCOVERY_QUERY = BodyValidator("discovery.yaml", fast_path=is_discovery_query)
+DISCOVERY_BATCH_QUERY = BodyValidator("discovery_batch.yaml")
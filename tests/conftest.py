@@ -1,5 +1,24 @@
 # -*- coding: utf-8 -*-
+import gzip
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import jwt
 import pytest
+from mesi_search import candig
+from mesi_search.upstream import CircuitBreaker, UpstreamClient
+
+
+@pytest.fixture(autouse=True)
+def empty_candig_caches():
+    """Every test starts without cached CanDIG datasets or counts"""
+    candig.CATALOGUE.invalidate()
+    candig.invalidate_counts()
+    yield
+    candig.CATALOGUE.invalidate()
+    candig.invalidate_counts()
 
 
 @pytest.fixture(scope="module")
@@ -32,3 +51,104 @@ def candig_raw_results():
         }
     }
     return test_data
+
+
+@pytest.fixture
+def app_client(mocker, candig_raw_results):
+    """Flask test client of the app with CanDIG mocked to return `candig_raw_results`"""
+    from mesi_search import main
+
+    mocker.patch("mesi_search.candig.datasets", lambda: list(candig_raw_results))
+    mocker.patch("mesi_search.candig.raw_results",
+                 lambda dataset_ids, **kwargs: {d: candig_raw_results[d] for d in dataset_ids})
+    mocker.patch.object(main.limiter, "enabled", False)
+    main.APP.config["TESTING"] = True
+    with main.APP.test_client() as client:
+        yield client
+
+
+@pytest.fixture
+def auth_headers():
+    """Authorization header with a JWT for the subject `tester`"""
+    token = jwt.encode({"sub": "tester", "iat": int(time.time())}, "not-so-secret")
+    if isinstance(token, bytes):
+        token = token.decode("utf-8")
+    return {"Authorization": "Bearer {}".format(token)}
+
+
+class StubNodeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        node = self.server
+        query = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if isinstance(query, str):  # `candig._datasets_page` sends a JSON string
+            query = json.loads(query)
+        node.seen.append((self.path, query))
+        node.arrivals.append(time.monotonic())
+        time.sleep(node.latency)
+        if node.failing:
+            status, result = 503, {}
+        elif self.path == "/datasets/search":
+            status, result = 200, {"results": {"datasets": [{"id": did} for did in node.results],
+                                               "total": len(node.results)}}
+        else:
+            result = node.results.get(query["datasetId"])
+            status = 200 if result else 404
+        body = json.dumps(result).encode("utf-8")
+        self.send_response(status)
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Type", "application/json")
+        if node.truncated == "chunked":  # announce a chunk of 1000 bytes, send 20 and hang up
+            self.send_header("Transfer-Encoding", "chunked")
+            body = b"3e8\r\n" + body[:20]
+        elif node.truncated:  # announce 1000 bytes, send 20 and hang up
+            self.send_header("Content-Length", "1000")
+            body = body[:20]
+        else:
+            self.send_header("Content-Length", str(len(body)))
+        self.close_connection = bool(node.truncated)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def candig_nodes(mocker):
+    """Starts local stub CanDIG nodes and federates `candig` over them
+
+    Call it with `{name: raw results per dataset ID}` and an optional
+    `{name: seconds}` of latency. Returns the stub servers by name, their
+    `seen` holds the `(path, query)` of every call, `arrivals` the
+    `time.monotonic()` it came in at, `failing` makes them answer 503 and
+    `truncated` hang up before the end of the body they announced, in a
+    chunk when it is `"chunked"`.
+    They answer gzip compressed to the clients that accept it.
+    """
+    servers = []
+
+    def start(results, latency=None):
+        nodes = {}
+        for name, node_results in results.items():
+            server = ThreadingHTTPServer(("127.0.0.1", 0), StubNodeHandler)
+            server.daemon_threads = True
+            server.results, server.failing, server.truncated = node_results, False, False
+            server.seen, server.arrivals = [], []
+            server.latency = (latency or {}).get(name, 0)
+            threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+            servers.append(server)
+            nodes[name] = server
+        mocker.patch.multiple(candig, FEDERATED=True, _node_datasets={}, UPSTREAMS={
+            name: UpstreamClient("http://127.0.0.1:{}".format(server.server_port),
+                                 retries=0, backoff=0, breaker=CircuitBreaker())
+            for name, server in nodes.items()})
+        return nodes
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import gzip
+import json
+
+import pytest
+
+pytest.importorskip("aiohttp")
+
+from mesi_search import asgi, ratelimit  # noqa: E402
+from mesi_search.ratelimit import SQLiteStorage  # noqa: E402
+
+
+def call(method, path, headers=None, body=b""):
+    """Call the ASGI app, return the status and the body of the response"""
+    scope = {"type": "http", "method": method, "path": path,
+             "headers": [(k.lower().encode("latin-1"), v.encode("latin-1"))
+                         for k, v in (headers or {}).items()]}
+    received = [{"type": "http.request", "body": body, "more_body": False}]
+    sent = []
+
+    async def receive():
+        return received.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(asgi.APP(scope, receive, send))
+    return sent[0]["status"], sent[1]["body"]
+
+
+def discover(headers, attributes):
+    return call("POST", asgi.DISCOVERY_PATH, headers,
+                json.dumps({"attributesOfInterest": attributes}).encode("utf-8"))
+
+
+@pytest.fixture
+def discover_results(mocker, candig_raw_results, tmp_path):
+    async def mock_discover(terms):
+        return {d: {t: candig_raw_results[d]["results"]["patients"][0][t] for t in terms}
+                for d in candig_raw_results}
+
+    mocker.patch("mesi_search.candig_async.discover", mock_discover)
+    storage = SQLiteStorage("sqlite:///{}".format(tmp_path / "ratelimit.db"))
+    mocker.patch.object(asgi, "STORAGE", storage)
+    mocker.patch.object(asgi, "LIMITER", asgi.FixedWindowRateLimiter(storage))
+
+
+def test_discover_patient(discover_results, auth_headers):
+    status, body = discover(auth_headers, ["causeOfDeath"])
+    assert status == 200
+    assert set(json.loads(body)["datasets"]) == {"dataset-1", "dataset-2"}
+
+
+def test_discover_patient_unauthorized(discover_results):
+    assert discover({}, ["causeOfDeath"])[0] == 401
+
+
+def test_discover_patient_bad_requests(discover_results, auth_headers):
+    status, body = discover(auth_headers, ["causeOfDeath", "shoeSize"])
+    assert status == 400 and b"shoeSize" in body
+    assert discover(auth_headers, "causeOfDeath")[0] == 400
+    assert call("POST", asgi.DISCOVERY_PATH, auth_headers, b"{")[0] == 400
+    assert call("POST", asgi.DISCOVERY_PATH, auth_headers,
+                b" " * (asgi.MAX_BODY_BYTES + 1))[0] == 413
+
+
+def test_discover_patient_rate_limited(discover_results, auth_headers):
+    statuses = [discover(auth_headers, ["causeOfDeath"])[0] for _ in range(11)]
+    assert statuses == [200] * 10 + [429]
+    # counted where the Flask app counts the discovery requests of `tester`
+    assert asgi.LIMITER.get_window_stats(asgi.DISCOVERY_LIMIT, "sub:tester",
+                                         ratelimit.DISCOVERY_SCOPE)[1] == 0
+
+
+def test_unknown_routes(auth_headers):
+    assert call("GET", asgi.DISCOVERY_PATH, auth_headers)[0] == 405
+    assert call("POST", "/nowhere", auth_headers)[0] == 404
+
+
+def test_discover_patient_compressed(discover_results, auth_headers, mocker):
+    mocker.patch.object(asgi.COMPRESSOR, "min_bytes", 0)
+    mocker.patch.object(asgi.COMPRESSOR, "encodings", ("gzip",))
+    scope = {"type": "http", "method": "POST", "path": asgi.DISCOVERY_PATH,
+             "headers": [(b"authorization", auth_headers["Authorization"].encode("latin-1")),
+                         (b"accept-encoding", b"gzip")]}
+    received = [{"type": "http.request", "more_body": False,
+                 "body": json.dumps({"attributesOfInterest": ["causeOfDeath"]}).encode("utf-8")}]
+    sent = []
+
+    async def receive():
+        return received.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(asgi.APP(scope, receive, send))
+    headers = dict(sent[0]["headers"])
+    assert headers[b"content-encoding"] == b"gzip"
+    assert headers[b"vary"] == b"Accept-Encoding"
+    assert int(headers[b"content-length"]) == len(sent[1]["body"])
+    assert set(json.loads(gzip.decompress(sent[1]["body"]))["datasets"]) == \
+        {"dataset-1", "dataset-2"}
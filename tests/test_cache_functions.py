@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+import pytest
+from mesi_search.cache import fingerprint, SingleFlight, TTLCache
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_fingerprint_ignores_key_order():
+    assert fingerprint({"a": 1, "b": [1, 2]}) == fingerprint({"b": [1, 2], "a": 1})
+    assert fingerprint({"a": 1}) != fingerprint({"a": 2})
+
+
+def test_ttl_cache_expiry():
+    clock = FakeClock()
+    cache = TTLCache(ttl=10, clock=clock)
+    cache.put("k", {"v": 1}, 10)
+    assert cache.get("k") == {"v": 1}
+    clock.now = 10.0
+    assert cache.get("k") is None
+    assert cache.stats()["expirations"] == 1
+    assert cache.stats()["bytes"] == 0
+
+
+def test_ttl_cache_lru_size_cap():
+    cache = TTLCache(ttl=10, max_bytes=30)
+    cache.put("a", 1, 10)
+    cache.put("b", 2, 10)
+    cache.put("c", 3, 10)
+    cache.get("a")  # "b" is now the least recently used
+    cache.put("d", 4, 10)
+    assert cache.get("b") is None
+    assert [cache.get(k) for k in "acd"] == [1, 3, 4]
+    cache.put("huge", 5, 31)  # bigger than the cap, never cached
+    assert cache.get("huge") is None
+    stats = cache.stats()
+    assert (stats["evictions"], stats["entries"], stats["bytes"]) == (1, 3, 30)
+
+
+def test_ttl_cache_disabled_and_invalidate():
+    disabled = TTLCache(ttl=0)
+    disabled.put("k", 1, 1)
+    assert disabled.get("k") is None
+
+    cache = TTLCache(ttl=10)
+    cache.put(("d1", "q"), 1, 1)
+    cache.put(("d2", "q"), 2, 1)
+    assert cache.invalidate(lambda key: key[0] == "d1") == 1
+    assert cache.get(("d2", "q")) == 2
+    assert cache.invalidate() == 1
+
+
+def test_single_flight_coalesces():
+    flights = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        release.wait(5)
+        return {"counts": 1}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flights.do("k", fetch)))
+               for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    while flights.stats()["calls"] < 5:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert sorted(shared for _, shared in results) == [False, True, True, True, True]
+    assert all(value == {"counts": 1} for value, _ in results)
+    assert flights.stats() == {"calls": 5, "coalesced": 4, "in_flight": 0}
+    assert flights.do("k", lambda: 2) == (2, False)  # nothing is kept once done
+
+
+def test_single_flight_shares_errors():
+    flights = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+
+    def fail():
+        started.set()
+        release.wait(5)
+        raise ValueError("upstream failed")
+
+    errors = []
+
+    def call():
+        try:
+            flights.do("k", fail)
+        except ValueError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=call)
+    follower.start()
+    while flights.stats()["coalesced"] < 1:
+        time.sleep(0.001)
+    release.set()
+    leader.join()
+    follower.join()
+    assert len(errors) == 2
+    with pytest.raises(KeyError):
+        flights.do("k", lambda: {}["missing"])
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+aiohttp = pytest.importorskip("aiohttp")
+
+from mesi_search import candig, candig_async  # noqa: E402
+from mesi_search.upstream import CircuitBreaker  # noqa: E402
+
+
+@pytest.fixture
+def count_server(candig_raw_results):
+    """Local CanDIG that answers `/count` from `candig_raw_results`, 503 for `flaky`"""
+    seen = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            query = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            seen.append(query)
+            result = candig_raw_results.get(query["datasetId"])
+            body = json.dumps(result).encode("utf-8")
+            self.send_response(200 if result else 503)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    server.seen = seen
+    server.url = "http://127.0.0.1:{}".format(server.server_port)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def async_upstream(count_server, mocker):
+    client = candig_async.AsyncUpstreamClient(count_server.url, CircuitBreaker(), backoff=0)
+    mocker.patch.object(candig_async, "UPSTREAM", client)
+    return client
+
+
+def run(coroutine):
+    async def run_and_close():
+        try:
+            return await coroutine
+        finally:
+            await candig_async.UPSTREAM.close()
+
+    return asyncio.run(run_and_close())
+
+
+def test_raw_results(async_upstream, count_server, candig_raw_results):
+    results = run(candig_async.raw_results(["dataset-1", "dataset-2"], fields=["causeOfDeath"]))
+    assert results == candig_raw_results
+    assert count_server.seen[0]["results"][0]["fields"] == ["causeOfDeath"]
+
+
+def test_raw_results_same_as_sync(async_upstream, candig_raw_results, mocker):
+    mocker.patch("mesi_search.candig.fetch_count",
+                 lambda query, timeout, **kwargs: candig_raw_results[query["datasetId"]])
+    dataset_ids = ["dataset-2", "dataset-1"]
+    async_results = run(candig_async.raw_results(dataset_ids, fields=["causeOfDeath"]))
+    assert async_results == candig.raw_results(dataset_ids, fields=["causeOfDeath"])
+    assert list(async_results) == dataset_ids
+
+
+def test_raw_results_failed_dataset(async_upstream, count_server):
+    errors = {}
+    results = run(candig_async.raw_results(["dataset-1", "flaky"], errors=errors))
+    assert list(results) == ["dataset-1"]
+    assert "503" in errors["flaky"]
+    assert sum(q["datasetId"] == "flaky" for q in count_server.seen) == 3  # retried twice
+
+
+def test_raw_results_timeout(async_upstream, mocker):
+    async def slow_post(*args, **kwargs):
+        await asyncio.sleep(1)
+
+    mocker.patch.object(async_upstream, "post", slow_post)
+    errors = {}
+    assert run(candig_async.raw_results(["dataset-1"], timeout=0.05, errors=errors)) == {}
+    assert "dataset-1" in errors
+
+
+def test_fetch_count_cached(async_upstream, count_server):
+    query = candig.prepare_count_query("dataset-1", ["causeOfDeath"])
+    first = run(candig_async.fetch_count(query))
+    assert run(candig_async.fetch_count(query)) == first
+    assert len(count_server.seen) == 1
+    assert candig.fetch_count(query) == first  # shared with the sync pipeline
+
+
+def test_fetch_count_coalesced(async_upstream, count_server, mocker):
+    mocker.patch.object(candig.COUNT_CACHE, "ttl", 0)
+    query = candig.prepare_count_query("dataset-1", ["causeOfDeath"])
+
+    async def burst():
+        return await asyncio.gather(*(candig_async.fetch_count(query) for _ in range(10)))
+
+    results = run(burst())
+    assert all(result == results[0] for result in results)
+    assert len(count_server.seen) == 1
+    assert not any(candig_async._IN_FLIGHT.values())
+
+
+def test_fetch_count_coalesced_per_event_loop(async_upstream, candig_raw_results, mocker):
+    query = candig.prepare_count_query("dataset-1", ["causeOfDeath"])
+    calls = []
+
+    async def fetch_count(key, query, timeout, client):
+        calls.append(asyncio.get_running_loop())
+        await asyncio.sleep(0.1)
+        return candig_raw_results["dataset-1"]
+
+    mocker.patch.object(candig_async, "_fetch_count", fetch_count)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(
+        asyncio.run(candig_async.fetch_count(query)))) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # a task of the other thread's loop cannot be awaited, each loop makes its own call
+    assert results == [candig_raw_results["dataset-1"]] * 2
+    assert len(calls) == 2 and calls[0] is not calls[1]
+
+
+def test_discover(async_upstream, mocker):
+    mocker.patch("mesi_search.candig.datasets", lambda: ["dataset-1", "dataset-2"])
+    result = run(candig_async.discover(["causeOfDeath"]))
+    assert set(result) == {"dataset-1", "dataset-2"}
+    assert set(result["dataset-1"]["causeOfDeath"]) == {"Cancer", "Heart"}
+
+
+def test_discover_no_terms(async_upstream, mocker):
+    datasets = mocker.patch("mesi_search.candig.datasets")
+    assert run(candig_async.discover([])) == {}
+    datasets.assert_not_called()
+
+
+def test_raw_results_federated(candig_nodes, candig_raw_results, mocker):
+    nodes = candig_nodes({"east": candig_raw_results, "west": candig_raw_results},
+                         latency={"west": 1.0})
+    clients = {node: candig_async.AsyncUpstreamClient(client.base_url, client.breaker, retries=0)
+               for node, client in candig.UPSTREAMS.items()}
+    mocker.patch.object(candig_async, "UPSTREAMS", clients)
+    errors = {}
+
+    async def fetch_and_close():
+        try:
+            return await candig_async.raw_results(
+                ["west:dataset-1", "east:dataset-1", "east:dataset-2"], fields=["causeOfDeath"],
+                timeout=0.1, errors=errors)
+        finally:
+            await candig_async.close()
+
+    results = asyncio.run(fetch_and_close())
+    assert results == {"east:dataset-1": candig_raw_results["dataset-1"],
+                       "east:dataset-2": candig_raw_results["dataset-2"]}
+    assert list(errors) == ["west:dataset-1"]
+    assert sorted(query["datasetId"] for _, query in nodes["east"].seen) == \
+        ["dataset-1", "dataset-2"]
+
+
+def test_post_ends_half_open_trial_on_broken_payload():
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            self.send_response(200)
+            self.send_header("Content-Length", "100")
+            self.end_headers()
+            self.wfile.write(b'{"results"')  # and hangs up
+            self.close_connection = True
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    now = [0.0]
+    breaker = CircuitBreaker(threshold=1, reset_timeout=10, clock=lambda: now[0])
+    breaker.record_failure()
+    now[0] = 10.0
+    client = candig_async.AsyncUpstreamClient(
+        "http://127.0.0.1:{}".format(server.server_port), breaker, retries=0)
+
+    async def post():
+        try:
+            await client.post("/count", json_data={})
+        finally:
+            await client.close()
+
+    with pytest.raises(aiohttp.ClientPayloadError):
+        asyncio.run(post())
+    server.shutdown()
+    server.server_close()
+    assert breaker.state == CircuitBreaker.OPEN
+    now[0] = 20.0
+    assert breaker.allow()  # a new trial, not stuck half open
@@ -1,4 +1,12 @@
 # -*- coding: utf-8 -*-
+import itertools
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
 from mesi_search import candig
 from requests.models import Response
 
@@ -7,7 +15,7 @@ def test_candig_datasets(mocker):
     """Testing the patching of the CanDIG API request with `datasets` call"""
     expected = ['WyJtb2NrMSJd', 'WyJtb2NrMiJd', 'WyJ0ZXN0MzAwIl0']
 
-    def mock_req(url, json_data):  # mock api request for datasets call
+    def mock_req(url, json_data, **kwargs):  # mock api request for datasets call
         r = Response()
         r.status_code = 200
         r._content = b'{"status": {"Known peers": 1, "Queried peers": 1, ' \
@@ -29,10 +37,61 @@ def test_candig_datasets(mocker):
     assert expected == actual
 
 
+def mock_datasets_search(all_ids, page_cap, with_total):
+    """Mock of the CanDIG dataset search that serves `all_ids` page by page"""
+    tokens = []
+
+    def mock_req(url, json_data, **kwargs):
+        query = json.loads(json_data)
+        tokens.append(query["pageToken"])
+        offset = int(query["pageToken"])
+        size = min(query["pageSize"], page_cap)
+        results = {"datasets": [{"id": did} for did in all_ids[offset:offset + size]]}
+        if offset + size < len(all_ids):
+            results["nextPageToken"] = str(offset + size)
+        if with_total:
+            results["total"] = len(all_ids)
+        r = Response()
+        r.status_code = 200
+        r._content = json.dumps({"results": results}).encode("utf-8")
+        return r
+
+    return mock_req, tokens
+
+
+def test_candig_fetch_datasets_pages_with_total(mocker):
+    """All pages are fetched when CanDIG caps the page size and tells the total"""
+    all_ids = ["dataset-{}".format(i) for i in range(25)]
+    mock_req, tokens = mock_datasets_search(all_ids, page_cap=10, with_total=True)
+    mocker.patch("mesi_search.candig.request", mock_req)
+
+    assert candig.fetch_datasets(page_size=1000) == all_ids
+    assert sorted(tokens) == [0, 10, 20]
+
+
+def test_candig_fetch_datasets_follows_page_token(mocker):
+    all_ids = ["dataset-{}".format(i) for i in range(25)]
+    mock_req, tokens = mock_datasets_search(all_ids, page_cap=1000, with_total=False)
+    mocker.patch("mesi_search.candig.request", mock_req)
+
+    assert candig.fetch_datasets(page_size=10) == all_ids
+    assert tokens == [0, "10", "20"]
+
+
+def test_candig_datasets_served_from_catalogue(mocker):
+    all_ids = ["dataset-1", "dataset-2"]
+    mock_req, tokens = mock_datasets_search(all_ids, page_cap=1000, with_total=True)
+    mocker.patch("mesi_search.candig.request", mock_req)
+
+    assert candig.datasets() == all_ids
+    assert candig.datasets() == all_ids
+    assert tokens == [0]
+
+
 def test_candig_raw_results(mocker):
     """Testing the patching CanDIG API request for `raw_results` call"""
 
-    def mock_req(url, json_data):  # mock api request for raw results
+    def mock_req(url, json_data, **kwargs):  # mock api request for raw results
         r = Response()
         r.status_code = 200
         r._content = b'{"status": {"Known peers": 1, "Queried peers": 1, ' \
@@ -78,12 +137,133 @@ def test_candig_raw_results(mocker):
     assert actual['WyJ0ZXN0MzAwIl0']['results']['patients'][0]['causeOfDeath']['Acute disease'] != 3
 
 
+def test_candig_raw_results_concurrent_matches_sequential(mocker):
+    """Fan-out over a thread pool gives the same results, in the same order"""
+    dataset_ids = ["dataset-{}".format(i) for i in range(12)]
+
+    def mock_req(url, json_data, **kwargs):
+        time.sleep(0.01 * (12 - int(json_data["datasetId"].split("-")[1])))
+        r = Response()
+        r.status_code = 200
+        r._content = '{{"results": {{"patients": [{{"gender": {{"{}": 1}}}}]}}}}'.format(
+            json_data["datasetId"]).encode("utf-8")
+        return r
+
+    mocker.patch("mesi_search.candig.request", mock_req)
+
+    sequential = candig.raw_results(dataset_ids, max_workers=1)
+    candig.invalidate_counts()
+    concurrent = candig.raw_results(dataset_ids, max_workers=4)
+    assert sequential == concurrent
+    assert list(sequential) == list(concurrent) == dataset_ids
+
+
+def test_candig_raw_results_dataset_failure(mocker):
+    """A failing dataset is reported while the other datasets are kept"""
+
+    def mock_req(url, json_data, **kwargs):
+        if json_data["datasetId"] == "slow":
+            raise requests.Timeout("read timed out")
+        r = Response()
+        r.status_code = 500 if json_data["datasetId"] == "broken" else 200
+        r._content = b'{"results": {"patients": [{"gender": {"Male": 3}}]}}'
+        return r
+
+    mocker.patch("mesi_search.candig.request", mock_req)
+
+    for workers in (1, 3):
+        candig.invalidate_counts()
+        errors = {}
+        actual = candig.raw_results(["ok", "slow", "broken"], max_workers=workers,
+                                    errors=errors)
+        assert list(actual) == ["ok"]
+        assert set(errors) == {"slow", "broken"}
+
+
+def test_candig_raw_results_cached(mocker):
+    """Raw counts are fetched once per dataset and query until invalidated"""
+    calls = []
+
+    def mock_req(url, json_data, **kwargs):
+        calls.append(json_data["datasetId"])
+        r = Response()
+        r.status_code = 200
+        r._content = b'{"results": {"patients": [{"gender": {"Male": 3}}]}}'
+        return r
+
+    mocker.patch("mesi_search.candig.request", mock_req)
+    before = candig.COUNT_CACHE.stats()
+
+    first = candig.raw_results(["d1", "d2"])
+    assert candig.raw_results(["d1", "d2"]) == first
+    assert sorted(calls) == ["d1", "d2"]
+
+    candig.invalidate_counts("d1")
+    candig.raw_results(["d1", "d2"])
+    assert sorted(calls) == ["d1", "d1", "d2"]
+    after = candig.COUNT_CACHE.stats()
+    assert [after[k] - before[k] for k in ("hits", "misses", "invalidations")] == [3, 3, 1]
+
+
+def test_candig_raw_results_streamed(mocker, candig_nodes):
+    """Streamed `/count` responses filter to exactly the same data"""
+    pytest.importorskip("ijson")
+    candig_nodes({"node": {"d1": {
+        "status": {"Valid response": True},
+        "results": {"patients": [{
+            "dateOfBirth": {"1970-01-0{}".format(i): 1 for i in range(1, 10)},
+            "gender": {"Male": 3, "Female": 4},
+            "causeOfDeath": {"Cancer": 3, "Stroke": 1},
+        }]},
+    }}})
+    terms = ["causeOfDeath", "gender"]
+    parsed = candig.raw_results(["node:d1"], fields=terms)
+
+    candig.invalidate_counts()
+    mocker.patch("mesi_search.candig.CANDIG_STREAM_COUNTS", True)
+    stream = mocker.spy(candig, "_stream_count")
+    streamed = candig.raw_results(["node:d1"], fields=terms)
+    assert stream.call_count == 1
+    assert streamed == {"node:d1": {"results": {"patients": [
+        {"gender": {"Male": 3, "Female": 4}, "causeOfDeath": {"Cancer": 3, "Stroke": 1}}]}}}
+    assert json.dumps(candig.data_filter(streamed, terms, "/results/patients")) == \
+        json.dumps(candig.data_filter(parsed, terms, "/results/patients"))
+
+
 def test_candig_prepare_count_query():
     dataset_id = "qwerty123"
     query = candig.prepare_count_query(dataset_id)
     assert query["datasetId"] == dataset_id
 
 
+def test_candig_prepare_count_query_projection():
+    query = candig.prepare_count_query("qwerty123", ["causeOfDeath", "gender"])
+    assert query["results"][0]["fields"] == ["gender", "causeOfDeath"]
+    assert candig.prepare_count_query("qwerty123")["results"][0]["fields"] == \
+        list(candig.PATIENT_FIELDS)
+    assert candig.prepare_count_query(None, ["gender"]) == {}
+
+
+def test_candig_raw_results_projected(mocker):
+    queries = []
+
+    def mock_req(url, json_data, **kwargs):
+        queries.append(json_data)
+        r = Response()
+        r.status_code = 200
+        r._content = b'{"results": {"patients": [{"gender": {"Male": 3}}]}}'
+        return r
+
+    mocker.patch("mesi_search.candig.request", mock_req)
+    candig.raw_results(["d1"], fields=["gender"])
+    assert queries[0]["results"][0]["fields"] == ["gender"]
+
+
+def test_candig_unknown_attributes():
+    assert candig.unknown_attributes(["gender", "causeOfDeath"]) == []
+    assert candig.unknown_attributes(["gender", "shoeSize"]) == ["shoeSize"]
+
+
 def test_candig_filter(candig_raw_results):
     test_data = candig_raw_results
     filtered_result = candig.data_filter(data=test_data, terms=["causeOfDeath"],
@@ -94,6 +274,27 @@ def test_candig_filter(candig_raw_results):
     assert filtered_result["dataset-2"]["causeOfDeath"]["Heart"] == 33
 
 
+def test_candig_count_table(candig_raw_results):
+    data = dict(candig_raw_results, **{
+        "dataset-3": {"results": {"patients": [{"causeOfDeath": {}, "gender": {"Male": 4}}]}}})
+    table = candig.count_table(data=data, terms=["causeOfDeath", "gender"],
+                               path="/results/patients")
+    assert table.to_dict() == {
+        "dataset-1": {"causeOfDeath": {"Cancer": 32, "Heart": 23}},
+        "dataset-2": {"causeOfDeath": {"Cancer": 11, "Heart": 33}},
+        "dataset-3": {"causeOfDeath": {}, "gender": {"Male": 4}},
+    }
+    assert table.categories == {"causeOfDeath": ["Cancer", "Heart"], "gender": ["Male"]}
+    expected = [candig.get_sensitivity(counts) for dataset in table.to_dict().values()
+                for counts in dataset.values()]
+    assert table.sensitivities().tolist() == expected == [9, 22, 1, 1]
+
+    noised = table.randomized(candig.create_noise_mechanism(1.0))
+    assert noised.counts is not table.counts
+    assert table.to_dict()["dataset-1"]["causeOfDeath"] == {"Cancer": 32, "Heart": 23}
+    assert noised.to_dict().keys() == table.to_dict().keys()
+
+
 def test_candig_private_filter(candig_raw_results):
     """Test differentially private filter without setting anything"""
     test_data = candig_raw_results
@@ -101,3 +302,163 @@ def test_candig_private_filter(candig_raw_results):
                                     path="/results/patients")
     assert ps["dataset-1"]["causeOfDeath"]["Cancer"] != 0
     assert ps["dataset-2"]["causeOfDeath"]["Cancer"] != 0
+
+
+def test_candig_request_passes_stream(mocker):
+    post = mocker.patch.object(candig.UPSTREAM, "post")
+    post.return_value.upstream_timing = mocker.Mock(elapsed=0.01, attempts=1, new_connections=0)
+    candig.request(url="/count", json_data={}, stream=True)
+    assert post.call_args[1]["stream"] is True
+
+
+def test_candig_fetch_count_coalesced(mocker):
+    mocker.patch.object(candig.COUNT_CACHE, "ttl", 0)
+    release = threading.Event()
+    calls = []
+
+    def slow_request(url, json_data, **kwargs):
+        calls.append(url)
+        release.wait(5)
+        return mocker.Mock(content=b'{"results": {"patients": []}}')
+
+    mocker.patch("mesi_search.candig.request", slow_request)
+    query = candig.prepare_count_query("d1", ["gender"])
+    coalesced = candig.FLIGHTS.stats()["coalesced"]
+    with ThreadPoolExecutor(max_workers=5) as pool:
+        futures = [pool.submit(candig.fetch_count, query) for _ in range(5)]
+        while candig.FLIGHTS.stats()["coalesced"] < coalesced + 4:
+            time.sleep(0.001)
+        release.set()
+    assert all(f.result() == {"results": {"patients": []}} for f in futures)
+    assert calls == ["/count"]
+
+
+def test_candig_fetch_snapshot_bypasses_cache(mocker, candig_raw_results):
+    mocker.patch("mesi_search.candig.datasets", lambda: ["dataset-1", "flaky"])
+    calls = []
+
+    def mock_req(url, json_data, **kwargs):
+        calls.append(json_data["datasetId"])
+        result = candig_raw_results.get(json_data["datasetId"])
+        response = Response()
+        response.status_code = 200 if result else 503
+        response._content = json.dumps(result).encode("utf-8")
+        return response
+
+    mocker.patch("mesi_search.candig.request", mock_req)
+    candig.fetch_snapshot()
+    results, failed = candig.fetch_snapshot()
+    assert list(results) == ["dataset-1"] and failed == ["flaky"]
+    assert calls.count("dataset-1") == 2
+    assert candig.prepare_count_query("dataset-1")["results"][0]["fields"] == \
+        list(candig.PATIENT_FIELDS)
+
+
+def node_results(candig_raw_results, factor):
+    """`candig_raw_results` with every count times `factor`, to tell nodes apart"""
+    return {did: {"results": {"patients": [
+        {term: {category: count * factor for category, count in counts.items()}
+         for term, counts in patient.items()}
+        for patient in result["results"]["patients"]]}}
+        for did, result in candig_raw_results.items()}
+
+
+def test_federated_datasets(candig_nodes, candig_raw_results):
+    nodes = candig_nodes({"east": candig_raw_results, "west": candig_raw_results})
+    assert candig.fetch_datasets() == ["east:dataset-1", "east:dataset-2",
+                                       "west:dataset-1", "west:dataset-2"]
+    assert all(path == "/datasets/search" for node in nodes.values() for path, _ in node.seen)
+
+
+def test_federated_datasets_node_down(candig_nodes, candig_raw_results):
+    nodes = candig_nodes({"east": candig_raw_results, "west": {"dataset-3": {}}})
+    assert candig.fetch_datasets() == ["east:dataset-1", "east:dataset-2", "west:dataset-3"]
+    nodes["west"].failing = True
+    assert candig.fetch_datasets() == ["east:dataset-1", "east:dataset-2", "west:dataset-3"]
+    nodes["east"].failing = True
+    with pytest.raises(requests.HTTPError):
+        candig.fetch_datasets()
+
+
+def test_federated_datasets_slow_node(candig_nodes, candig_raw_results):
+    nodes = candig_nodes({"east": candig_raw_results, "west": {"dataset-3": {}}})
+    assert candig.fetch_datasets() == ["east:dataset-1", "east:dataset-2", "west:dataset-3"]
+    nodes["west"].results = {"dataset-4": {}}
+    nodes["west"].latency = 1.0
+    started = time.monotonic()
+    # west is not waited on, it keeps its last listing
+    assert candig.fetch_datasets(timeout=0.2) == \
+        ["east:dataset-1", "east:dataset-2", "west:dataset-3"]
+    assert time.monotonic() - started < 0.5
+
+
+def test_federated_raw_results(candig_nodes, candig_raw_results):
+    nodes = candig_nodes({"east": candig_raw_results,
+                          "west": node_results(candig_raw_results, 10)})
+    dataset_ids = ["west:dataset-2", "east:dataset-1", "west:dataset-1"]
+    results = candig.raw_results(dataset_ids, fields=["causeOfDeath"])
+    assert list(results) == dataset_ids
+    assert results["east:dataset-1"] == candig_raw_results["dataset-1"]
+    assert results["west:dataset-1"] == node_results(candig_raw_results, 10)["dataset-1"]
+    assert sorted(query["datasetId"] for _, query in nodes["west"].seen) == \
+        ["dataset-1", "dataset-2"]  # the IDs on the node, not namespaced
+    assert set(candig.private_data_filter(results, ["causeOfDeath"], "/results/patients")) == \
+        set(dataset_ids)
+
+
+def test_federated_raw_results_unknown_node(candig_nodes, candig_raw_results):
+    candig_nodes({"east": candig_raw_results})
+    errors = {}
+    results = candig.raw_results(["east:dataset-1", "north:dataset-1"], errors=errors)
+    assert list(results) == ["east:dataset-1"]
+    assert "north" in errors["north:dataset-1"]
+
+
+def test_federated_raw_results_streamed_truncated(mocker, candig_nodes, candig_raw_results):
+    nodes = candig_nodes({"east": candig_raw_results, "west": candig_raw_results})
+    mocker.patch("mesi_search.candig.CANDIG_STREAM_COUNTS", True)
+    dataset_ids = ["west:dataset-1", "east:dataset-1", "west:dataset-2", "east:dataset-2"]
+    for truncated, max_workers in itertools.product(("length", "chunked"), (1, 4)):
+        nodes["west"].truncated = truncated
+        errors = {}
+        results = candig.raw_results(dataset_ids, max_workers=max_workers, cached=False,
+                                     errors=errors)
+        assert list(results) == ["east:dataset-1", "east:dataset-2"]
+        assert set(errors) == {"west:dataset-1", "west:dataset-2"}
+
+
+def test_federated_slow_node_does_not_stall(candig_nodes, candig_raw_results):
+    slow = {"dataset-{}".format(i): candig_raw_results["dataset-1"] for i in range(4)}
+    nodes = candig_nodes({"east": candig_raw_results, "west": slow}, latency={"west": 0.2})
+    dataset_ids = ["west:dataset-{}".format(i) for i in range(4)] + \
+        ["east:dataset-1", "east:dataset-2"]
+    started = time.monotonic()
+    results = candig.raw_results(dataset_ids, max_workers=1)
+    assert list(results) == dataset_ids
+    # east is called right away, not after the 0.8 s the calls to west take
+    assert all(arrival - started < 0.15 for arrival in nodes["east"].arrivals)
+
+
+def test_raw_results_timeout_includes_retries(candig_nodes, candig_raw_results):
+    nodes = candig_nodes({"west": candig_raw_results}, latency={"west": 1.0})
+    candig.UPSTREAMS["west"].retries, candig.UPSTREAMS["west"].backoff = 2, 0.05
+    for max_workers in (1, 4):
+        errors = {}
+        started = time.monotonic()
+        assert candig.raw_results(["west:dataset-1"], max_workers=max_workers, timeout=0.2,
+                                  errors=errors) == {}
+        assert time.monotonic() - started < 0.45
+        assert list(errors) == ["west:dataset-1"]
+    assert len(nodes["west"].seen) == 2  # one attempt each, no time left to retry
+
+
+def test_federated_slow_node_times_out(candig_nodes, candig_raw_results):
+    candig_nodes({"east": candig_raw_results, "west": candig_raw_results},
+                 latency={"west": 1.0})
+    errors = {}
+    started = time.monotonic()
+    results = candig.raw_results(["west:dataset-1", "east:dataset-1", "east:dataset-2"],
+                                 timeout=0.1, errors=errors)
+    assert time.monotonic() - started < 0.5
+    assert list(results) == ["east:dataset-1", "east:dataset-2"]
+    assert list(errors) == ["west:dataset-1"]
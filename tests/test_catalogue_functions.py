@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+from mesi_search.catalogue import DatasetCatalogue
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_catalogue_serves_cached_ids_while_refreshing():
+    clock = FakeClock()
+    release = threading.Event()
+    fetched = []
+
+    def fetch():
+        fetched.append(1)
+        if len(fetched) > 1:
+            release.wait(5)  # a slow refresh
+        return ["dataset-{}".format(len(fetched))]
+
+    catalogue = DatasetCatalogue(fetch, refresh_interval=60, clock=clock)
+    assert catalogue.ids() == ["dataset-1"]
+    clock.now = 30.0
+    assert catalogue.ids() == ["dataset-1"]
+    assert len(fetched) == 1
+
+    clock.now = 60.0
+    assert catalogue.ids() == ["dataset-1"]  # stale list while the refresh runs
+    assert catalogue.ids() == ["dataset-1"]
+    release.set()
+    for _ in range(100):
+        if catalogue.ids() == ["dataset-2"]:
+            break
+        time.sleep(0.01)
+    assert catalogue.ids() == ["dataset-2"]
+    assert len(fetched) == 2
+
+
+def test_catalogue_keeps_ids_when_refresh_fails():
+    clock = FakeClock()
+    results = [["dataset-1"]]
+    failed = threading.Event()
+
+    def fetch():
+        if not results:
+            failed.set()
+            raise ValueError("upstream is down")
+        return results.pop()
+
+    catalogue = DatasetCatalogue(fetch, refresh_interval=60, clock=clock)
+    assert catalogue.ids() == ["dataset-1"]
+    clock.now = 120.0
+    assert catalogue.ids() == ["dataset-1"]
+    assert failed.wait(5)
+    catalogue.invalidate()
+    results.append(["dataset-2"])
+    assert catalogue.ids() == ["dataset-2"]
+
+
+def test_catalogue_without_refresh_interval_always_fetches():
+    fetched = []
+    catalogue = DatasetCatalogue(lambda: fetched.append(1) or ["d"], refresh_interval=0)
+    catalogue.ids()
+    catalogue.ids()
+    assert len(fetched) == 2
+
+
+def test_catalogue_loaded():
+    catalogue = DatasetCatalogue(lambda: ["d"], refresh_interval=60)
+    assert not catalogue.loaded
+    catalogue.ids()
+    assert catalogue.loaded
+    catalogue.invalidate()
+    assert not catalogue.loaded
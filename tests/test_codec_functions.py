@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import json
+
+import pytest
+
+from mesi_search import codec, main
+
+DOCUMENT = {"datasets": {"d2": {"gender": {"Male": 3, "Female": 4}},
+                         "d1": {"causeOfDeath": {"Heart": 1, "Cancé": 2}}}}
+CODECS = [codec.StandardCodec] + ([codec.OrjsonCodec] if codec.AVAILABLE else [])
+
+
+@pytest.mark.parametrize("json_codec", CODECS)
+def test_codec_round_trip(json_codec):
+    encoded = json_codec.dumps(DOCUMENT)
+    assert isinstance(encoded, bytes)
+    assert json_codec.loads(encoded) == DOCUMENT
+    assert json_codec.loads(encoded.decode("utf-8")) == DOCUMENT
+
+
+@pytest.mark.parametrize("json_codec", CODECS)
+def test_codec_sorted_keys_like_json(json_codec):
+    assert json.loads(json_codec.dumps(DOCUMENT, sort_keys=True)) == DOCUMENT
+    assert json_codec.dumps(DOCUMENT, sort_keys=True) == \
+        json.dumps(DOCUMENT, sort_keys=True, separators=(",", ":"),
+                   ensure_ascii=False).encode("utf-8")
+
+
+@pytest.mark.parametrize("json_codec", CODECS)
+def test_codec_keys_that_are_not_strings(json_codec):
+    assert json_codec.loads(json_codec.dumps({1: 2, None: 3})) == {"1": 2, "null": 3}
+
+
+@pytest.mark.parametrize("json_codec", CODECS)
+def test_codec_invalid_json(json_codec):
+    with pytest.raises(ValueError):
+        json_codec.loads(b'{"attributesOfInterest": [')
+
+
+def test_get_codec():
+    assert codec.get_codec("json") is codec.StandardCodec
+    assert codec.get_codec("auto") is (codec.OrjsonCodec if codec.AVAILABLE
+                                       else codec.StandardCodec)
+    with pytest.raises(ValueError):
+        codec.get_codec("simplejson")
+
+
+def test_get_codec_orjson_missing(mocker):
+    mocker.patch("mesi_search.codec.AVAILABLE", False)
+    assert codec.get_codec("auto") is codec.StandardCodec
+    with pytest.raises(ValueError):
+        codec.get_codec("orjson")
+
+
+def test_jsonify_like_flask():
+    with main.APP.app_context():
+        response = codec.jsonify(DOCUMENT)
+        assert response.mimetype == "application/json"
+        assert response.get_json() == DOCUMENT
+        assert response.get_data() == json.dumps(
+            DOCUMENT, sort_keys=True, separators=(",", ":"), ensure_ascii=False
+        ).encode("utf-8") + b"\n"
+
+
+def test_request_body_parsed_with_codec(app_client, auth_headers, mocker):
+    loads = mocker.spy(codec.CODEC, "loads")
+    response = app_client.post("/api/candig/patient", headers=auth_headers,
+                               content_type="application/json",
+                               data=json.dumps({"attributesOfInterest": ["gender"]}))
+    assert response.status_code == 200
+    assert loads.call_count == 1  # once for the validation and the view
+
+
+def test_request_body_invalid_json(app_client, auth_headers):
+    response = app_client.post("/api/candig/patient", headers=auth_headers,
+                               content_type="application/json", data='{"attributesOfInterest"')
+    assert response.status_code == 400
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+import gzip
+import json
+
+import pytest
+from werkzeug.http import parse_accept_header
+
+from mesi_search import compression, main
+from mesi_search.compression import Compressor
+
+BODY = json.dumps({"datasets": {"dataset-{}".format(i): {"causeOfDeath": {"Cancer": i}}
+                                for i in range(100)}}).encode("utf-8")
+
+
+def negotiate(compressor, accept_encoding):
+    return compressor.negotiate(parse_accept_header(accept_encoding))
+
+
+def test_negotiate(mocker):
+    mocker.patch("mesi_search.compression.brotli", object())
+    compressor = Compressor()
+    assert negotiate(compressor, "gzip, deflate, br") == "br"
+    assert negotiate(compressor, "gzip;q=1.0, br;q=0.5") == "gzip"
+    assert negotiate(compressor, "gzip") == "gzip"
+    assert negotiate(compressor, "*") == "br"
+    assert negotiate(compressor, "br;q=0, gzip") == "gzip"
+    assert negotiate(compressor, "identity") is None
+    assert negotiate(compressor, "") is None
+
+
+def test_negotiate_without_brotli(mocker):
+    mocker.patch("mesi_search.compression.brotli", None)
+    compressor = Compressor()
+    assert compressor.encodings == ("gzip",)
+    assert negotiate(compressor, "br") is None
+    assert negotiate(compressor, "gzip, br") == "gzip"
+
+
+def test_encode_gzip():
+    compressor = Compressor(encodings=("gzip",))
+    data, encoding = compressor.encode(BODY, "application/json", "gzip")
+    assert encoding == "gzip"
+    assert len(data) < len(BODY)
+    assert gzip.decompress(data) == BODY
+    assert compressor.encode(BODY, "application/json", "gzip")[0] == data  # no timestamp
+
+
+@pytest.mark.skipif(compression.brotli is None, reason="brotli is not installed")
+def test_encode_brotli():
+    data, encoding = Compressor().encode(BODY, "application/json", "br, gzip")
+    assert encoding == "br"
+    assert compression.brotli.decompress(data) == BODY
+
+
+def test_encode_leaves_alone():
+    compressor = Compressor(min_bytes=1024, encodings=("gzip",))
+    assert compressor.encode(BODY[:1000], "application/json", "gzip") == (BODY[:1000], None)
+    assert compressor.encode(BODY, "image/png", "gzip") == (BODY, None)
+    assert compressor.encode(BODY, "application/json", "") == (BODY, None)
+    assert Compressor(encodings=()).encode(BODY, "application/json", "gzip") == (BODY, None)
+
+
+def discover(client, headers, attributes):
+    return client.post("/api/candig/patient", headers=headers, content_type="application/json",
+                       data=json.dumps({"attributesOfInterest": attributes}))
+
+
+def test_discover_patient_compressed(app_client, auth_headers, mocker):
+    mocker.patch.object(main.COMPRESSOR, "min_bytes", 0)
+    mocker.patch.object(main.COMPRESSOR, "encodings", ("gzip",))
+    plain = discover(app_client, auth_headers, ["causeOfDeath"])
+    assert "Content-Encoding" not in plain.headers
+    assert "Accept-Encoding" in plain.headers["Vary"]
+
+    compressed = discover(app_client, dict(auth_headers, **{"Accept-Encoding": "gzip"}),
+                          ["causeOfDeath"])
+    assert compressed.status_code == 200
+    assert compressed.headers["Content-Encoding"] == "gzip"
+    assert int(compressed.headers["Content-Length"]) == len(compressed.data)
+    assert set(json.loads(gzip.decompress(compressed.data))["datasets"]) == \
+        {"dataset-1", "dataset-2"}
+
+
+def test_discover_patient_small_not_compressed(app_client, auth_headers, mocker):
+    mocker.patch.object(main.COMPRESSOR, "min_bytes", 1024 * 1024)
+    response = discover(app_client, dict(auth_headers, **{"Accept-Encoding": "gzip"}),
+                        ["causeOfDeath"])
+    assert response.status_code == 200
+    assert "Content-Encoding" not in response.headers
+    assert response.get_json()["datasets"]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+import os
+import stat
+
+import pytest
+from mesi_search.files import private_directory
+
+
+def test_private_directory_made_private(tmp_path):
+    path = private_directory(str(tmp_path / "state" / "sessions"))
+    assert path == str(tmp_path / "state" / "sessions")
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o700
+    assert private_directory(path) == path  # an existing private directory is fine
+
+
+def test_private_directory_writable_by_others(tmp_path):
+    path = tmp_path / "sessions"
+    path.mkdir()
+    path.chmod(0o777)
+    with pytest.raises(ValueError, match="writable"):
+        private_directory(str(path))
+
+
+def test_private_directory_owned_by_another_user(mocker, tmp_path):
+    mocker.patch("os.geteuid", return_value=os.geteuid() + 1)
+    with pytest.raises(ValueError, match="owned"):
+        private_directory(str(tmp_path))
+
+
+def test_private_directory_symlink(tmp_path):
+    (tmp_path / "target").mkdir(mode=0o700)
+    (tmp_path / "link").symlink_to(tmp_path / "target")
+    with pytest.raises(ValueError, match="not a directory"):
+        private_directory(str(tmp_path / "link"))
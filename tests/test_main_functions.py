@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+import json
+
+import jwt
+import pytest
+from limits.storage import MemoryStorage
+from limits.strategies import FixedWindowRateLimiter
+
+from mesi_search import main, utils
+
+
+def discover(client, headers, attributes):
+    return client.post("/api/candig/patient", headers=headers, content_type="application/json",
+                       data=json.dumps({"attributesOfInterest": attributes}))
+
+
+def test_discover_patient(app_client, auth_headers):
+    response = discover(app_client, auth_headers, ["causeOfDeath"])
+    assert response.status_code == 200
+    datasets = response.get_json()["datasets"]
+    assert set(datasets) == {"dataset-1", "dataset-2"}
+    assert set(datasets["dataset-1"]["causeOfDeath"]) == {"Cancer", "Heart"}
+
+
+def test_discover_patient_unknown_attribute(app_client, auth_headers):
+    response = discover(app_client, auth_headers, ["causeOfDeath", "shoeSize"])
+    assert response.status_code == 400
+    assert b"shoeSize" in response.data
+
+
+def test_discover_patient_unauthorized(app_client):
+    assert discover(app_client, {}, ["causeOfDeath"]).status_code == 401
+
+
+def test_session_kept_server_side(app_client, auth_headers):
+    response = discover(app_client, auth_headers, ["causeOfDeath"])
+    cookie = response.headers["Set-Cookie"].split(";")[0].split("=", 1)[1]
+    assert len(cookie) < 100  # only the signed session ID
+    discover(app_client, auth_headers, ["gender"])
+
+    interface = main.APP.session_interface
+    sid = interface._get_signer(main.APP).unsign(cookie).decode("utf-8")
+    stored = interface.cache.get(interface.key_prefix + sid)
+    assert sorted(stored["attributes_of_interest"]) == ["causeOfDeath", "gender"]
+    assert set(stored["result"]["datasets"]) == {"dataset-1", "dataset-2"}
+    assert stored["sub"] == "tester"
+
+
+def test_discover_patient_decodes_jwt_once(app_client, auth_headers, mocker):
+    decode_jwt = mocker.spy(utils, "decode_jwt")
+    assert discover(app_client, auth_headers, ["causeOfDeath"]).status_code == 200
+    assert decode_jwt.call_count == 1
+
+
+def test_discover_patient_jwt_without_sub(app_client):
+    token = jwt.encode({"iat": 0}, "not-so-secret")
+    if isinstance(token, bytes):
+        token = token.decode("utf-8")
+    headers = {"Authorization": "Bearer {}".format(token)}
+    assert discover(app_client, headers, ["causeOfDeath"]).status_code == 401
+
+
+def discover_batch(client, headers, attribute_sets):
+    return client.post("/api/candig/patient/batch", headers=headers,
+                       content_type="application/json",
+                       data=json.dumps({"queries": [{"attributesOfInterest": attributes}
+                                                    for attributes in attribute_sets]}))
+
+
+def test_discover_patient_batch(app_client, auth_headers, mocker):
+    raw_results = mocker.spy(main.candig, "raw_results")
+    response = discover_batch(app_client, auth_headers, [["causeOfDeath"], []])
+    assert response.status_code == 200
+    results = response.get_json()["results"]
+    assert len(results) == 2
+    assert set(results[0]["datasets"]["dataset-1"]["causeOfDeath"]) == {"Cancer", "Heart"}
+    assert results[1]["datasets"] == {}  # like `/api/candig/patient` without attributes
+    assert raw_results.call_count == 1  # one upstream fetch for all queries
+    assert raw_results.call_args[1]["fields"] == ["causeOfDeath"]
+
+
+def test_discover_patient_batch_noised_per_attribute_set(app_client, auth_headers, mocker):
+    private_data_filter = mocker.spy(main.candig, "private_data_filter")
+    response = discover_batch(app_client, auth_headers, [
+        ["causeOfDeath", "gender"], ["gender", "causeOfDeath"], ["causeOfDeath"]])
+    assert private_data_filter.call_count == 2  # the same set is not noised again
+    results = response.get_json()["results"]
+    assert results[0] == results[1]
+
+
+@pytest.fixture
+def limited_client(app_client, mocker):
+    """`app_client` with the rate limits on, counted in memory"""
+    storage = MemoryStorage()  # the limiter only keeps a weak reference to it
+    mocker.patch.object(main.limiter, "enabled", True)
+    mocker.patch.object(main.limiter, "_limiter", FixedWindowRateLimiter(storage))
+    yield app_client
+
+
+def test_discovery_limit_shared(limited_client, auth_headers):
+    statuses = [discover(limited_client, auth_headers, ["causeOfDeath"]).status_code
+                for _ in range(10)]
+    assert statuses == [200] * 10
+    assert discover_batch(limited_client, auth_headers, [["causeOfDeath"]]).status_code == 429
+
+
+def test_discovery_limit_spent_per_attribute_set(limited_client, auth_headers):
+    batch = [["causeOfDeath"], ["gender"], ["causeOfDeath"]]
+    assert discover_batch(limited_client, auth_headers, batch).status_code == 200  # spends 2
+    for _ in range(6):
+        assert discover(limited_client, auth_headers, ["causeOfDeath"]).status_code == 200
+    response = discover_batch(limited_client, auth_headers,
+                              [["causeOfDeath"], ["gender"], ["ethnicity"]])
+    assert response.status_code == 429 and b"3 distinct attribute sets" in response.data
+    assert discover(limited_client, auth_headers, ["causeOfDeath"]).status_code == 200
+    assert discover(limited_client, auth_headers, ["causeOfDeath"]).status_code == 429
+
+
+def test_discover_patient_batch_bad_requests(app_client, auth_headers, mocker):
+    response = discover_batch(app_client, auth_headers, [["causeOfDeath"], ["shoeSize"]])
+    assert response.status_code == 400 and b"shoeSize" in response.data
+    mocker.patch.dict(main.APP.config, CANDIG_BATCH_MAX_QUERIES=2)
+    assert discover_batch(app_client, auth_headers, [["gender"]] * 3).status_code == 400
+    assert discover_batch(app_client, auth_headers, []).status_code == 400
+
+
+def test_discover_patient_batch_unauthorized(app_client):
+    assert discover_batch(app_client, {}, [["causeOfDeath"]]).status_code == 401
+
+
+def test_discover_patient_from_snapshot(app_client, auth_headers, candig_raw_results, mocker):
+    from mesi_search import candig
+
+    mocker.patch.object(candig.SNAPSHOT, "data", lambda: candig_raw_results)
+    raw_results = mocker.patch("mesi_search.candig.raw_results")
+    response = discover(app_client, auth_headers, ["causeOfDeath"])
+    assert response.status_code == 200
+    assert set(response.get_json()["datasets"]) == {"dataset-1", "dataset-2"}
+    raw_results.assert_not_called()
+
+
+def test_discover_patient_result_released_once(app_client, auth_headers, mocker):
+    private_data_filter = mocker.spy(main.candig, "private_data_filter")
+    first = discover(app_client, auth_headers, ["causeOfDeath", "gender"])
+    etag = first.headers["ETag"]
+    assert first.headers["Cache-Control"] in ("private, no-cache", "no-cache, private")
+    again = discover(app_client, auth_headers, ["gender", "causeOfDeath"])
+    assert again.status_code == 200
+    assert again.headers["ETag"] == etag
+    assert again.data == first.data
+    assert private_data_filter.call_count == 1
+
+    discover(app_client, auth_headers, ["gender"])
+    assert private_data_filter.call_count == 2
+    other = discover(app_client, auth_headers, ["causeOfDeath", "gender"])
+    assert private_data_filter.call_count == 3
+    assert other.headers["ETag"] != etag or other.data == first.data
+
+
+def test_discover_patient_not_modified(app_client, auth_headers, mocker):
+    private_data_filter = mocker.spy(main.candig, "private_data_filter")
+    etag = discover(app_client, auth_headers, ["causeOfDeath"]).headers["ETag"]
+    response = discover(app_client, dict(auth_headers, **{"If-None-Match": etag}),
+                        ["causeOfDeath"])
+    assert response.status_code == 304
+    assert response.data == b""
+    assert response.headers["ETag"] == etag
+    assert private_data_filter.call_count == 1
+
+    response = discover(app_client, dict(auth_headers, **{"If-None-Match": '"other"'}),
+                        ["causeOfDeath"])
+    assert response.status_code == 200
+    assert response.headers["ETag"] == etag
+
+
+def test_discover_patient_not_modified_compressed(app_client, auth_headers, mocker):
+    mocker.patch.object(main.COMPRESSOR, "min_bytes", 0)
+    mocker.patch.object(main.COMPRESSOR, "encodings", ("gzip",))
+    headers = dict(auth_headers, **{"Accept-Encoding": "gzip"})
+    first = discover(app_client, headers, ["causeOfDeath"])
+    assert first.headers["Content-Encoding"] == "gzip"
+    etag = first.headers["ETag"]
+    assert etag.endswith('-gzip"')
+    response = discover(app_client, dict(headers, **{"If-None-Match": etag}), ["causeOfDeath"])
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert response.headers["Vary"] == first.headers["Vary"] == "Accept-Encoding"
+
+
+def test_discover_patient_not_modified_weak(app_client, auth_headers):
+    etag = discover(app_client, auth_headers, ["causeOfDeath"]).headers["ETag"]
+    response = discover(app_client, dict(auth_headers, **{"If-None-Match": "W/" + etag}),
+                        ["causeOfDeath"])
+    assert response.status_code == 304
+
+
+def test_discover_patient_released_until_counts_change(app_client, auth_headers, mocker):
+    private_data_filter = mocker.spy(main.candig, "private_data_filter")
+    etag = discover(app_client, auth_headers, ["causeOfDeath"]).headers["ETag"]
+    main.candig.invalidate_counts()
+    response = discover(app_client, dict(auth_headers, **{"If-None-Match": etag}),
+                        ["causeOfDeath"])
+    assert response.status_code == 200
+    assert private_data_filter.call_count == 2
+
+    mocker.patch.object(main.candig, "counts_version", lambda: "new counts")
+    discover(app_client, auth_headers, ["causeOfDeath"])
+    assert private_data_filter.call_count == 3
+
+
+def test_discover_patient_result_released_for_ttl(app_client, auth_headers, mocker):
+    private_data_filter = mocker.spy(main.candig, "private_data_filter")
+    mocker.patch.dict(main.APP.config, SESSION_RESULT_TTL=0)
+    response = discover(app_client, auth_headers, ["causeOfDeath"])
+    assert "ETag" not in response.headers
+    discover(app_client, auth_headers, ["causeOfDeath"])
+    assert private_data_filter.call_count == 2
+
+
+def test_discover_patient_batch_drops_release(app_client, auth_headers, mocker):
+    private_data_filter = mocker.spy(main.candig, "private_data_filter")
+    discover(app_client, auth_headers, ["causeOfDeath"])
+    discover_batch(app_client, auth_headers, [["causeOfDeath"]])
+    response = discover(app_client, auth_headers, ["causeOfDeath"])
+    assert "datasets" in response.get_json()
+    assert private_data_filter.call_count == 3
+
+
+def test_health(app_client, mocker):
+    from mesi_search import candig
+
+    response = app_client.get("/health")
+    assert response.status_code == 200
+    assert response.get_json()["snapshot"]["status"] == "disabled"
+
+    mocker.patch.object(candig.SNAPSHOT, "health", lambda: {"status": "stale"})
+    response = app_client.get("/health")
+    assert response.status_code == 503
+    assert response.get_json()["status"] == "degraded"
+
+
+def test_health_federated(app_client, candig_nodes, candig_raw_results):
+    candig_nodes({"east": candig_raw_results, "west": candig_raw_results})
+    response = app_client.get("/health")
+    assert response.get_json()["nodes"] == {"east": "closed", "west": "closed"}
+
+
+def test_prebuilt_apispec_up_to_date(app_client, tmp_path):
+    from mesi_search import main, swagger
+
+    with open(swagger.APISPEC_FILE) as f:
+        prebuilt = json.load(f)
+    assert app_client.get("/apispec_1.json").get_json() == prebuilt
+    try:
+        built = swagger.build_apispec(main.SWAGGER, str(tmp_path / "apispec_1.json"))
+    finally:
+        swagger.load_apispec(main.SWAGGER)
+    assert built == prebuilt, "API changed, run bin/build_apispec.py"
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import runpy
+
+from mesi_search import metrics
+from prometheus_client import REGISTRY
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def discover(client, headers, attributes):
+    return client.post("/api/candig/patient", headers=headers, content_type="application/json",
+                       data=json.dumps({"attributesOfInterest": attributes}))
+
+
+def test_discovery_stages_recorded(app_client, auth_headers):
+    stages = ["datasets", "filter", "noise", "session_write", "serialize"]
+    before = {stage: sample("mesi_stage_seconds_count", stage=stage) for stage in stages}
+    assert discover(app_client, auth_headers, ["causeOfDeath"]).status_code == 200
+    for stage in stages:
+        assert sample("mesi_stage_seconds_count", stage=stage) == before[stage] + 1, stage
+
+
+def test_responses_recorded(app_client, auth_headers):
+    labels = {"endpoint": "/api/candig/patient", "status": "401"}
+    before = sample("mesi_responses_total", **labels)
+    discover(app_client, {}, ["causeOfDeath"])
+    assert sample("mesi_responses_total", **labels) == before + 1
+
+
+def test_rate_limited_recorded(app_client, auth_headers, mocker):
+    from flask_limiter.errors import RateLimitExceeded
+    from mesi_search import main
+
+    limit = mocker.Mock(error_message=None, limit="10 per 1 minute")
+    mocker.patch.object(main.candig, "unknown_attributes", side_effect=RateLimitExceeded(limit))
+    before = sample("mesi_rate_limited_total", endpoint="/api/candig/patient")
+    response = discover(app_client, auth_headers, ["causeOfDeath"])
+    assert response.status_code == 429
+    assert sample("mesi_rate_limited_total", endpoint="/api/candig/patient") == before + 1
+
+
+def test_upstream_calls_recorded(mocker):
+    from mesi_search import candig
+
+    class Result(object):
+        status_code = 503
+        upstream_timing = mocker.Mock(elapsed=0.2, attempts=3, new_connections=0)
+
+    mocker.patch.object(candig.UPSTREAM, "post", lambda *args, **kwargs: Result())
+    before = sample("mesi_upstream_responses_total", endpoint="/count", status="503")
+    candig.request(url="/count", json_data={})
+    assert sample("mesi_upstream_responses_total", endpoint="/count", status="503") == before + 1
+
+
+def test_metrics_endpoint(app_client):
+    response = app_client.get("/metrics")
+    assert response.status_code == 200
+    assert response.content_type.startswith("text/plain")
+    assert b"mesi_stage_seconds_bucket" in response.data
+
+
+def test_metrics_multiprocess(tmp_path, mocker):
+    mocker.patch.dict(os.environ, {metrics.MULTIPROC_DIR_VARIABLE: str(tmp_path)})
+    body, _ = metrics.latest()
+    assert body == b""  # no worker has written anything to the directory yet
+    metrics.mark_process_dead(12345)
+
+
+def test_gunicorn_config(tmp_path, mocker):
+    multiproc_dir = tmp_path / "metrics"
+    mocker.patch.dict(os.environ, {metrics.MULTIPROC_DIR_VARIABLE: str(multiproc_dir)})
+    config = runpy.run_path(os.path.join(os.path.dirname(__file__), os.pardir, "bin",
+                                         "gunicorn.conf.py"))
+    (tmp_path / "metrics").mkdir()
+    (multiproc_dir / "counter_1.db").write_bytes(b"")
+    config["on_starting"](None)
+    assert os.listdir(str(multiproc_dir)) == []
+    dead = mocker.patch("prometheus_client.multiprocess.mark_process_dead")
+    config["child_exit"](None, mocker.Mock(pid=42))
+    dead.assert_called_once_with(42)
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+from mesi_search import candig
+from mesi_search.noise import LaplaceNoise
+from scipy import stats
+
+
+@pytest.mark.parametrize("epsilon,delta,sensitivity", [(10.0, 0.3, 9), (0.5, 0.0, 1)])
+def test_laplace_noise_matches_diffprivlib(epsilon, delta, sensitivity):
+    """The batched mechanism draws from the same distribution as diffprivlib's Laplace"""
+    mech = candig.create_laplace_mechanism(epsilon, delta)
+    mech.set_sensitivity(sensitivity)
+    engine = LaplaceNoise(epsilon, delta, rng=np.random.default_rng(7))
+
+    assert 2 * engine.scale(sensitivity) ** 2 == pytest.approx(mech.get_variance(0))
+
+    np.random.seed(7)  # diffprivlib draws from numpy's global random state
+    reference = np.array([mech.randomise(0) for _ in range(5000)])
+    batched = engine.randomise(np.zeros(5000), sensitivity)
+    assert stats.ks_2samp(reference, batched).pvalue > 0.01
+    assert stats.kstest(batched, "laplace", args=(0, engine.scale(sensitivity))).pvalue > 0.01
+
+
+def test_laplace_noise_sensitivity_per_value():
+    engine = LaplaceNoise(1.0, rng=np.random.default_rng(3))
+    noise = engine.randomise(np.zeros(20000), np.repeat([1, 100], 10000))
+    assert np.std(noise[:10000]) == pytest.approx(np.sqrt(2), rel=0.1)
+    assert np.std(noise[10000:]) == pytest.approx(100 * np.sqrt(2), rel=0.1)
+
+
+def test_laplace_noise_parameter_checks():
+    with pytest.raises(ValueError):
+        LaplaceNoise(-1.0)
+    with pytest.raises(ValueError):
+        LaplaceNoise(1.0, 1.5)
+    with pytest.raises(ValueError):
+        LaplaceNoise(0.0, 0.0)
+    with pytest.raises(ValueError):
+        LaplaceNoise(1.0).randomise([1, 2], -1)
+
+
+def test_randomize_counts():
+    engine = candig.create_noise_mechanism(10.0)
+    counts = [{"Cancer": 32, "Heart": 23}, {}, {"Male": 5}]
+    noised = candig.randomize_counts(engine, counts)
+    assert [list(c) for c in noised] == [["Cancer", "Heart"], [], ["Male"]]
+    assert all(type(v) is int for c in noised for v in c.values())
+    assert candig.randomize(engine, {"causeOfDeath": counts[0]}).keys() == {"causeOfDeath"}
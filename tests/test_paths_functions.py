@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+import dpath.util
+import pytest
+from mesi_search import paths
+
+DATA = {
+    "results": {
+        "patients": [{"causeOfDeath": {"Cancer": 32}, "gender": {"Male": 3}}],
+        "total": 1,
+        "2020": "year",
+    }
+}
+
+
+@pytest.mark.parametrize("path", [
+    "/", "/results/patients", "results/patients", "/results/patients/0/causeOfDeath",
+    "/results/2020", "/results/patients/*/gender", "/results/pat?ents",
+])
+def test_get_matches_dpath(path):
+    assert paths.get(DATA, path) == dpath.util.get(DATA, path)
+
+
+@pytest.mark.parametrize("path", [
+    "/results/missing", "/results/patients/1", "/results/patients/-1",
+    "/results/patients/first", "/results/total/value", "/results/*/gender/Female",
+])
+def test_get_missing_raises_key_error(path):
+    with pytest.raises(KeyError):
+        dpath.util.get(DATA, path)
+    with pytest.raises(KeyError):
+        paths.get(DATA, path)
+
+
+def test_compile_path_is_cached():
+    assert paths.compile_path("/results/patients") is paths.compile_path("/results/patients")
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+import cProfile
+import json
+
+from mesi_search import profiling
+from mesi_search.profiling import RequestProfiler
+
+
+def test_profiler_disabled_by_default():
+    profiler = RequestProfiler("unused")
+    assert not profiler.enabled
+    assert not profiler.wanted({profiling.HEADER: "anything"})
+
+
+def test_profiler_wanted():
+    profiler = RequestProfiler("unused", token="s3cret")
+    assert profiler.wanted({profiling.HEADER: "s3cret"})
+    assert not profiler.wanted({profiling.HEADER: "guess"})
+    assert not profiler.wanted({})
+    assert RequestProfiler("unused", sample_rate=1.0).wanted({})
+
+
+def test_profiler_rotates(tmp_path):
+    profiler = RequestProfiler(str(tmp_path), keep=2)
+    for _ in range(3):
+        profiler.write(cProfile.Profile(), [], {"path": "/", "seconds": 0.001})
+    assert len(list(tmp_path.glob("*.prof"))) == 2
+    assert len(list(tmp_path.glob("*.json"))) == 2
+
+
+def test_profiler_refuses_shared_directory(tmp_path):
+    tmp_path.chmod(0o777)
+    profiler = RequestProfiler(str(tmp_path))
+    assert profiler.write(cProfile.Profile(), [], {"path": "/", "seconds": 0.001}) is None
+    assert not list(tmp_path.iterdir())
+
+
+def test_discovery_profiled_with_header(app_client, auth_headers, tmp_path, mocker):
+    mocker.patch.object(profiling, "PROFILER", RequestProfiler(str(tmp_path), token="s3cret"))
+    headers = dict(auth_headers, **{profiling.HEADER: "s3cret"})
+    response = app_client.post("/api/candig/patient", headers=headers,
+                               data=json.dumps({"attributesOfInterest": ["causeOfDeath"]}),
+                               content_type="application/json")
+    assert response.status_code == 200
+    summaries = list(tmp_path.glob("*.json"))
+    assert len(summaries) == 1 and len(list(tmp_path.glob("*.prof"))) == 1
+    summary = json.loads(summaries[0].read_text())
+    assert summary["attributes"] == ["causeOfDeath"]
+    assert summary["status"] == 200 and summary["seconds"] > 0
+
+    app_client.post("/api/candig/patient", headers=auth_headers,
+                    data=json.dumps({"attributesOfInterest": ["causeOfDeath"]}),
+                    content_type="application/json")
+    assert len(list(tmp_path.glob("*.json"))) == 1
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+import multiprocessing
+import threading
+
+import pytest
+from limits import parse
+from limits.storage import storage_from_string
+from limits.strategies import FixedWindowRateLimiter
+from mesi_search import ratelimit
+from mesi_search.ratelimit import SQLiteStorage
+
+
+@pytest.fixture
+def storage(tmp_path):
+    return SQLiteStorage("sqlite:///{}".format(tmp_path / "ratelimit.db"))
+
+
+def test_storage_registered(tmp_path):
+    url = "sqlite:///{}".format(tmp_path / "limits" / "ratelimit.db")
+    assert isinstance(storage_from_string(url), SQLiteStorage)
+    assert (tmp_path / "limits" / "ratelimit.db").exists()
+
+
+def test_storage_refuses_shared_directory(tmp_path):
+    tmp_path.chmod(0o777)
+    with pytest.raises(ValueError):
+        SQLiteStorage("sqlite:///{}".format(tmp_path / "ratelimit.db"))
+    assert not (tmp_path / "ratelimit.db").exists()
+
+
+@pytest.mark.parametrize("returning", [True, False])
+def test_storage_counters(storage, mocker, returning):
+    mocker.patch.object(ratelimit, "RETURNING", returning and ratelimit.RETURNING)
+    now = 1000.0
+    mocker.patch.object(ratelimit.time, "time", lambda: now)
+    assert [storage.incr("k", 60) for _ in range(3)] == [1, 2, 3]
+    assert storage.get("k") == 3 and storage.get("other") == 0
+    assert storage.get_expiry("k") == 1060
+    now = 1060.0  # the window is over, the counter starts again
+    assert storage.get("k") == 0
+    assert storage.incr("k", 60) == 1
+    assert storage.get_expiry("k") == 1120
+    now = 1070.0
+    storage.incr("k", 60, elastic_expiry=True)
+    assert storage.get_expiry("k") == 1130
+    storage.clear("k")
+    assert storage.get("k") == 0
+    storage.incr("k", 60)
+    storage.reset()
+    assert storage.get("k") == 0
+    assert storage.check()
+
+
+def _hit(url, times):
+    storage = SQLiteStorage(url)
+    for _ in range(times):
+        storage.incr("shared", 60)
+
+
+def test_storage_shared_between_processes(storage):
+    storage.incr("shared", 60)
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=_hit, args=(storage.uri, 50)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(30)
+    assert [worker.exitcode for worker in workers] == [0] * 4
+    assert storage.get("shared") == 201
+
+
+def _hit_inherited(storage, times):
+    for _ in range(times):
+        storage.incr("shared", 60)
+
+
+def test_storage_one_connection_per_process(storage, mocker):
+    connect = mocker.spy(ratelimit.sqlite3, "connect")
+    threads = [threading.Thread(target=_hit_inherited, args=(storage, 50)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert storage.get("shared") == 200
+    assert connect.call_count == 0  # opened by the constructor, shared by the threads
+    # a forked worker does not use the connection of its parent
+    context = multiprocessing.get_context("fork")
+    worker = context.Process(target=_hit_inherited, args=(storage, 10))
+    worker.start()
+    worker.join(30)
+    assert worker.exitcode == 0
+    assert storage.get("shared") == 210
+
+
+def test_storage_limits(storage):
+    limiter = FixedWindowRateLimiter(storage)
+    limit = parse("10/minute")
+    assert [limiter.hit(limit, "user") for _ in range(11)] == [True] * 10 + [False]
+    assert limiter.hit(limit, "someone else")
+    reset, remaining = limiter.get_window_stats(limit, "user")
+    assert remaining == 0 and reset > 0
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+import threading
+
+from mesi_search.snapshot import CountSnapshot
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_snapshot_disabled():
+    snapshot = CountSnapshot(lambda: ({"d1": {}}, []), refresh_interval=0)
+    assert snapshot.data() is None
+    assert snapshot.health()["status"] == "disabled"
+
+
+def test_snapshot_refresh_keeps_failed_datasets():
+    fetches = iter([({"d1": 1, "d2": 2}, []), ({"d1": 10}, ["d2"])])
+    snapshot = CountSnapshot(lambda: next(fetches), refresh_interval=60)
+    snapshot.refresh()
+    snapshot.refresh()
+    assert snapshot._data == {"d1": 10, "d2": 2}
+
+
+def test_snapshot_served_until_too_old():
+    clock = FakeClock()
+    snapshot = CountSnapshot(lambda: ({"d1": 1}, []), refresh_interval=60, max_age=120,
+                             clock=clock)
+    snapshot.start = lambda: None  # refreshed by hand below
+    assert snapshot.data() is None
+    assert snapshot.health()["status"] == "loading"
+    snapshot.refresh()
+    clock.now = 120.0
+    assert snapshot.data() == {"d1": 1}
+    assert snapshot.health()["status"] == "ok"
+    clock.now = 121.0
+    assert snapshot.data() is None
+    health = snapshot.health()
+    assert (health["status"], health["age"], health["datasets"]) == ("stale", 121.0, 1)
+
+
+def test_snapshot_refreshed_in_background():
+    refreshed = threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        if len(calls) == 1:
+            raise ValueError("upstream down")
+        refreshed.set()
+        return {"d1": len(calls)}, []
+
+    snapshot = CountSnapshot(fetch, refresh_interval=0.01)
+    assert snapshot.data() is None  # starts the refresh, does not wait on it
+    assert refreshed.wait(5)
+    snapshot.stop()
+    assert snapshot.data() == {"d1": 2}
+    assert snapshot.health()["refreshes"] >= 1
+
+
+def test_snapshot_version_follows_counts():
+    fetches = iter([({"d1": {"a": 1}}, []), ({"d1": {"a": 1}}, []), ({"d1": {"a": 2}}, [])])
+    snapshot = CountSnapshot(lambda: next(fetches), refresh_interval=60)
+    snapshot.start = lambda: None
+    assert snapshot.version() is None
+    snapshot.refresh()
+    first = snapshot.version()
+    assert first is not None
+    snapshot.refresh()
+    assert snapshot.version() == first
+    snapshot.refresh()
+    assert snapshot.version() != first
+    snapshot.invalidate()
+    assert snapshot.version() is None
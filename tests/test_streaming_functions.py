@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+import io
+import json
+
+import pytest
+from mesi_search import streaming
+
+pytest.importorskip("ijson")
+
+
+def parse(document, fields):
+    return streaming.parse_counts(io.BytesIO(json.dumps(document).encode("utf-8")), fields)
+
+
+def test_parse_counts_keeps_only_fields():
+    document = {
+        "status": {"Known peers": 1},
+        "results": {
+            "patients": [
+                {"dateOfBirth": {"1970-01-01": 2}, "gender": {"Male": 2, "Female": 1.5},
+                 "race": [1, {"nested": [2]}], "causeOfDeath": {}},
+                {"gender": "n/a"},
+            ],
+            "total": 2,
+        },
+    }
+    assert parse(document, ["gender", "race", "causeOfDeath"]) == {"results": {"patients": [
+        {"gender": {"Male": 2, "Female": 1.5}, "race": [1, {"nested": [2]}], "causeOfDeath": {}},
+        {"gender": "n/a"},
+    ]}}
+
+
+def test_parse_counts_without_patients():
+    assert parse({"status": {}}, ["gender"]) == {}
+    assert parse({"results": {"datasets": []}}, ["gender"]) == {"results": {}}
+
+
+def test_parse_counts_invalid_json():
+    with pytest.raises(ValueError):
+        streaming.parse_counts(io.BytesIO(b'{"results": {"patients": ['), ["gender"])
+
+
+def test_counting_reader():
+    reader = streaming.CountingReader(io.BytesIO(b"0123456789"))
+    reader.read(4)
+    reader.read()
+    assert reader.bytes_read == 10
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+import json
+import time
+
+import jwt
+import pytest
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jwt.algorithms import RSAAlgorithm
+from mesi_search.tokens import KeySet, TokenVerifier
+
+
+def rsa_key():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048,
+                                    backend=default_backend())
+
+
+def write_jwks(path, keys):
+    jwks = {"keys": []}
+    for kid, private_key in keys.items():
+        jwk = json.loads(RSAAlgorithm.to_jwk(private_key.public_key()))
+        jwk.update(kid=kid, use="sig", alg="RS256")
+        jwks["keys"].append(jwk)
+    path.write_text(json.dumps(jwks))
+    return str(path)
+
+
+def token(private_key, kid="key-1", algorithm="RS256", **claims):
+    payload = {"sub": "tester", "iat": int(time.time()), "exp": int(time.time()) + 60}
+    payload.update(claims)
+    encoded = jwt.encode(payload, private_key, algorithm=algorithm, headers={"kid": kid})
+    return encoded.decode("utf-8") if isinstance(encoded, bytes) else encoded
+
+
+@pytest.fixture(scope="module")
+def signing_key():
+    return rsa_key()
+
+
+@pytest.fixture
+def verifier(tmp_path, signing_key):
+    return TokenVerifier(KeySet(write_jwks(tmp_path / "jwks.json", {"key-1": signing_key})))
+
+
+def test_verify_token(verifier, signing_key):
+    assert verifier.verify(token(signing_key))["sub"] == "tester"
+
+
+def test_verify_token_other_key(verifier):
+    with pytest.raises(jwt.InvalidSignatureError):
+        verifier.verify(token(rsa_key()))
+
+
+def test_verify_token_unknown_kid(verifier, signing_key):
+    with pytest.raises(jwt.InvalidTokenError):
+        verifier.verify(token(signing_key, kid="key-2"))
+
+
+def test_verify_token_expired(verifier, signing_key):
+    with pytest.raises(jwt.ExpiredSignatureError):
+        verifier.verify(token(signing_key, exp=int(time.time()) - 60))
+
+
+def test_verify_token_algorithm_confusion(verifier, tmp_path):
+    # an HMAC token "signed" with the public key must not pass for the RSA key
+    public_jwk = json.loads((tmp_path / "jwks.json").read_text())["keys"][0]
+    forged = token(json.dumps(public_jwk), algorithm="HS256")
+    with pytest.raises(jwt.InvalidAlgorithmError):
+        verifier.verify(forged)
+
+
+def test_verified_tokens_skip_decode(verifier, signing_key, mocker):
+    encoded = token(signing_key)
+    decode = mocker.spy(jwt, "decode")
+    claims = verifier.verify(encoded)
+    assert verifier.verify(encoded) == claims
+    assert decode.call_count == 1
+    assert verifier.hits == 1
+
+
+def test_verified_tokens_until_exp(tmp_path, signing_key, mocker):
+    now = [time.time()]
+    verifier = TokenVerifier(KeySet(write_jwks(tmp_path / "jwks.json", {"key-1": signing_key})),
+                             clock=lambda: now[0])
+    encoded = token(signing_key, exp=int(now[0]) + 30)
+    decode = mocker.spy(jwt, "decode")
+    verifier.verify(encoded)
+    now[0] += 20
+    verifier.verify(encoded)
+    assert decode.call_count == 1
+    now[0] += 20  # expired in the cache, verified again
+    verifier.verify(encoded)
+    assert decode.call_count == 2
+
+
+def test_verified_tokens_bounded(verifier, signing_key):
+    verifier.max_entries = 2
+    tokens = [token(signing_key, sub=str(i)) for i in range(3)]
+    for encoded in tokens:
+        verifier.verify(encoded)
+    assert len(verifier._verified) == 2
+    verifier.verify(tokens[0])
+    assert verifier.hits == 0
+
+
+def test_key_set_reloads_rotated_keys(tmp_path, signing_key):
+    path = tmp_path / "jwks.json"
+    verifier = TokenVerifier(KeySet(write_jwks(path, {"key-1": signing_key})))
+    new_key = rsa_key()
+    write_jwks(path, {"key-1": signing_key, "key-2": new_key})
+    verifier.key_set._mtime = None  # as if the file was written after loading it
+    assert verifier.verify(token(new_key, kid="key-2"))["sub"] == "tester"
+
+
+def test_key_set_without_keys(tmp_path):
+    path = tmp_path / "jwks.json"
+    path.write_text(json.dumps({"keys": []}))
+    with pytest.raises(ValueError):
+        KeySet(str(path))
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+import requests
+from mesi_search.upstream import CircuitBreaker, UpstreamClient, UpstreamUnavailable
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def upstream_server():
+    """Local keep-alive HTTP server that answers with the queued status codes"""
+    statuses = []
+    seen = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            seen.append((self.path, json.loads(self.rfile.read(length)),
+                         self.headers.get("Accept-Encoding")))
+            body = b'{"results": {}}'
+            self.send_response(statuses.pop(0) if statuses else 200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.statuses = statuses
+    server.seen = seen
+    server.url = "http://127.0.0.1:{}".format(server.server_port)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_client_reuses_connection(upstream_server):
+    client = UpstreamClient(upstream_server.url, backoff=0)
+    for _ in range(3):
+        r = client.post("/count", json_data={"datasetId": "abc"})
+        assert r.json() == {"results": {}}
+    assert r.upstream_timing.attempts == 1
+    assert r.upstream_timing.new_connections == 0
+    assert client.stats()["connections"] == 1
+    assert upstream_server.seen[0] == ("/count", {"datasetId": "abc"}, "gzip")
+
+
+def test_client_retries_unavailable_upstream(upstream_server):
+    upstream_server.statuses.extend([503, 502])
+    client = UpstreamClient(upstream_server.url, retries=2, backoff=0)
+    r = client.post("/count", json_data={})
+    assert r.status_code == 200
+    assert r.upstream_timing.attempts == 3
+    assert client.stats()["retries"] == 2
+
+
+def test_client_gives_up_after_retries(upstream_server):
+    upstream_server.statuses.extend([503, 503, 503])
+    client = UpstreamClient(upstream_server.url, retries=1, backoff=0)
+    r = client.post("/count", json_data={})
+    assert r.status_code == 503
+    assert client.stats()["failures"] == 1
+    assert len(upstream_server.seen) == 2
+
+
+def test_client_fails_fast_when_breaker_open():
+    breaker = CircuitBreaker(threshold=2, reset_timeout=60)
+    client = UpstreamClient("http://127.0.0.1:9", retries=0, connect_timeout=0.5,
+                            breaker=breaker)
+    for _ in range(2):
+        with pytest.raises(requests.ConnectionError):
+            client.post("/count", json_data={})
+    with pytest.raises(UpstreamUnavailable):
+        client.post("/count", json_data={})
+    assert client.stats()["rejected"] == 1
+
+
+def test_circuit_breaker_half_open():
+    clock = FakeClock()
+    breaker = CircuitBreaker(threshold=1, reset_timeout=10, clock=clock)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+    clock.now = 10.0
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow()
+    assert not breaker.allow()  # only one trial call at a time
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+    clock.now = 20.0
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_client_ends_half_open_trial_on_any_error(mocker):
+    clock = FakeClock()
+    breaker = CircuitBreaker(threshold=1, reset_timeout=10, clock=clock)
+    breaker.record_failure()
+    clock.now = 10.0
+    client = UpstreamClient("http://127.0.0.1:9", retries=2, breaker=breaker)
+    post = mocker.patch.object(client.session, "post",
+                               side_effect=requests.exceptions.ContentDecodingError("bad gzip"))
+    with pytest.raises(requests.exceptions.ContentDecodingError):
+        client.post("/count", json_data={})
+    assert post.call_count == 1  # not retried
+    assert breaker.state == CircuitBreaker.OPEN
+    assert client.stats()["failures"] == 1
+
+    clock.now = 20.0
+    post.side_effect = None
+    post.return_value.status_code = 200
+    client.post("/count", json_data={})
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_client_no_retry_past_deadline(upstream_server, mocker):
+    upstream_server.statuses.extend([503, 503, 503])
+    mocker.patch("mesi_search.upstream.random.uniform", return_value=5.0)
+    client = UpstreamClient(upstream_server.url, retries=2, backoff=10)
+    r = client.post("/count", json_data={}, deadline=time.monotonic() + 1)
+    assert r.status_code == 503
+    assert r.upstream_timing.attempts == 1 and r.upstream_timing.elapsed < 1
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+from flasgger.utils import validate
+from mesi_search import validation
+from mesi_search.validation import BodyValidator, is_discovery_query
+from werkzeug.exceptions import HTTPException
+
+BODIES = [
+    {"attributesOfInterest": ["gender", "causeOfDeath"]},
+    {"attributesOfInterest": []},
+    {"attributesOfInterest": "gender"},
+    {"attributesOfInterest": [1]},
+    {"attributesOfInterest": ["gender"], "extra": True},
+    {"other": 1},
+    [1],
+    "gender",
+]
+
+
+def flasgger_response(path, data):
+    """Status and body of the response of flasgger's validation, `None` if valid"""
+    from mesi_search.main import APP
+
+    with APP.test_request_context("/api/candig/patient", method="POST"):
+        try:
+            validate(data, filepath=os.path.join(validation.RESOURCES, path))
+        except HTTPException as e:
+            return e.response.status_code, e.response.get_data(as_text=True)
+    return None
+
+
+@pytest.mark.parametrize("data", BODIES)
+def test_same_errors_as_flasgger(data):
+    error = validation.DISCOVERY_QUERY.error(data)
+    expected = flasgger_response("discovery.yaml", data)
+    assert (error is None and expected is None) or expected == (400, str(error))
+
+
+@pytest.mark.parametrize("data", [{"queries": [{"attributesOfInterest": ["gender"]}]},
+                                  {"queries": []}, {"queries": [{}]}])
+def test_same_batch_errors_as_flasgger(data):
+    error = validation.DISCOVERY_BATCH_QUERY.error(data)
+    expected = flasgger_response("discovery_batch.yaml", data)
+    assert (error is None and expected is None) or expected == (400, str(error))
+
+
+@pytest.mark.parametrize("data", BODIES + [{"attributesOfInterest": [True]}, None])
+def test_fast_path_only_passes_valid_bodies(data):
+    if is_discovery_query(data):
+        assert BodyValidator("discovery.yaml").error(data) is None
+
+
+def test_invalid_bodies_rejected(app_client, auth_headers):
+    response = app_client.post("/api/candig/patient", headers=auth_headers,
+                               data='{"attributesOfInterest": "gender"}',
+                               content_type="application/json")
+    assert response.status_code == 400
+    assert response.get_data(as_text=True).startswith("'gender' is not of type 'array'")
+    response = app_client.post("/api/candig/patient", headers=auth_headers, data="{}",
+                               content_type="application/json")
+    assert (response.status_code, response.data) == (400, b"No data to validate")